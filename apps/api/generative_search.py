@@ -1,29 +1,37 @@
 
 import os
+import json
+import uuid
+import atexit
 import logging
-from hashlib import blake2b
-from flask import jsonify, request, session, Blueprint
+from pathlib import Path
+from flask import jsonify, request, session, Blueprint, Response, stream_with_context
 from flask_cors import cross_origin
 
-from langchain.storage import LocalFileStore
-from langchain.embeddings import CacheBackedEmbeddings
 from langchain_google_genai.chat_models import ChatGoogleGenerativeAI
-from langchain_google_genai.embeddings import GoogleGenerativeAIEmbeddings
 
 from apps.core.utils import api_key_required
+from apps.core.metrics import metrics
+from apps.core.cache.embedding_store import PackedEmbeddingStore, cache_backed_embeddings
+from apps.core.query_normalization import query_cache_key
 from apps.ecodome.generative_search.generative_search import split_webpage, create_or_get_vectorstore, generative_search, get_generative_search_chain
+from apps.ecodome.generative_search.engine import GenSearchEngine
+from apps.ecodome.generative_search.embeddings import EmbeddingBatcher, create_embeddings
+from apps.ecodome.generative_search.models import SearchRequest, ChatRequest
 
 gen_search_bp = Blueprint("gen_search", __name__)
 
-embedding_store_path = os.path.join("./.runtime", os.getenv("EMBEDDING_CACHE_STORE", "embed_cache"))
-embedding_cache_store = LocalFileStore(embedding_store_path)
+embedding_store_path = os.path.join("./.runtime", os.getenv("EMBEDDING_CACHE_STORE", "embed_store"))
+embedding_cache_store = PackedEmbeddingStore(embedding_store_path)
 
-embedding_model = GoogleGenerativeAIEmbeddings(
-    google_api_key=os.getenv('GOOGLE_GEN_AI_API_KEY', ''),
-    model="models/embedding-001",
-)
-cache_embedder = CacheBackedEmbeddings.from_bytes_store(
-    embedding_model, embedding_cache_store, namespace=embedding_model.model,
+# "google" (hosted) by default; "hashing" or "sentence-transformers" embed locally on CPU
+embedding_backend = os.getenv("EMBEDDING_BACKEND", "google")
+embedding_model = create_embeddings(embedding_backend)
+if embedding_backend == "google":
+    # coalesce the embedding calls of concurrent requests into batched provider calls
+    embedding_model = EmbeddingBatcher(embedding_model)
+cache_embedder = cache_backed_embeddings(
+    embedding_model, embedding_cache_store, namespace=getattr(embedding_model, "model", embedding_backend),
 )
 
 chat_model = ChatGoogleGenerativeAI(
@@ -31,6 +39,33 @@ chat_model = ChatGoogleGenerativeAI(
     model="gemini-pro",
 )
 
+_search_engine = None
+
+def get_search_engine() -> GenSearchEngine:
+    """ Lazily create the generative search engine shared by this worker """
+    global _search_engine
+    if _search_engine is None:
+        _search_engine = GenSearchEngine(
+            llm=chat_model,
+            embedding_model=cache_embedder,
+            vector_store_path=Path("./.runtime/gensearch/vector_stores"),
+            result_cache_path=Path("./.runtime/gensearch/result_cache"),
+        )
+        atexit.register(_search_engine.close)
+    return _search_engine
+
+def event_stream(events):
+    """ Serialize engine events as Server-Sent Events """
+    for event in events:
+        yield f"event: {event['event']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+
+def sse_response(events) -> Response:
+    return Response(
+        stream_with_context(event_stream(events)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @gen_search_bp.post('/gensearch')
 @cross_origin()
 @api_key_required(required_role='user')
@@ -39,8 +74,21 @@ def generative_search_api():
         data = request.json
         search_term = data.get('search_term') 
         image_url = data.get('image_url', None)
+
+        if data.get('stream', False):
+            search_request = SearchRequest(
+                search_term=search_term,
+                image_url=image_url,
+                stream=True,
+                knowledge_sources=data.get('knowledge_sources', ['web']),
+                filters=data.get('filters', {}),
+            )
+            result_id = str(uuid.uuid4())
+            # same shape as the non-streamed search, so /ingest_docs and /genchat can tell it has no webpage yet
+            session['gen_ai_context'] = {'result_id': result_id, 'webpage_url': None, 'subject': search_term}
+            return sse_response(get_search_engine().search_stream(search_request, result_id=result_id))
         
-        gen_ai_result_id = blake2b(search_term.encode()).hexdigest()[:64]
+        gen_ai_result_id = query_cache_key(search_term, image_url)
         result, webpage_url = generative_search(
             llm=chat_model,
             image_url=image_url,
@@ -68,17 +116,17 @@ def ingest_docs():
 
         gen_ai_context = session.get('gen_ai_context')
         if gen_ai_context:
-            result_id = gen_ai_context['result_id']
-            webpage_url = gen_ai_context['webpage_url']
+            result_id = gen_ai_context.get('result_id')
+            webpage_url = gen_ai_context.get('webpage_url')
             if webpage_url:
                 # ingest the webpage
-                docs = split_webpage(embedding_model=cache_embedder, webpage_url=webpage_url)
+                docs = split_webpage(webpage_url=webpage_url)
                 db = create_or_get_vectorstore(
                     docs=docs,
                     gen_ai_result_id=result_id,
                     embedding_model=cache_embedder,
                 )
-                session['gen_ai_context'] = {'db': db}
+                session['gen_ai_context'] = {**gen_ai_context, 'db': db}
 
                 return jsonify({"message": f"Created a vector db from the webpage {webpage_url}", "result_id": result_id}), 202
             return jsonify({"error":"No webpage url found to vectorize"}), 400
@@ -93,10 +141,25 @@ def gen_chat():
         data = request.json
         query = data.get('query', '')
 
+        if data.get('stream', False):
+            gen_ai_context = session.get('gen_ai_context') or {}
+            result_id = data.get('result_id') or gen_ai_context.get('result_id')
+            if not result_id:
+                return jsonify({"error": "No search to follow up on. Run `/gensearch` first"}), 400
+            chat_request = ChatRequest(
+                query=query,
+                result_id=result_id,
+                search_term=gen_ai_context.get('subject', ''),
+                stream=True,
+            )
+            return sse_response(get_search_engine().chat_stream(chat_request))
+
         gen_ai_context = session.get('gen_ai_context')
         if gen_ai_context:
-            result_id = gen_ai_context['result_id']
-            db = gen_ai_context['db']
+            result_id = gen_ai_context.get('result_id')
+            db = gen_ai_context.get('db')
+            if db is None:
+                return jsonify({"error": "No vector db for this search. Run `/ingest_docs` first"}), 400
             rag_chain = get_generative_search_chain(
                 db=db,
                 embedding_model=cache_embedder,
@@ -108,4 +171,38 @@ def gen_chat():
             return jsonify({ "result": result, "result_id": result_id }), 200
         return jsonify({"error": "Error occured while generating followup responses. Run `/ingest_docs` first"}), 500
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+@gen_search_bp.post('/gensearch/batch')
+@cross_origin()
+@api_key_required(required_role='admin')
+def generative_search_batch():
+    try:
+        data = request.json
+        search_requests = [
+            SearchRequest(
+                search_term=item['search_term'],
+                image_url=item.get('image_url', None),
+                knowledge_sources=item.get('knowledge_sources', ['web']),
+                filters=item.get('filters', {}),
+                user_id=item.get('user_id', 'anonymous'),
+            )
+            for item in data.get('requests', [])
+        ]
+        if not search_requests:
+            return jsonify({"error": "No search requests provided"}), 400
+
+        results = get_search_engine().search_many(
+            search_requests,
+            max_llm_concurrency=int(data.get('max_llm_concurrency', 4)),
+        )
+        return jsonify({"results": results}), 200
+    except Exception as e:
+        return jsonify({"error": f"Error occured : {e}"}), 500
+
+@gen_search_bp.get("/gensearch/metrics")
+@api_key_required(required_role='admin')
+def gen_search_metrics():
+    if request.args.get('format') == 'json':
+        return jsonify(metrics.export()), 200
+    return Response(metrics.to_prometheus(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,338 @@
+import os
+import mmap
+import zlib
+import fcntl
+import struct
+import logging
+import threading
+from hashlib import blake2b
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import EncoderBackedStore
+from langchain_core.stores import ByteStore
+
+logger = logging.getLogger(__name__)
+
+# record header: crc32 of key + value, key length, value length (or _TOMBSTONE)
+_HEADER = struct.Struct("<IHI")
+_TOMBSTONE = 0xFFFFFFFF
+
+
+def encode_embedding(vector: List[float]) -> bytes:
+    """Little-endian float32 bytes of an embedding (a quarter of the JSON size)"""
+    return np.asarray(vector, dtype="<f4").tobytes()
+
+
+def decode_embedding(data: bytes) -> List[float]:
+    return np.frombuffer(data, dtype="<f4").tolist()
+
+
+def cache_backed_embeddings(embedding_model, store: ByteStore, namespace: str = "") -> CacheBackedEmbeddings:
+    """Wrap `embedding_model` so document embeddings are cached in `store` as float32 bytes"""
+    def key_encoder(text: str) -> str:
+        return namespace + blake2b(text.encode("utf-8"), digest_size=20).hexdigest()
+
+    return CacheBackedEmbeddings(
+        embedding_model,
+        EncoderBackedStore(store, key_encoder, encode_embedding, decode_embedding),
+    )
+
+
+class PackedEmbeddingStore(ByteStore):
+    """
+    Append-only, memory-mapped `ByteStore` for embedding caches.
+
+    Values are appended as records to segment files of about `segment_bytes`,
+    so millions of entries take a few hundred files instead of one file each.
+    An in-memory index maps keys to their record, and reads are slices of a
+    read-only mmap of the segment, so a hit costs no system calls.
+
+    Several processes can share a store: appends, compaction and eviction are
+    serialized with an flock, and every record carries a CRC so a reader never
+    indexes a record that is still being written. A process that misses a key
+    picks up the records others appended since it last looked. Compaction and
+    eviction bump a generation number, which makes the other processes rebuild
+    their index on their next miss; until then they keep serving hits (and
+    keys another process deleted) from their existing mappings.
+
+    A background thread periodically compacts sealed segments that are mostly
+    dead records (overwritten or deleted keys), then evicts the oldest
+    segments while the store is over `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        segment_bytes: int = 64 * 1024 * 1024,
+        max_bytes: int = 4 * 1024 * 1024 * 1024,
+        compact_ratio: float = 0.5,
+        maintenance_interval: float = 300.0
+    ):
+        self.root = Path(root)
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.compact_ratio = compact_ratio
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        # key -> (segment, value offset, value length or -1 for a deleted key)
+        self._index: Dict[str, Tuple[int, int, int]] = {}
+        self._scanned: Dict[int, int] = {}
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._generation: Optional[int] = None
+        self._lock = threading.RLock()
+        self._lock_path = self.root / "LOCK"
+        self._generation_path = self.root / "GENERATION"
+
+        self._refresh()
+
+        self.maintenance_interval = maintenance_interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._maintain_periodically, name="embedding-store-maintenance", daemon=True)
+        self.thread.start()
+
+    def mget(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        with self._lock:
+            values = [self._read(key) for key in keys]
+            if any(value is None for value in values):
+                # other processes may have appended the missing keys
+                self._refresh()
+                values = [value if value is not None else self._read(key) for key, value in zip(keys, values)]
+            return values
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, bytes]]) -> None:
+        if key_value_pairs:
+            with self._exclusive():
+                self._append([(key.encode("utf-8"), value) for key, value in key_value_pairs])
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        if keys:
+            with self._exclusive():
+                self._append([(key.encode("utf-8"), None) for key in keys])
+
+    def yield_keys(self, prefix: Optional[str] = None) -> Iterator[str]:
+        with self._lock:
+            self._refresh()
+            keys = [key for key, (_, _, length) in self._index.items() if length >= 0]
+        for key in keys:
+            if prefix is None or key.startswith(prefix):
+                yield key
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(1 for _, _, length in self._index.values() if length >= 0)
+
+    def size(self) -> int:
+        """Total bytes on disk"""
+        return sum(self._segment_size(segment) for segment in self._segments())
+
+    def _read(self, key: str) -> Optional[bytes]:
+        entry = self._index.get(key)
+        if entry is None or entry[2] < 0:
+            return None
+        segment, offset, length = entry
+        # a copy, not a memoryview: ByteStore values are bytes, and a view still
+        # held by a caller would make closing the mapping on a remap or a
+        # compaction fail with BufferError
+        return self._maps[segment][offset:offset + length]
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.root / f"{segment:08d}.seg"
+
+    def _segments(self) -> List[int]:
+        return sorted(int(name[:-4]) for name in os.listdir(self.root) if name.endswith(".seg"))
+
+    def _segment_size(self, segment: int) -> int:
+        try:
+            return self._segment_path(segment).stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold both the in-process and the cross-process lock"""
+        with self._lock, open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_generation(self) -> int:
+        try:
+            return int(self._generation_path.read_text() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _bump_generation(self) -> None:
+        tmp_path = self._generation_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(str(self._read_generation() + 1))
+        os.replace(tmp_path, self._generation_path)
+
+    def _refresh(self) -> None:
+        """Index the records appended since the last refresh, or rebuild after a compaction"""
+        with self._lock:
+            generation = self._read_generation()
+            if generation != self._generation:
+                for mapped in self._maps.values():
+                    mapped.close()
+                self._index.clear()
+                self._scanned.clear()
+                self._maps.clear()
+                self._generation = generation
+
+            for segment in self._segments():
+                size = self._segment_size(segment)
+                if size > self._scanned.get(segment, 0):
+                    self._scan(segment, size)
+
+    def _map(self, segment: int, size: int) -> Optional[mmap.mmap]:
+        mapped = self._maps.get(segment)
+        if mapped is not None and len(mapped) >= size:
+            return mapped
+        try:
+            with open(self._segment_path(segment), "rb") as f:
+                remapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+        if mapped is not None:
+            mapped.close()
+        self._maps[segment] = remapped
+        return remapped
+
+    def _scan(self, segment: int, size: int) -> None:
+        mapped = self._map(segment, size)
+        if mapped is None:
+            return
+        size = min(size, len(mapped))
+        position = self._scanned.get(segment, 0)
+        while position + _HEADER.size <= size:
+            crc, key_length, value_length = _HEADER.unpack_from(mapped, position)
+            start = position + _HEADER.size
+            end = start + key_length + (0 if value_length == _TOMBSTONE else value_length)
+            # stop at a record that is incomplete (still being written, or torn by a crash)
+            if end > size or zlib.crc32(mapped[start:end]) != crc:
+                break
+            key = mapped[start:start + key_length].decode("utf-8")
+            if value_length == _TOMBSTONE:
+                self._index[key] = (segment, end, -1)
+            else:
+                self._index[key] = (segment, start + key_length, value_length)
+            position = end
+        self._scanned[segment] = position
+
+    @staticmethod
+    def _record(key: bytes, value: Optional[bytes]) -> bytes:
+        body = key + (value or b"")
+        value_length = _TOMBSTONE if value is None else len(value)
+        return _HEADER.pack(zlib.crc32(body), len(key), value_length) + body
+
+    def _append(self, records: List[Tuple[bytes, Optional[bytes]]]) -> None:
+        """Append records to the newest segment, starting new ones as they fill up; needs `_exclusive`"""
+        self._refresh()
+        segments = self._segments()
+        segment = segments[-1] if segments else 1
+
+        # nobody else is writing, so anything past the last complete record is a torn write
+        scanned = self._scanned.get(segment, 0)
+        if self._segment_size(segment) > scanned:
+            logger.warning(f"Truncating torn write at {scanned} in embedding store segment {segment}")
+            os.truncate(self._segment_path(segment), scanned)
+            mapped = self._maps.pop(segment, None)
+            if mapped is not None:
+                mapped.close()
+            self._map(segment, scanned)
+
+        blob = bytearray()
+        size = scanned
+        for key, value in records:
+            record = self._record(key, value)
+            if size + len(blob) and size + len(blob) + len(record) > self.segment_bytes:
+                self._write(segment, blob)
+                segment += 1
+                blob = bytearray()
+                size = 0
+            blob += record
+        self._write(segment, blob)
+
+    def _write(self, segment: int, blob: bytearray) -> None:
+        if not blob:
+            return
+        start = self._segment_size(segment)
+        with open(self._segment_path(segment), "ab") as f:
+            f.write(blob)
+        self._scanned.setdefault(segment, start)
+        self._scan(segment, start + len(blob))
+
+    def compact(self) -> int:
+        """Rewrite the live records of mostly-dead sealed segments into the newest one; returns segments removed"""
+        with self._exclusive():
+            self._refresh()
+            segments = self._segments()
+            if len(segments) < 2:
+                return 0
+
+            live: Dict[int, List[str]] = {segment: [] for segment in segments}
+            live_bytes: Dict[int, int] = dict.fromkeys(segments, 0)
+            for key, (segment, _, length) in self._index.items():
+                live[segment].append(key)
+                live_bytes[segment] += _HEADER.size + len(key.encode("utf-8")) + max(length, 0)
+
+            compacted = [
+                segment for segment in segments[:-1]
+                if live_bytes[segment] < (1 - self.compact_ratio) * self._segment_size(segment)
+            ]
+            for segment in compacted:
+                # deletions only matter while an older segment could still hold the key
+                keep_deleted = segment != segments[0]
+                records = []
+                for key in live[segment]:
+                    value = self._read(key)
+                    if value is not None or keep_deleted:
+                        records.append((key.encode("utf-8"), value))
+                self._append(records)
+
+            for segment in compacted:
+                self._segment_path(segment).unlink()
+            if compacted:
+                self._bump_generation()
+                self._refresh()
+                logger.info(f"Compacted {len(compacted)} embedding store segments")
+            return len(compacted)
+
+    def evict(self) -> int:
+        """Drop the oldest segments while the store is over its byte budget; returns segments removed"""
+        with self._exclusive():
+            segments = self._segments()
+            total = sum(self._segment_size(segment) for segment in segments)
+            evicted = 0
+            for segment in segments[:-1]:
+                if total <= self.max_bytes:
+                    break
+                total -= self._segment_size(segment)
+                self._segment_path(segment).unlink()
+                evicted += 1
+            if evicted:
+                self._bump_generation()
+                self._refresh()
+                logger.info(f"Evicted {evicted} embedding store segments")
+            return evicted
+
+    def _maintain_periodically(self) -> None:
+        while not self.stop_event.wait(timeout=self.maintenance_interval):
+            try:
+                self.compact()
+                self.evict()
+            except Exception as e:
+                logger.warning(f"Error during embedding store maintenance: {e}")
+
+    def close(self) -> None:
+        self.stop_event.set()
+        self.thread.join()
+        with self._lock:
+            for mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import IO, Any, Dict, NamedTuple, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+class CachedPage(NamedTuple):
+    url: str
+    content_hash: str
+    final_url: str
+    encoding: Optional[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    validated_at: float
+    truncated: bool = False
+
+
+class PageCache:
+    """
+    Content-addressed on-disk cache of fetched web pages.
+
+    Bodies are stored once per content hash under `blobs/`, next to whatever
+    was derived from them (extracted documents, chunks), so pages that change
+    URL or are served by several URLs are extracted and chunked only once.
+    A SQLite index maps each URL to its current content hash and the
+    ETag/Last-Modified validators for conditional revalidation.
+
+    A background thread keeps the blobs within `max_bytes`, dropping the
+    least recently used content and any content no URL refers to any more.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = 1024 * 1024 * 1024, eviction_interval: float = 300.0):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.blob_root = self.root / "blobs"
+        self.blob_root.mkdir(parents=True, exist_ok=True)
+        self.spool_root = self.root / "spool"
+        self.spool_root.mkdir(exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.root / "index.sqlite"), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, content_hash TEXT NOT NULL, final_url TEXT NOT NULL, encoding TEXT, "
+            "etag TEXT, last_modified TEXT, truncated INTEGER NOT NULL, validated_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS blobs (content_hash TEXT PRIMARY KEY, size INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS pages_content_hash ON pages (content_hash)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)")
+        self._db.commit()
+
+        self.eviction_interval = eviction_interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._evict_periodically, name="page-cache-eviction", daemon=True)
+        self.thread.start()
+
+    def _blob_dir(self, content_hash: str) -> Path:
+        return self.blob_root / content_hash[:2]
+
+    def _body_path(self, content_hash: str) -> Path:
+        return self._blob_dir(content_hash) / f"{content_hash}.body"
+
+    def _artifact_path(self, content_hash: str, kind: str) -> Path:
+        return self._blob_dir(content_hash) / f"{content_hash}.{kind}.json"
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes) -> None:
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def lookup(self, url: str) -> Optional[CachedPage]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT content_hash, final_url, encoding, etag, last_modified, validated_at, truncated FROM pages WHERE url = ?",
+                (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (time.time(), url))
+            self._db.commit()
+        content_hash, final_url, encoding, etag, last_modified, validated_at, truncated = row
+        return CachedPage(url, content_hash, final_url, encoding, etag, last_modified, validated_at, bool(truncated))
+
+    def read_body(self, content_hash: str) -> Optional[bytes]:
+        try:
+            return self._body_path(content_hash).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def open_body(self, content_hash: str) -> Optional[IO[bytes]]:
+        """The stored body as an open file, to read it in chunks"""
+        try:
+            return open(self._body_path(content_hash), "rb")
+        except FileNotFoundError:
+            return None
+
+    def has_body(self, content_hash: str) -> bool:
+        return self._body_path(content_hash).exists()
+
+    def spool(self) -> IO[bytes]:
+        """A temporary file to stream a body into before it is `store`d"""
+        return tempfile.NamedTemporaryFile(dir=self.spool_root, suffix=".tmp", delete=False)
+
+    def store(
+        self,
+        url: str,
+        content_hash: str,
+        content: Union[bytes, Path],
+        final_url: str,
+        encoding: Optional[str],
+        headers: Dict[str, str],
+        truncated: bool = False
+    ) -> CachedPage:
+        """
+        Record the body fetched for `url`, given as bytes or as a spooled file
+        (which is moved into place); content already stored isn't written again.
+        """
+        body_path = self._body_path(content_hash)
+        if isinstance(content, Path):
+            size = content.stat().st_size
+            if body_path.exists():
+                content.unlink()
+            else:
+                body_path.parent.mkdir(exist_ok=True)
+                os.replace(content, body_path)
+        else:
+            size = len(content)
+            if not body_path.exists():
+                self._write_atomic(body_path, content)
+
+        now = time.time()
+        page = CachedPage(
+            url, content_hash, final_url, encoding,
+            headers.get("ETag"), headers.get("Last-Modified"), now, truncated
+        )
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO blobs (content_hash, size) VALUES (?, ?)", (content_hash, size)
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages "
+                "(url, content_hash, final_url, encoding, etag, last_modified, truncated, validated_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, content_hash, final_url, encoding, page.etag, page.last_modified, int(truncated), now, now)
+            )
+            self._db.commit()
+        return page
+
+    def revalidated(self, page: CachedPage, headers: Dict[str, str]) -> CachedPage:
+        """Mark a cached page as still current after a 304, keeping any validators the server updated"""
+        page = page._replace(
+            etag=headers.get("ETag", page.etag),
+            last_modified=headers.get("Last-Modified", page.last_modified),
+            validated_at=time.time(),
+        )
+        with self._lock:
+            self._db.execute(
+                "UPDATE pages SET etag = ?, last_modified = ?, validated_at = ? WHERE url = ?",
+                (page.etag, page.last_modified, page.validated_at, page.url)
+            )
+            self._db.commit()
+        return page
+
+    def get_artifact(self, content_hash: str, kind: str) -> Optional[Any]:
+        """Something derived from a body (e.g. its extracted documents), or None"""
+        try:
+            return json.loads(self._artifact_path(content_hash, kind).read_bytes())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Error reading page cache artifact {content_hash}.{kind}: {e}")
+            return None
+
+    def set_artifact(self, content_hash: str, kind: str, value: Any) -> None:
+        """
+        Store something derived from a cached body; without a stored body
+        (e.g. a `no-store` page) it is skipped, since eviction couldn't account for it.
+        """
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM blobs WHERE content_hash = ?", (content_hash,)).fetchone() is None:
+                return
+        data = json.dumps(value, default=str).encode("utf-8")
+        path = self._artifact_path(content_hash, kind)
+        self._write_atomic(path, data)
+        with self._lock:
+            updated = self._db.execute(
+                "UPDATE blobs SET size = size + ? WHERE content_hash = ?", (len(data), content_hash)
+            ).rowcount
+            self._db.commit()
+        if not updated:
+            # the body was evicted while this was being written
+            path.unlink(missing_ok=True)
+
+    def delete(self, url: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM pages WHERE url = ?", (url,))
+            self._db.commit()
+
+    def evict(self) -> int:
+        """Drop the least recently used content until the byte budget is met, and content no url refers to; returns blobs removed"""
+        with self._lock:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total > self.max_bytes:
+                # content is shared between urls, so drop it with every url that serves it
+                dropped = []
+                for content_hash, size in self._db.execute(
+                    "SELECT blobs.content_hash, blobs.size FROM blobs JOIN pages ON pages.content_hash = blobs.content_hash "
+                    "GROUP BY blobs.content_hash ORDER BY MAX(pages.accessed_at)"
+                ):
+                    if total <= self.max_bytes:
+                        break
+                    dropped.append(content_hash)
+                    total -= size
+                self._db.executemany("DELETE FROM pages WHERE content_hash = ?", [(content_hash,) for content_hash in dropped])
+
+            orphans = [row[0] for row in self._db.execute(
+                "SELECT content_hash FROM blobs WHERE content_hash NOT IN (SELECT content_hash FROM pages)"
+            )]
+            self._db.executemany("DELETE FROM blobs WHERE content_hash = ?", [(content_hash,) for content_hash in orphans])
+            self._db.commit()
+
+        for content_hash in orphans:
+            for path in self._blob_dir(content_hash).glob(f"{content_hash}.*"):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+        return len(orphans)
+
+    def _evict_periodically(self) -> None:
+        while not self.stop_event.wait(timeout=self.eviction_interval):
+            try:
+                evicted = self.evict()
+                if evicted:
+                    logger.info(f"Page cache eviction removed {evicted} pages")
+            except Exception as e:
+                logger.warning(f"Error during page cache eviction: {e}")
+
+    def close(self) -> None:
+        self.stop_event.set()
+        self.thread.join()
+        with self._lock:
+            self._db.close()
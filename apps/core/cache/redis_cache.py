@@ -1,6 +1,12 @@
 import os
+import json
+import inspect
+import logging
 from redis import StrictRedis
 from functools import wraps
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
 
 redis_client = StrictRedis(
     host=os.getenv('REDIS_CACHE_HOST', 'localhost'),
@@ -14,20 +20,42 @@ def generate_cache_key(func, *args, **kwargs):
     kwargs_str = ','.join([f"{key}={value}" for key, value in sorted(kwargs.items())])
     return f"{func.__name__}:{args_str}:{kwargs_str}"
 
-def redis_cache(ttl=3600):
+def redis_cache(ttl=3600, key_normalizers: Optional[Dict[str, Callable]] = None):
+    """
+    Cache a function's JSON-serializable results in Redis.
+
+    `key_normalizers` maps argument names to functions applied to those
+    arguments when building the cache key (e.g. `{"query": normalize_query}`),
+    so equivalent arguments share an entry; the function itself still gets the
+    original arguments. None results are not cached.
+    """
     def decorator(func):
+        signature = inspect.signature(func)
+
+        def cache_key(args, kwargs):
+            if not key_normalizers:
+                return generate_cache_key(func, *args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            for name, normalize in key_normalizers.items():
+                if name in bound.arguments:
+                    bound.arguments[name] = normalize(bound.arguments[name])
+            return generate_cache_key(func, *bound.args, **bound.kwargs)
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            cache_key = generate_cache_key(func, *args, **kwargs)
-            cached_result = redis_client.get(cache_key)
+            key = cache_key(args, kwargs)
+            cached_result = redis_client.get(key)
 
             if cached_result:
-                return cached_result.decode('utf-8')
-            else:
-                result = func(*args, **kwargs)
-                redis_client.setex(cache_key, ttl, result)
-                return result
+                try:
+                    return json.loads(cached_result)
+                except ValueError:
+                    logger.warning(f"Ignoring unreadable cache entry {key}")
+
+            result = func(*args, **kwargs)
+            if result is not None:
+                redis_client.setex(key, ttl, json.dumps(result))
+            return result
             
         return wrapper
     return decorator
-
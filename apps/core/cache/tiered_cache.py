@@ -0,0 +1,246 @@
+import os
+import json
+import asyncio
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from hashlib import blake2b
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """In-process LRU cache bounded by entry count and approximate byte size"""
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, _, expires_at = entry
+            if expires_at <= time.time():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, size: int, expires_at: float) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (value, size, expires_at)
+            self._size += size
+            while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+                self._pop(next(iter(self._entries)))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+
+    def evict_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (_, _, expires_at) in self._entries.items() if expires_at <= now]
+            for key in expired:
+                self._pop(key)
+        return len(expired)
+
+    def _pop(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCache:
+    """
+    Sharded on-disk cache.
+
+    Values are JSON files spread over 256 shard directories. Expiry, size and
+    last access live in a small SQLite index, so a probe never has to stat or
+    parse an expired file and eviction never has to walk the tree.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = 512 * 1024 * 1024):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.root / "index.sqlite"), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+        self._db.commit()
+
+    def _path(self, key: str) -> Path:
+        digest = blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+        return self.root / digest[:2] / f"{digest}.json"
+
+    def get(self, key: str) -> Optional[Tuple[Any, int, float]]:
+        """Return (value, size, expires_at) or None"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT expires_at, size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or row[0] <= now:
+                return None
+            self._db.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+
+        try:
+            with open(self._path(key), "r") as f:
+                return json.load(f), row[1], row[0]
+        except FileNotFoundError:
+            self.delete(key)
+            return None
+        except Exception as e:
+            logger.warning(f"Error reading disk cache entry: {e}")
+            return None
+
+    def set(self, key: str, payload: str, expires_at: float) -> None:
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, expires_at, size, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, expires_at, len(payload), time.time())
+            )
+            self._db.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._db.commit()
+        self._unlink(key)
+
+    def _unlink(self, key: str) -> None:
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def evict(self) -> int:
+        """Drop expired entries, then least recently used ones until the byte budget is met"""
+        with self._lock:
+            keys = [row[0] for row in self._db.execute("SELECT key FROM entries WHERE expires_at <= ?", (time.time(),))]
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+            if total > self.max_bytes:
+                for key, size in self._db.execute(
+                    "SELECT key, size FROM entries WHERE expires_at > ? ORDER BY accessed_at", (time.time(),)
+                ):
+                    if total <= self.max_bytes:
+                        break
+                    keys.append(key)
+                    total -= size
+            self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in keys])
+            self._db.commit()
+
+        for key in keys:
+            self._unlink(key)
+        return len(keys)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class TieredCache:
+    """
+    Two-tier TTL cache: an in-process LRU in front of a sharded disk cache.
+
+    A background thread periodically evicts expired entries from both tiers and
+    keeps the disk tier within its byte budget.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        ttl: int = 3600,
+        memory_entries: int = 1024,
+        memory_bytes: int = 64 * 1024 * 1024,
+        disk_bytes: int = 512 * 1024 * 1024,
+        eviction_interval: float = 60.0
+    ):
+        self.ttl = ttl
+        self.memory = LRUCache(max_entries=memory_entries, max_bytes=memory_bytes)
+        self.disk = DiskCache(root, max_bytes=disk_bytes)
+
+        self.eviction_interval = eviction_interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._evict_periodically, name="tiered-cache-eviction", daemon=True)
+        self.thread.start()
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+
+        entry = self.disk.get(key)
+        if entry is None:
+            return None
+        value, size, expires_at = entry
+        self.memory.set(key, value, size, expires_at)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        expires_at = time.time() + (ttl if ttl is not None else self.ttl)
+        payload = json.dumps(value, default=str)
+        self.memory.set(key, value, len(payload), expires_at)
+        self.disk.set(key, payload, expires_at)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """Async `get`; memory hits return immediately, the disk tier runs in a worker thread"""
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        await asyncio.to_thread(self.set, key, value, ttl)
+
+    def delete(self, key: str) -> None:
+        self.memory.delete(key)
+        self.disk.delete(key)
+
+    def evict(self) -> None:
+        memory_evicted = self.memory.evict_expired()
+        disk_evicted = self.disk.evict()
+        if memory_evicted or disk_evicted:
+            logger.info(f"Cache eviction removed {memory_evicted} memory and {disk_evicted} disk entries")
+
+    def _evict_periodically(self) -> None:
+        while not self.stop_event.wait(timeout=self.eviction_interval):
+            try:
+                self.evict()
+            except Exception as e:
+                logger.warning(f"Error during cache eviction: {e}")
+
+    def close(self) -> None:
+        self.stop_event.set()
+        self.thread.join()
+        self.disk.close()
@@ -0,0 +1,206 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# latency buckets in seconds, from sub-millisecond cache hits to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+class Counter:
+    """Monotonically increasing value"""
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    """Value that can go up and down"""
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Histogram:
+    """Cumulative-bucket histogram of observed values"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            cumulative = []
+            running = 0
+            for count in self.counts[:-1]:
+                running += count
+                cumulative.append(running)
+            return {
+                "count": self.count,
+                "sum": self.sum,
+                "buckets": dict(zip(self.buckets, cumulative)),
+            }
+
+
+class MetricsRegistry:
+    """Process-wide collection of labelled counters, gauges and histograms"""
+
+    def __init__(self):
+        self._counters: Dict[Tuple[str, LabelSet], Counter] = {}
+        self._gauges: Dict[Tuple[str, LabelSet], Gauge] = {}
+        self._histograms: Dict[Tuple[str, LabelSet], Histogram] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: Optional[Dict[str, str]]) -> Tuple[str, LabelSet]:
+        return name, tuple(sorted((labels or {}).items()))
+
+    def counter(self, name: str, labels: Optional[Dict[str, str]] = None) -> Counter:
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self._counters:
+                self._counters[key] = Counter()
+            return self._counters[key]
+
+    def gauge(self, name: str, labels: Optional[Dict[str, str]] = None) -> Gauge:
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self._gauges:
+                self._gauges[key] = Gauge()
+            return self._gauges[key]
+
+    def histogram(self, name: str, labels: Optional[Dict[str, str]] = None, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            return self._histograms[key]
+
+    def export(self) -> Dict[str, List[Dict[str, object]]]:
+        """JSON-serializable snapshot of every metric"""
+        with self._lock:
+            counters = list(self._counters.items())
+            gauges = list(self._gauges.items())
+            histograms = list(self._histograms.items())
+        return {
+            "counters": [{"name": name, "labels": dict(labels), "value": c.value} for (name, labels), c in counters],
+            "gauges": [{"name": name, "labels": dict(labels), "value": g.value} for (name, labels), g in gauges],
+            "histograms": [{"name": name, "labels": dict(labels), **h.snapshot()} for (name, labels), h in histograms],
+        }
+
+    def to_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        def fmt_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+
+        lines = []
+        for (name, labels), counter in counters:
+            lines.append(f"{name}{fmt_labels(labels)} {counter.value}")
+        for (name, labels), gauge in gauges:
+            lines.append(f"{name}{fmt_labels(labels)} {gauge.value}")
+        for (name, labels), histogram in histograms:
+            snapshot = histogram.snapshot()
+            for bound, count in snapshot["buckets"].items():
+                lines.append(f"{name}_bucket{fmt_labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{fmt_labels(labels, [('le', '+Inf')])} {snapshot['count']}")
+            lines.append(f"{name}_sum{fmt_labels(labels)} {snapshot['sum']}")
+            lines.append(f"{name}_count{fmt_labels(labels)} {snapshot['count']}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+_current_trace: ContextVar[Optional["RequestTrace"]] = ContextVar("request_trace", default=None)
+
+
+class RequestTrace:
+    """
+    Per-request stage timings and counters.
+
+    While active (used as a context manager) it is picked up by `timed` and
+    `count` anywhere in the call stack, including threads started with a copy
+    of the current context. Every observation is also fed to the registry
+    histograms/counters under `<namespace>_stage_seconds` and
+    `<namespace>_<counter>_total`.
+    """
+
+    def __init__(self, namespace: str, registry: MetricsRegistry = metrics):
+        self.namespace = namespace
+        self.registry = registry
+        self.timings: Dict[str, float] = {}
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._token = None
+
+    def __enter__(self) -> "RequestTrace":
+        self._token = _current_trace.set(self)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        _current_trace.reset(self._token)
+
+    def record(self, stage: str, elapsed: float) -> None:
+        with self._lock:
+            self.timings[stage] = self.timings.get(stage, 0.0) + elapsed
+        self.registry.histogram(f"{self.namespace}_stage_seconds", {"stage": stage}).observe(elapsed)
+
+    def count(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+        self.registry.counter(f"{self.namespace}_{name}_total").inc(amount)
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {"timings": dict(self.timings), "counters": dict(self.counters)}
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Time a block into the active request trace, if there is one"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.record(stage, time.perf_counter() - start)
+
+
+def count(name: str, amount: float = 1) -> None:
+    """Increment a counter on the active request trace, if there is one"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count(name, amount)
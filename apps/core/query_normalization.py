@@ -0,0 +1,61 @@
+import re
+import unicodedata
+from functools import lru_cache
+from hashlib import blake2b
+from typing import Optional
+
+# leading words that only mark a query as a question ("what is", "how do", ...)
+QUESTION_WORDS = frozenset((
+    "what", "whats", "how", "why", "when", "where", "which", "who", "whom", "whose",
+    "is", "are", "was", "were", "can", "could", "do", "does", "did", "should", "would", "will",
+))
+STOP_WORDS = frozenset((
+    "a", "an", "the", "of", "for", "in", "on", "at", "by", "with", "about",
+    "is", "are", "was", "were", "be", "been", "it", "its", "this", "that", "these", "those",
+    "i", "me", "my", "you", "your", "we", "our", "there", "some", "any", "please", "tell",
+))
+# words that make the order of the others matter ("better than", "from x to y", "not x but y");
+# "and"/"or" are kept too, since "paper or plastic" isn't the query "paper and plastic" is
+ORDER_SENSITIVE_WORDS = frozenset((
+    "and", "or", "than", "to", "from", "into", "before", "after", "over", "under", "not", "no", "without",
+    "but", "instead", "per", "then", "never", "dont", "doesnt", "isnt", "arent", "cant", "wont",
+))
+
+_APOSTROPHE_RE = re.compile(r"['’`]")
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+")
+
+
+@lru_cache(maxsize=4096)
+def normalize_query(query: Optional[str]) -> str:
+    """
+    Canonical form of a search query, for use in cache keys.
+
+    Unicode-normalizes (NFKC) and case-folds the query, drops punctuation,
+    leading question words (and a "to" after them) and stop words, and
+    collapses whitespace. Negations, comparison words and "and"/"or" are kept,
+    and the remaining words are sorted unless one of them makes their order
+    meaningful. A query made up only of stop
+    words keeps them rather than normalizing to nothing.
+    """
+    if not query:
+        return ""
+
+    text = unicodedata.normalize("NFKC", query).casefold()
+    text = _APOSTROPHE_RE.sub("", text)
+    words = _PUNCTUATION_RE.sub(" ", text).split()
+
+    start = 0
+    # a "to" left in front ("how to recycle glass") only marks an infinitive
+    while start < len(words) - 1 and (words[start] in QUESTION_WORDS or words[start] == "to"):
+        start += 1
+    words = [word for word in words[start:] if word not in STOP_WORDS] or words
+
+    if not ORDER_SENSITIVE_WORDS.intersection(words):
+        words = sorted(words)
+    return " ".join(words)
+
+
+def query_cache_key(query: Optional[str], *parts: Optional[str], digest_size: int = 32) -> str:
+    """Hex digest of the normalized query and any extra key parts (e.g. an image url)"""
+    key = "|".join([normalize_query(query), *(part or "" for part in parts)])
+    return blake2b(key.encode("utf-8"), digest_size=digest_size).hexdigest()
@@ -0,0 +1,369 @@
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+
+from apps.core.metrics import MetricsRegistry, metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+# gauge value per breaker state
+STATE_VALUES = {CLOSED: 0.0, HALF_OPEN: 0.5, OPEN: 1.0}
+
+
+class ShedError(Exception):
+    """A call was refused without being attempted"""
+
+
+class CircuitOpenError(ShedError):
+    pass
+
+
+class ConcurrencyLimitError(ShedError):
+    pass
+
+
+class DeadlineExceeded(TimeoutError):
+    """The caller's time budget ran out, which says nothing about the domain"""
+
+
+class LatencyTracker:
+    """Latencies of the last `window` successful calls"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percentile: float, min_samples: int = 20) -> Optional[float]:
+        """The given percentile (0-100), or None until there are `min_samples` samples"""
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures, so calls fail fast.
+
+    After `reset_timeout` seconds one probe call is let through (half-open);
+    its success closes the breaker again, its failure reopens it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def abandon_probe(self) -> None:
+        """The call `allow` let through was never made, so let another one probe"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that adapts to the downstream (AIMD).
+
+    Every success raises the limit by 1/limit, so about one slot per limit's
+    worth of calls; every failure halves it, down to `min_limit`.
+    """
+
+    def __init__(self, initial: int = 8, min_limit: int = 1, max_limit: int = 64):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(initial)
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.in_flight < int(self.limit), timeout=timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, success: Optional[bool]) -> None:
+        """Free a slot; a success or failure adapts the limit, None (no verdict) leaves it"""
+        with self._condition:
+            self.in_flight -= 1
+            if success:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            elif success is not None:
+                self.limit = max(self.min_limit, self.limit / 2)
+            self._condition.notify_all()
+
+
+class _Domain:
+    """Breaker, limiter, latencies and metrics of one downstream domain"""
+
+    def __init__(self, name: str, resilience: "Resilience"):
+        self.name = name
+        self.breaker = CircuitBreaker(resilience.failure_threshold, resilience.reset_timeout)
+        self.limiter = AdaptiveLimiter(resilience.initial_limit, resilience.min_limit, resilience.max_limit)
+        self.latencies = LatencyTracker()
+        self.calls = 0
+        self.hedges = 0
+
+        registry = resilience.registry
+        labels = {"domain": name}
+        self.latency_histogram = registry.histogram("resilience_latency_seconds", labels)
+        self.hedges_total = registry.counter("resilience_hedges_total", labels)
+        self.hedge_wins_total = registry.counter("resilience_hedge_wins_total", labels)
+        self.circuit_state = registry.gauge("resilience_circuit_state", labels)
+        self.concurrency_limit = registry.gauge("resilience_concurrency_limit", labels)
+        self.in_flight = registry.gauge("resilience_in_flight", labels)
+        self._outcomes = {
+            outcome: registry.counter("resilience_calls_total", {**labels, "outcome": outcome})
+            for outcome in ("success", "failure", "timeout", "deadline", "shed_open", "shed_limit")
+        }
+
+    def record(self, outcome: str) -> None:
+        self._outcomes[outcome].inc()
+        self.circuit_state.set(STATE_VALUES[self.breaker.state])
+        self.concurrency_limit.set(self.limiter.limit)
+        self.in_flight.set(self.limiter.in_flight)
+
+
+class Resilience:
+    """
+    Resilience layer for calls to external hosts, keyed by domain.
+
+    `call` runs a blocking function under a per-domain circuit breaker (which
+    sheds calls to a domain that keeps failing or timing out) and adaptive
+    concurrency limit. If the first attempt hasn't finished after the domain's
+    `hedge_percentile` latency, a duplicate is sent and the first result to
+    arrive wins; hedges are capped at `hedge_budget` of the domain's calls.
+    Only hedge idempotent calls. State is exported through `metrics` with a
+    `domain` label (`resilience_*`).
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        initial_limit: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        hedge_percentile: float = 95.0,
+        hedge_budget: float = 0.1,
+        max_workers: int = 64,
+        registry: MetricsRegistry = metrics
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self.registry = registry
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="resilience")
+        self._domains: Dict[str, _Domain] = {}
+        self._lock = threading.Lock()
+
+    def domain(self, name: str) -> _Domain:
+        with self._lock:
+            state = self._domains.get(name)
+            if state is None:
+                state = self._domains[name] = _Domain(name, self)
+            return state
+
+    def call(
+        self,
+        domain: str,
+        fn: Callable[..., Any],
+        *args,
+        timeout: Optional[float] = None,
+        deadline: Optional[float] = None,
+        hedge: bool = True,
+        is_failure: Callable[[Exception], bool] = lambda e: True,
+        **kwargs
+    ) -> Any:
+        """
+        Call `fn(*args, **kwargs)` for `domain`, raising ShedError if it is
+        refused, TimeoutError after `timeout` seconds, or whatever `fn` raised.
+        Errors for which `is_failure` is False (e.g. a 404) don't count against
+        the domain.
+
+        `timeout` is the domain's own time limit; `deadline` (a time.monotonic()
+        value) is the caller's budget. Running out of the caller's budget
+        raises DeadlineExceeded and isn't held against the domain: only
+        timeouts that took the domain's full `timeout` are failures.
+        """
+        state = self.domain(domain)
+        if not state.breaker.allow():
+            state.record("shed_open")
+            raise CircuitOpenError(f"Circuit open for {domain}")
+        start = time.monotonic()
+        end = None if timeout is None else start + timeout
+        if deadline is not None:
+            end = deadline if end is None else min(end, deadline)
+        if not state.limiter.acquire(timeout=None if end is None else max(0.0, end - start)):
+            state.breaker.abandon_probe()
+            state.record("shed_limit")
+            raise ConcurrencyLimitError(f"Concurrency limit reached for {domain}")
+
+        success = False
+        attempts: List[Future] = []
+        try:
+            remaining = None if end is None else max(0.0, end - time.monotonic())
+            result, elapsed = self._attempt(state, fn, args, kwargs, remaining, hedge, attempts)
+            success = True
+            state.latencies.observe(elapsed)
+            state.latency_histogram.observe(elapsed)
+            state.breaker.record_success()
+            return result
+        except TimeoutError as e:
+            own_timeout = timeout is not None and time.monotonic() - start >= timeout
+            if not own_timeout and (deadline is not None or isinstance(e, DeadlineExceeded)):
+                # the caller's budget ran out first: no verdict on the domain
+                success = None
+                state.breaker.abandon_probe()
+                state.record("deadline")
+                if isinstance(e, DeadlineExceeded):
+                    raise
+                raise DeadlineExceeded(f"Deadline reached calling {domain}") from e
+            state.breaker.record_failure()
+            state.record("timeout")
+            logger.info(f"Call to {domain} timed out after {timeout}s")
+            raise
+        except Exception as e:
+            if is_failure(e):
+                state.breaker.record_failure()
+                state.record("failure")
+            else:
+                success = True
+                state.breaker.record_success()
+            raise
+        finally:
+            if success:
+                state.record("success")
+            self._release_when_settled(state, attempts, success)
+
+    def _release_when_settled(self, state: _Domain, attempts: List[Future], success: Optional[bool]) -> None:
+        """
+        Free the call's limiter slot once none of its attempts is still running,
+        so a losing hedge or an abandoned attempt stays counted in `in_flight`.
+        """
+        for future in attempts:
+            # attempts that haven't started yet needn't run at all
+            future.cancel()
+        outstanding = [future for future in attempts if not future.done()]
+        if not outstanding:
+            state.limiter.release(success)
+            state.in_flight.set(state.limiter.in_flight)
+            return
+
+        left = [len(outstanding)]
+        lock = threading.Lock()
+
+        def settled(_):
+            with lock:
+                left[0] -= 1
+                if left[0]:
+                    return
+            state.limiter.release(success)
+            state.in_flight.set(state.limiter.in_flight)
+
+        for future in outstanding:
+            future.add_done_callback(settled)
+
+    def _attempt(self, state: _Domain, fn, args, kwargs, timeout: Optional[float], hedge: bool, attempts: List[Future]):
+        """
+        Run the call, hedged if it is slow; returns (result, seconds the winning
+        attempt took). Every attempt started is added to `attempts`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        started: Dict[Future, float] = {}
+
+        def submit() -> Future:
+            # each attempt gets its own copy of the caller's context, so request traces still see it
+            future = self.executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+            started[future] = time.monotonic()
+            attempts.append(future)
+            return future
+
+        primary = submit()
+        pending = {primary}
+        with self._lock:
+            state.calls += 1
+            hedge_after = state.latencies.percentile(self.hedge_percentile) if hedge else None
+            if hedge_after is not None and state.hedges >= self.hedge_budget * state.calls:
+                hedge_after = None
+
+        error = None
+        while pending:
+            wait_for = hedge_after
+            if deadline is not None:
+                left = max(0.0, deadline - time.monotonic())
+                wait_for = left if wait_for is None else min(wait_for, left)
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        state.hedge_wins_total.inc()
+                    return future.result(), time.monotonic() - started[future]
+                error = future.exception()
+
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            if hedge_after is not None and not done:
+                # the primary is slower than usual: race a duplicate against it
+                with self._lock:
+                    state.hedges += 1
+                state.hedges_total.inc()
+                pending.add(submit())
+                hedge_after = None
+            elif not pending and error is not None:
+                raise error
+
+        if error is not None and not pending:
+            raise error
+        raise TimeoutError(f"Call to {state.name} timed out")
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+resilience = Resilience()
@@ -3,7 +3,7 @@ import logging
 import json
 import time
 from pathlib import Path
-from typing import Optional, List, Dict, Any, Tuple, Union
+from typing import Optional, List, Dict, Any, Tuple, Union, Iterable, Iterator
 from functools import lru_cache
 from tqdm import tqdm
 
@@ -22,17 +22,22 @@ from langchain_community.graphs.graph_document import (
 
 from apps.ecodome.data_synthesis.knowledge.models import Relationship, Node, KnowledgeGraph
 from apps.ecodome.data_synthesis.knowledge.cache import KnowledgeCacheManager
+from apps.ecodome.generative_search.processors import StreamingDocumentPipeline, batched
+from apps.ecodome.generative_search.vector_index import VectorIndexConfig, build_vectorstore, load_vectorstore, save_vectorstore
 
 logger = logging.getLogger(__name__)
 
 class KnowledgeBase:
-    def __init__(self, n4j_graph, embedding_model, data_sources_path: str, cache_dir: Optional[str] = None, chunk_size: int = 1024, chunk_overlap: int = 100) -> None:
+    def __init__(self, n4j_graph, embedding_model, data_sources_path: str, cache_dir: Optional[str] = None, chunk_size: int = 1024, chunk_overlap: int = 100, ingest_workers: Optional[int] = None, index_config: Optional[VectorIndexConfig] = None, mmap_indexes: bool = False) -> None:
         self.n4j_graph = n4j_graph
         self.embedding_model = embedding_model
         self.data_sources_path = Path(data_sources_path)
         self.cache_dir = Path(cache_dir) if cache_dir else Path("./.runtime/kb_cache")
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.ingest_workers = ingest_workers
+        self.index_config = index_config or VectorIndexConfig()
+        self.mmap_indexes = mmap_indexes
 
         self.cache_dir.mkdir(parents=True, exist_ok=True)
         self.cache_manager = KnowledgeCacheManager(str(self.cache_dir))
@@ -42,8 +47,12 @@ class KnowledgeBase:
 
         self.schema = self._get_schema()
 
+    @property
+    def vector_store_path(self) -> Path:
+        return self.cache_dir / "vector_stores"
+
     def _initialize_vector_stores(self):
-        vector_store_path = self.cache_dir / "vector_stores"
+        vector_store_path = self.vector_store_path
         vector_store_path.mkdir(exist_ok=True)
 
         try:
@@ -51,7 +60,7 @@ class KnowledgeBase:
                 if store_dir.is_dir():
                     store_name = store_dir.name
                     try:
-                        self.vector_stores[store_name] = FAISS.load_local(str(store_dir), self.embedding_model)
+                        self.vector_stores[store_name] = load_vectorstore(store_dir, self.embedding_model, mmap=self.mmap_indexes)
                         logger.info(f"Loaded vector store: {store_name}")
                     except Exception as e:
                         logger.warning(f"Could not load vector store {store_name}: {e}")
@@ -119,49 +128,80 @@ class KnowledgeBase:
                 logger.info(f"Loaded {len(cached_docs)} documents from cache")
                 return cached_docs
 
-        all_docs = []
+        all_docs = list(self.iter_documents())
+
+        if all_docs:
+            self.cache_manager.set(cache_key, all_docs)
+            logger.info(f"Loaded and cached {len(all_docs)} documents")
+        return all_docs
+
+    def iter_documents(self) -> Iterator[Document]:
+        """Lazily load documents from data sources, one file at a time"""
         try:
             for file_path in self.data_sources_path.glob('**/*'):
                 if file_path.is_file():
                     try:
                         if file_path.suffix.lower() == '.pdf':
                             loader = PyPDFLoader(str(file_path))
-                            docs = loader.load()
                         elif file_path.suffix.lower() in ['.txt', '.md', '.json']:
                             loader = TextLoader(str(file_path))
-                            docs = loader.load()
                         else:
                             # add more loaders here
                             continue
 
-                        all_docs.extend(docs)
+                        yield from loader.lazy_load()
                     except Exception as e:
                         logger.warning(f"Failed to load {file_path}: {e}")
         except Exception as e:
             logger.error(f"Error loading documents: {e}")
 
-        if all_docs:
-            self.cache_manager.set(cache_key, all_docs)
-            logger.info(f"Loaded and cached {len(all_docs)} documents")
-        return all_docs
+    def ingest_pipeline(self, embedding_model=None) -> StreamingDocumentPipeline:
+        return StreamingDocumentPipeline(
+            splitter_cls=TokenTextSplitter,
+            splitter_kwargs={"chunk_size": self.chunk_size, "chunk_overlap": self.chunk_overlap},
+            max_workers=self.ingest_workers,
+            embedding_model=embedding_model or self.embedding_model
+        )
 
-    def split_docs(self, docs: List[Documents]) -> List[Document]:
-        splitter = TokenTextSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
-        chunked_docs = splitter.split_documents(docs)
-        return chunked_docs
+    def iter_chunks(self, docs: Optional[Iterable[Document]] = None) -> Iterator[Document]:
+        """Stream cleaned, split and deduplicated chunks of `docs` (default: every data source file)"""
+        return self.ingest_pipeline().run(self.iter_documents() if docs is None else docs)
+
+    def split_docs(self, docs: List[Document]) -> List[Document]:
+        return list(self.iter_chunks(docs))
+
+    def build_vector_store(self, name: str, docs: Optional[Iterable[Document]] = None, index_config: Optional[VectorIndexConfig] = None, embedding_model=None) -> Optional[FAISS]:
+        """
+        Embed `docs` (default: every data source file) into a vector store with the configured index type and save it.
+
+        `embedding_model` overrides the knowledge base's model for this store,
+        e.g. a local backend from `create_embeddings` for bulk re-indexing.
+        """
+        config = index_config or self.index_config
+        embedding_model = embedding_model or self.embedding_model
+        pipeline = self.ingest_pipeline(embedding_model)
+        store = build_vectorstore(
+            pipeline.iter_embedded(self.iter_documents() if docs is None else docs),
+            embedding_model,
+            config
+        )
+        if store is None:
+            logger.warning(f"No documents to build vector store {name}")
+            return None
+
+        save_vectorstore(store, self.vector_store_path / name, config)
+        self.vector_stores[name] = store
+        logger.info(f"Built {config.index_type} vector store {name} with {store.index.ntotal} chunks")
+        return store
 
     def build_knowledge_graph(self, llm, docs: Optional[List[Document]] = None, batch_size: int = 5) -> None:
         """Build knowledge graph from documents"""
         if docs is None:
+            # the cached load is cheaper than re-reading every source file
             docs = self.load_documents()
+        logger.info(f"Building knowledge graph from {len(docs)} documents")
 
-        chunked_docs = self.split_docs(docs)
-        total = len(chunked_docs)
-
-        logger.info(f"Building knowledge graph from {total} document chunks")
-        batches = [chunked_docs[i:i + batch_size] for i in range(0, len(chunked_docs), batch_size)]
-
-        for i, batch in enumerate(batches):
+        for i, batch in enumerate(batched(self.iter_chunks(docs), batch_size)):
             try:
                 node_types = list(self.schema.get("node_props", {}).keys()) if self.schema else []
                 rel_types = list(self.schema.get("rel_props", {}).keys()) if self.schema else []
@@ -0,0 +1,163 @@
+import re
+import logging
+from typing import Dict, List, Optional, Sequence, Set
+
+from langchain.schema import Document
+
+from apps.core.metrics import count
+
+logger = logging.getLogger(__name__)
+
+# tokens of retrieved context to send per model; well under the context windows,
+# since prompt size drives both latency and cost
+CONTEXT_TOKEN_BUDGETS: Dict[str, int] = {
+    "gemini-pro": 4000,
+    "gemini-1.0-pro": 4000,
+    "gemini-1.5-flash": 6000,
+    "gemini-1.5-pro": 8000,
+}
+DEFAULT_TOKEN_BUDGET = 3000
+
+STOP_WORDS = frozenset((
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "in",
+    "is", "it", "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "where", "which",
+    "who", "why", "with",
+))
+
+_WORD_RE = re.compile(r"\w+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English text)"""
+    return max(1, len(text) // 4)
+
+
+def query_terms(query: str) -> Set[str]:
+    return {word for word in _WORD_RE.findall(query.lower()) if len(word) > 2 and word not in STOP_WORDS}
+
+
+def _shingles(text: str, size: int = 3) -> Set[tuple]:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class ContextPacker:
+    """
+    Fit retrieved chunks into a token budget before they go into a prompt.
+
+    Chunks are scored by their retrieval rank and query-term overlap; chunks
+    that mostly repeat a better one are dropped, long chunks are trimmed to the
+    sentences around query terms, and the best chunks are kept, most relevant
+    first, until the budget is used up.
+
+    Beyond the best chunk, chunks containing less than `min_overlap` of the
+    query terms are left out, as are chunks whose relevance score from the
+    retriever (when given) is below `min_score`.
+    """
+
+    def __init__(self, token_budget: int = DEFAULT_TOKEN_BUDGET, max_chunk_tokens: int = 400, redundancy_threshold: float = 0.7, min_overlap: float = 0.2, min_score: Optional[float] = None):
+        self.token_budget = token_budget
+        self.max_chunk_tokens = max_chunk_tokens
+        self.redundancy_threshold = redundancy_threshold
+        self.min_overlap = min_overlap
+        self.min_score = min_score
+
+    @classmethod
+    def for_model(cls, model_name: Optional[str], **kwargs) -> "ContextPacker":
+        name = (model_name or "").split("/")[-1]
+        return cls(token_budget=CONTEXT_TOKEN_BUDGETS.get(name, DEFAULT_TOKEN_BUDGET), **kwargs)
+
+    def pack(self, query: str, docs: Sequence[Document], scores: Optional[Sequence[float]] = None) -> List[Document]:
+        """Select, trim and order `docs` (in retrieval order, optionally with relevance scores) to fit the budget"""
+        if not docs:
+            return []
+
+        terms = query_terms(query)
+        ranked = []
+        for rank, doc in enumerate(docs):
+            score = scores[rank] if scores is not None else 1.0 / (1 + rank)
+            overlap = 1.0
+            if terms:
+                words = set(_WORD_RE.findall(doc.page_content.lower()))
+                overlap = len(terms & words) / len(terms)
+                score += overlap
+            ranked.append((score, rank, overlap, doc))
+        ranked.sort(key=lambda item: (-item[0], item[1]))
+
+        packed = []
+        kept_shingles = []
+        used = 0
+        for score, rank, overlap, doc in ranked:
+            # the rank-based part of the score never gets low enough to cut on, so cut on real relevance signals
+            if packed and overlap < self.min_overlap:
+                continue
+            if packed and scores is not None and self.min_score is not None and scores[rank] < self.min_score:
+                continue
+
+            shingles = _shingles(doc.page_content)
+            if any(self._overlap(shingles, other) >= self.redundancy_threshold for other in kept_shingles):
+                continue
+
+            text = self._trim(doc.page_content, terms)
+            tokens = estimate_tokens(text)
+            if used + tokens > self.token_budget:
+                remaining = self.token_budget - used
+                if remaining < 50:
+                    break
+                text = self._trim(text, terms, max_tokens=remaining)
+                tokens = estimate_tokens(text)
+
+            packed.append(Document(page_content=text, metadata=doc.metadata))
+            kept_shingles.append(shingles)
+            used += tokens
+
+        count("context_tokens", used)
+        logger.debug(f"Packed {len(packed)}/{len(docs)} chunks into ~{used} tokens")
+        return packed
+
+    def pack_text(self, query: str, text: str, metadata: Optional[dict] = None) -> str:
+        """Pack a single blob of text (e.g. raw search results) by treating its paragraphs as chunks"""
+        paragraphs = [p.strip() for p in re.split(r"\n\s*\n|\n", text or "") if p.strip()]
+        docs = [Document(page_content=p, metadata=metadata or {}) for p in paragraphs]
+        return self.format(query, docs)
+
+    def format(self, query: str, docs: Sequence[Document], scores: Optional[Sequence[float]] = None) -> str:
+        return "\n\n".join(doc.page_content for doc in self.pack(query, docs, scores))
+
+    @staticmethod
+    def _overlap(a: Set[tuple], b: Set[tuple]) -> float:
+        if not a or not b:
+            return 0.0
+        return len(a & b) / min(len(a), len(b))
+
+    def _trim(self, text: str, terms: Set[str], max_tokens: Optional[int] = None) -> str:
+        """Keep the sentences around query-term hits (or the leading ones) within `max_tokens`"""
+        max_tokens = max_tokens or self.max_chunk_tokens
+        if estimate_tokens(text) <= max_tokens:
+            return text
+
+        sentences = [s for s in _SENTENCE_RE.split(text) if s.strip()]
+        hits = [i for i, sentence in enumerate(sentences) if terms & set(_WORD_RE.findall(sentence.lower()))]
+
+        selected = set()
+        for i in hits:
+            selected.update(j for j in (i - 1, i, i + 1) if 0 <= j < len(sentences))
+        # fall back to (and then pad with) the leading sentences
+        order = sorted(selected) + [i for i in range(len(sentences)) if i not in selected]
+
+        kept = []
+        used = 0
+        for i in order:
+            tokens = estimate_tokens(sentences[i])
+            if used + tokens > max_tokens:
+                if not kept:
+                    kept.append(i)
+                    sentences[i] = sentences[i][:max_tokens * 4]
+                break
+            kept.append(i)
+            used += tokens
+
+        return " ".join(sentences[i] for i in sorted(kept))
@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SearchContextStore:
+    """
+    Bounded store for the contexts of active searches.
+
+    The most recently used contexts are kept in memory up to `max_contexts`
+    entries and `max_bytes` of serialized size. Colder contexts are spilled to
+    disk as compact JSON and transparently reloaded on the next `get`. A
+    background janitor drops contexts that have not been used for `ttl` seconds
+    from both memory and disk.
+    """
+
+    def __init__(self, spill_path: Path, max_contexts: int = 1000, max_bytes: int = 32 * 1024 * 1024, ttl: int = 24 * 3600, janitor_interval: float = 300.0):
+        self.spill_path = Path(spill_path)
+        self.max_contexts = max_contexts
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self.spill_path.mkdir(parents=True, exist_ok=True)
+
+        self._contexts: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._size = 0
+        self._lock = threading.RLock()
+
+        self.janitor_interval = janitor_interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._janitor, name="search-context-janitor", daemon=True)
+        self.thread.start()
+
+    def put(self, result_id: str, context: Dict[str, Any]) -> None:
+        """Add or refresh a context, spilling the coldest ones if the store is over budget"""
+        size = len(self._serialize(context))
+        with self._lock:
+            self._discard(result_id)
+            self._contexts[result_id] = context
+            self._sizes[result_id] = size
+            self._size += size
+
+            while len(self._contexts) > 1 and (len(self._contexts) > self.max_contexts or self._size > self.max_bytes):
+                cold_id = next(iter(self._contexts))
+                self._spill(cold_id, self._contexts[cold_id])
+                self._discard(cold_id)
+
+    def get(self, result_id: str) -> Optional[Dict[str, Any]]:
+        """Return a context, reloading it from disk if it was spilled"""
+        with self._lock:
+            context = self._contexts.get(result_id)
+            if context is not None:
+                self._contexts.move_to_end(result_id)
+                return context
+
+        context = self._load(result_id)
+        if context is None:
+            return None
+        if self._is_expired(context, time.time() - self.ttl):
+            self.remove(result_id)
+            return None
+
+        self.put(result_id, context)
+        self._spill_file(result_id).unlink(missing_ok=True)
+        return context
+
+    def remove(self, result_id: str) -> None:
+        with self._lock:
+            self._discard(result_id)
+        self._spill_file(result_id).unlink(missing_ok=True)
+
+    def expire(self, max_age: Optional[float] = None) -> int:
+        """Drop contexts that have not been used for `max_age` seconds (defaults to the store ttl)"""
+        cutoff = time.time() - (max_age if max_age is not None else self.ttl)
+
+        with self._lock:
+            expired = [result_id for result_id, context in self._contexts.items() if self._is_expired(context, cutoff)]
+            for result_id in expired:
+                self._discard(result_id)
+
+        removed = len(expired)
+        for spill_file in self.spill_path.glob("*/*.json"):
+            try:
+                if spill_file.stat().st_mtime < cutoff:
+                    spill_file.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def __contains__(self, result_id: str) -> bool:
+        with self._lock:
+            if result_id in self._contexts:
+                return True
+        return self._spill_file(result_id).exists()
+
+    def __len__(self) -> int:
+        return len(self._contexts)
+
+    def close(self) -> None:
+        """Stop the janitor and spill every in-memory context"""
+        self.stop_event.set()
+        self.thread.join()
+        with self._lock:
+            for result_id, context in self._contexts.items():
+                self._spill(result_id, context)
+            self._contexts.clear()
+            self._sizes.clear()
+            self._size = 0
+
+    def _discard(self, result_id: str) -> None:
+        if result_id in self._contexts:
+            del self._contexts[result_id]
+            self._size -= self._sizes.pop(result_id)
+
+    def _spill_file(self, result_id: str) -> Path:
+        return self.spill_path / result_id[:2] / f"{result_id}.json"
+
+    def _spill(self, result_id: str, context: Dict[str, Any]) -> None:
+        spill_file = self._spill_file(result_id)
+        try:
+            spill_file.parent.mkdir(exist_ok=True)
+            tmp_file = spill_file.with_suffix(f".{os.getpid()}.tmp")
+            tmp_file.write_text(self._serialize(context))
+            os.replace(tmp_file, spill_file)
+        except Exception as e:
+            logger.warning(f"Error spilling search context {result_id}: {e}")
+
+    def _load(self, result_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            context = json.loads(self._spill_file(result_id).read_text())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Error loading search context {result_id}: {e}")
+            return None
+
+        context["timestamp"] = datetime.fromisoformat(context["timestamp"])
+        return context
+
+    @staticmethod
+    def _serialize(context: Dict[str, Any]) -> str:
+        return json.dumps(context, separators=(",", ":"), default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value))
+
+    @staticmethod
+    def _is_expired(context: Dict[str, Any], cutoff: float) -> bool:
+        return context["timestamp"].timestamp() < cutoff
+
+    def _janitor(self) -> None:
+        while not self.stop_event.wait(timeout=self.janitor_interval):
+            try:
+                removed = self.expire()
+                if removed:
+                    logger.info(f"Expired {removed} search contexts")
+            except Exception as e:
+                logger.warning(f"Error expiring search contexts: {e}")
@@ -0,0 +1,298 @@
+import os
+import json
+import time
+import fcntl
+import pickle
+import shutil
+import asyncio
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores.faiss import FAISS
+
+from apps.core.metrics import count, timed
+from apps.ecodome.generative_search.index_registry import embedding_id
+
+logger = logging.getLogger(__name__)
+
+# identifies the embedding model a saved corpus was built with
+EMBEDDING_FILE = "embedding.json"
+
+
+def content_hash(text: str) -> str:
+    """Stable identifier for a chunk of text"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class CorpusView(BaseRetriever):
+    """Retriever restricted to a subset of the chunks held by a CorpusIndex"""
+
+    corpus: Any
+    content_hashes: List[str]
+    k: int = 10
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.corpus.search(query, self.content_hashes, k=self.k)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        return await self.corpus.asearch(query, self.content_hashes, k=self.k)
+
+
+class CorpusIndex:
+    """
+    Long-lived vector index shared by every search.
+
+    Chunks are keyed by the hash of their content, so a page that was indexed
+    by an earlier search is never embedded again. Each search only gets a
+    filtered view over the chunks it retrieved.
+
+    Past `max_chunks` the oldest tenth of the chunks is dropped. Every process
+    loads the saved corpus, but only the first one to start (holding the
+    writer lock) saves it back: periodically, and on `close`. A save only
+    clones the index under the lock searches take; serializing the clone,
+    writing a new version directory and swapping the `current` link to it
+    happen outside it. A saved corpus built with another embedding model
+    than `embedding_model` is ignored, since its vectors don't compare.
+    """
+
+    def __init__(self, embedding_model, store_path: Path, save_interval: float = 30.0, max_chunks: int = 500_000):
+        self.embedding_model = embedding_model
+        self.store_path = Path(store_path)
+        self.save_interval = save_interval
+        self.max_chunks = max_chunks
+
+        self.store: Optional[FAISS] = None
+        self._positions: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._last_saved = time.monotonic()
+
+        self.store_path.mkdir(parents=True, exist_ok=True)
+        self._writer_lock = self._acquire_writer_lock()
+        self._load()
+
+    def _acquire_writer_lock(self):
+        """The open lock file if this process is the one that saves the corpus, else None"""
+        lock_file = open(self.store_path / "writer.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            logger.info(f"Corpus index at {self.store_path} is saved by another process")
+            return None
+        return lock_file
+
+    def _load(self) -> None:
+        folder = self.store_path / "current"
+        if not (folder / "index.faiss").exists():
+            return
+        try:
+            saved_model = json.loads((folder / EMBEDDING_FILE).read_text())
+        except (OSError, ValueError):
+            saved_model = None
+        if saved_model != embedding_id(self.embedding_model):
+            logger.warning(f"Corpus index at {self.store_path} was built with another embedding model, starting empty")
+            return
+        try:
+            self.store = FAISS.load_local(str(folder), self.embedding_model)
+            self._positions = {doc_id: pos for pos, doc_id in self.store.index_to_docstore_id.items()}
+            logger.info(f"Loaded corpus index with {len(self._positions)} chunks")
+        except Exception as e:
+            logger.warning(f"Could not load corpus index, starting empty: {e}")
+            self.store = None
+            self._positions = {}
+
+    def __contains__(self, chunk_hash: str) -> bool:
+        return chunk_hash in self._positions
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def add_documents(self, docs: List[Document], batch_size: Optional[int] = None) -> List[str]:
+        """
+        Index the chunks that are not in the corpus yet and return the hashes of all of them.
+
+        New chunks are embedded in calls of at most `batch_size` texts (all at once by default).
+        """
+        hashes, pending = self._pending_chunks(docs)
+
+        batch_size = batch_size or len(pending)
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            count("embedding_calls")
+            count("chunks_embedded", len(batch))
+            # embed outside the lock so concurrent searches don't queue behind each other
+            with timed("embedding"):
+                embeddings = self.embedding_model.embed_documents([doc.page_content for doc in batch])
+            with timed("index_build"):
+                self._append(batch, embeddings)
+
+        logger.debug(f"Corpus index: {len(pending)} new chunks, {len(hashes) - len(pending)} reused")
+        return hashes
+
+    async def aadd_documents(self, docs: List[Document], batch_size: Optional[int] = None) -> List[str]:
+        """Async `add_documents`, embedding through the model's async API"""
+        hashes, pending = self._pending_chunks(docs)
+
+        batch_size = batch_size or len(pending)
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            count("embedding_calls")
+            count("chunks_embedded", len(batch))
+            with timed("embedding"):
+                embeddings = await self.embedding_model.aembed_documents([doc.page_content for doc in batch])
+            with timed("index_build"):
+                await asyncio.to_thread(self._append, batch, embeddings)
+
+        logger.debug(f"Corpus index: {len(pending)} new chunks, {len(hashes) - len(pending)} reused")
+        return hashes
+
+    def _pending_chunks(self, docs: List[Document]):
+        """Tag every chunk with its hash; return all hashes and the chunks missing from the corpus"""
+        hashes = []
+        new_docs = {}
+        for doc in docs:
+            chunk_hash = content_hash(doc.page_content)
+            doc.metadata["content_hash"] = chunk_hash
+            hashes.append(chunk_hash)
+            if chunk_hash not in self._positions and chunk_hash not in new_docs:
+                new_docs[chunk_hash] = doc
+        return hashes, list(new_docs.values())
+
+    def _append(self, docs: List[Document], embeddings: List[List[float]]) -> None:
+        with self._lock:
+            rows = [
+                (doc, embedding) for doc, embedding in zip(docs, embeddings)
+                if doc.metadata["content_hash"] not in self._positions
+            ]
+            if not rows:
+                return
+
+            text_embeddings = [(doc.page_content, embedding) for doc, embedding in rows]
+            metadatas = [doc.metadata for doc, _ in rows]
+            ids = [doc.metadata["content_hash"] for doc, _ in rows]
+
+            if self.store is None:
+                self.store = FAISS.from_embeddings(text_embeddings, self.embedding_model, metadatas=metadatas, ids=ids)
+            else:
+                self.store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+
+            # new vectors are appended, so they take the last positions
+            first = self.store.index.ntotal - len(ids)
+            self._positions.update((doc_id, first + offset) for offset, doc_id in enumerate(ids))
+            if len(self._positions) > self.max_chunks:
+                self._drop_oldest(len(self._positions) - self.max_chunks + self.max_chunks // 10)
+            self._dirty = True
+            save_due = time.monotonic() - self._last_saved >= self.save_interval
+        if save_due:
+            self.save()
+
+    def _drop_oldest(self, n: int) -> None:
+        """Remove the `n` chunks indexed first; needs the lock"""
+        oldest = [self.store.index_to_docstore_id[pos] for pos in range(n)]
+        self.store.delete(oldest)
+        # removal renumbers every later vector
+        self._positions = {doc_id: pos for pos, doc_id in self.store.index_to_docstore_id.items()}
+        count("corpus_chunks_dropped", n)
+        logger.info(f"Corpus index dropped its {n} oldest chunks")
+
+    def search(self, query: str, content_hashes: List[str], k: int = 10) -> List[Document]:
+        """Similarity search restricted to the given chunks"""
+        count("embedding_calls")
+        return self._search_by_vector(self.embedding_model.embed_query(query), content_hashes, k)
+
+    async def asearch(self, query: str, content_hashes: List[str], k: int = 10) -> List[Document]:
+        count("embedding_calls")
+        embedding = await self.embedding_model.aembed_query(query)
+        # the search blocks, and may wait for the lock behind an append
+        return await asyncio.to_thread(self._search_by_vector, embedding, content_hashes, k)
+
+    def _search_by_vector(self, embedding: List[float], content_hashes: List[str], k: int) -> List[Document]:
+        with self._lock:
+            if self.store is None:
+                return []
+            positions = np.array(
+                sorted({self._positions[h] for h in content_hashes if h in self._positions}),
+                dtype=np.int64
+            )
+            if not len(positions):
+                return []
+
+            vector = np.array([embedding], dtype=np.float32)
+            if self.store._normalize_L2:
+                faiss.normalize_L2(vector)
+
+            selector = faiss.IDSelectorBatch(len(positions), faiss.swig_ptr(positions))
+            params = faiss.SearchParameters(sel=selector)
+            _, indices = self.store.index.search(vector, min(k, len(positions)), params=params)
+
+            docs = []
+            for pos in indices[0]:
+                if pos == -1:
+                    continue
+                doc = self.store.docstore.search(self.store.index_to_docstore_id[pos])
+                if isinstance(doc, Document):
+                    docs.append(doc)
+            return docs
+
+    def as_retriever(self, content_hashes: List[str], k: int = 10) -> CorpusView:
+        """Retriever over the chunks of a single search"""
+        return CorpusView(corpus=self, content_hashes=list(dict.fromkeys(content_hashes)), k=k)
+
+    def save(self) -> None:
+        """Persist the corpus if it changed since the last save and this process is its writer"""
+        if self._writer_lock is None:
+            return
+        with self._save_lock:
+            # only copy under the lock; serializing and writing the copy don't hold up searches
+            with self._lock:
+                if self.store is None or not self._dirty:
+                    return
+                index = faiss.clone_index(self.store.index)
+                docstore = (InMemoryDocstore(dict(self.store.docstore._dict)), dict(self.store.index_to_docstore_id))
+                self._dirty = False
+                self._last_saved = time.monotonic()
+            try:
+                self._write_version(faiss.serialize_index(index), docstore)
+            except Exception as e:
+                with self._lock:
+                    self._dirty = True
+                logger.warning(f"Error saving corpus index: {e}")
+
+    def _write_version(self, index, docstore) -> None:
+        """Write a snapshot to a new version directory (the layout of FAISS.save_local) and make it current"""
+        version = f"v{time.time_ns()}"
+        folder = self.store_path / version
+        folder.mkdir()
+        index.tofile(str(folder / "index.faiss"))
+        with open(folder / "index.pkl", "wb") as f:
+            pickle.dump(docstore, f)
+        (folder / EMBEDDING_FILE).write_text(json.dumps(embedding_id(self.embedding_model)))
+
+        link_path = self.store_path / "current"
+        try:
+            previous = os.readlink(link_path)
+        except OSError:
+            previous = None
+        tmp_link = self.store_path / f".{version}.link"
+        os.symlink(version, tmp_link)
+        os.replace(tmp_link, link_path)
+        if previous is not None:
+            shutil.rmtree(self.store_path / previous, ignore_errors=True)
+
+    def close(self) -> None:
+        """Save the corpus and hand the writer lock over to another process"""
+        self.save()
+        if self._writer_lock is not None:
+            self._writer_lock.close()
+            self._writer_lock = None
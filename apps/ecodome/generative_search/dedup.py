@@ -0,0 +1,120 @@
+import re
+import zlib
+import hashlib
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain.schema import Document
+
+from apps.core.metrics import count
+
+logger = logging.getLogger(__name__)
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_NON_WORD_RE = re.compile(r"\W+")
+
+
+def normalize_for_dedup(text: str) -> str:
+    """Case- and punctuation-insensitive form of a chunk, used for exact dedup and shingling"""
+    return _NON_WORD_RE.sub(" ", text.lower()).strip()
+
+
+class ChunkDeduplicator:
+    """
+    Remove exact and near-duplicate chunks.
+
+    A chunk is dropped when its normalized text hashes to one already seen, or
+    when its MinHash signature over word shingles, looked up with LSH banding,
+    gives an estimated Jaccard similarity of at least `threshold` to an earlier
+    kept chunk. The first occurrence is always the one kept, so retrieval order
+    is preserved.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, bands: int = 32, shingle_size: int = 5, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+        # universal hash family h(x) = (a * x + b) mod p; a, b and x are 32-bit so nothing overflows
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def deduplicate(self, docs: List[Document]) -> List[Document]:
+        if len(docs) < 2:
+            return list(docs)
+
+        seen = SeenChunks(self)
+        kept = [doc for doc in docs if seen.add(self.fingerprint(doc.page_content))]
+
+        if len(kept) < len(docs):
+            count("chunks_deduplicated", len(docs) - len(kept))
+            logger.debug(f"Dropped {len(docs) - len(kept)} duplicate chunks of {len(docs)}")
+        return kept
+
+    def fingerprint(self, text: str) -> Optional[Tuple[bytes, np.ndarray]]:
+        """Exact-match digest and MinHash signature of a chunk, or None if it has no words"""
+        normalized = normalize_for_dedup(text)
+        if not normalized:
+            return None
+        digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+        return digest, self.signature(normalized)
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash signature of the word shingles of (already normalized) `text`"""
+        words = text.split()
+        size = min(self.shingle_size, len(words)) or 1
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles)
+        )
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+class SeenChunks:
+    """
+    The chunks kept so far by a ChunkDeduplicator.
+
+    Split from the deduplicator so fingerprints can be computed elsewhere (e.g.
+    in worker processes) and checked against one growing set of chunks.
+    """
+
+    def __init__(self, deduplicator: ChunkDeduplicator):
+        self.threshold = deduplicator.threshold
+        self.bands = deduplicator.bands
+        self.rows = deduplicator.rows
+        self._digests: Set[bytes] = set()
+        self._buckets: List[Dict[bytes, List[int]]] = [defaultdict(list) for _ in range(self.bands)]
+        self._signatures: List[np.ndarray] = []
+
+    def add(self, fingerprint: Optional[Tuple[bytes, np.ndarray]]) -> bool:
+        """Record a chunk, returning False if it is empty or duplicates one already seen"""
+        if fingerprint is None:
+            return False
+        digest, signature = fingerprint
+        if digest in self._digests:
+            return False
+        self._digests.add(digest)
+
+        bands = [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+        candidates = {other for band, key in enumerate(bands) for other in self._buckets[band].get(key, ())}
+        if any(np.mean(self._signatures[other] == signature) >= self.threshold for other in candidates):
+            return False
+
+        index = len(self._signatures)
+        self._signatures.append(signature)
+        for band, key in enumerate(bands):
+            self._buckets[band][key].append(index)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._signatures)
@@ -0,0 +1,254 @@
+import os
+import re
+import time
+import zlib
+import asyncio
+import inspect
+import logging
+import threading
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from apps.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 100, 250)
+
+
+class _Lane:
+    """Pending texts of one kind (documents or queries) and the thread that flushes them"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.pending: List[Tuple[str, Future]] = []
+        self.condition = threading.Condition()
+        self.oldest = 0.0
+
+
+class EmbeddingBatcher(Embeddings):
+    """
+    Coalesce embedding calls from concurrent requests into batched provider calls.
+
+    Texts passed to `embed_documents`/`embed_query` are queued; a flush thread
+    per kind waits up to `max_wait` seconds after the first queued text for
+    others to arrive (or until `max_batch_size` are queued), then embeds the
+    distinct texts in one call and fans the vectors back out to the callers.
+    Up to `max_concurrent_batches` provider calls run at a time.
+
+    Queries are batched with `embed_documents(texts, task_type="retrieval_query")`
+    when the wrapped model supports a task type (as the Google embeddings do),
+    and otherwise embedded one at a time, still deduplicated across callers.
+    Callers give up with a TimeoutError after `timeout` seconds.
+    """
+
+    def __init__(self, embedding_model: Embeddings, max_batch_size: int = 100, max_wait: float = 0.005, max_concurrent_batches: int = 4, timeout: float = 60.0):
+        self.embedding_model = embedding_model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.batch_query_embeddings = "task_type" in inspect.signature(embedding_model.embed_documents).parameters
+
+        self.batch_sizes = metrics.histogram("embedding_batcher_batch_size", buckets=BATCH_SIZE_BUCKETS)
+        self.texts_total = metrics.counter("embedding_batcher_texts_total")
+        self.calls_total = metrics.counter("embedding_batcher_calls_total")
+
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix="embedding-batch")
+        self.stop_event = threading.Event()
+        self.lanes: Dict[str, _Lane] = {}
+        self.threads = []
+        for name in ("document", "query"):
+            lane = self.lanes[name] = _Lane(name)
+            thread = threading.Thread(target=self._flush_periodically, args=(lane,), name=f"embedding-batcher-{name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def __getattr__(self, name):
+        # expose the wrapped model's attributes (e.g. `model`, used as a cache namespace)
+        if name == "embedding_model":
+            raise AttributeError(name)
+        return getattr(self.embedding_model, name)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        futures = self._submit("document", texts)
+        deadline = time.monotonic() + self.timeout
+        return [future.result(timeout=max(0.0, deadline - time.monotonic())) for future in futures]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._submit("query", [text])[0].result(timeout=self.timeout)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        futures = self._submit("document", texts)
+        return list(await asyncio.wait_for(asyncio.gather(*(asyncio.wrap_future(future) for future in futures)), self.timeout))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.wait_for(asyncio.wrap_future(self._submit("query", [text])[0]), self.timeout)
+
+    def _submit(self, kind: str, texts: List[str]) -> List[Future]:
+        lane = self.lanes[kind]
+        futures = [Future() for _ in texts]
+        with lane.condition:
+            if not lane.pending:
+                lane.oldest = time.monotonic()
+            lane.pending.extend(zip(texts, futures))
+            lane.condition.notify()
+        return futures
+
+    def _flush_periodically(self, lane: _Lane) -> None:
+        while True:
+            with lane.condition:
+                while not lane.pending and not self.stop_event.is_set():
+                    lane.condition.wait(timeout=1.0)
+                if not lane.pending:
+                    return
+                # give concurrent callers a moment to join the batch
+                while len(lane.pending) < self.max_batch_size and not self.stop_event.is_set():
+                    remaining = lane.oldest + self.max_wait - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    lane.condition.wait(timeout=remaining)
+
+                batch = lane.pending[:self.max_batch_size]
+                del lane.pending[:self.max_batch_size]
+                lane.oldest = time.monotonic()
+
+            self.executor.submit(self._embed_batch, lane.name, batch)
+
+    def _embed_batch(self, kind: str, batch: List[Tuple[str, Future]]) -> None:
+        # every caller's future must get a vector or an error, whatever goes wrong
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            if kind == "document":
+                vectors = self.embedding_model.embed_documents(texts)
+            elif self.batch_query_embeddings:
+                vectors = self.embedding_model.embed_documents(texts, task_type="retrieval_query")
+            else:
+                vectors = [self.embedding_model.embed_query(text) for text in texts]
+            if len(vectors) != len(texts):
+                raise ValueError(f"Got {len(vectors)} embeddings for {len(texts)} texts")
+
+            self.batch_sizes.observe(len(texts))
+            self.texts_total.inc(len(batch))
+            self.calls_total.inc(1 if kind == "document" or self.batch_query_embeddings else len(texts))
+            by_text = dict(zip(texts, vectors))
+            for text, future in batch:
+                future.set_result(by_text[text])
+        except Exception as e:
+            logger.warning(f"Batched {kind} embedding of {len(texts)} texts failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def close(self) -> None:
+        self.stop_event.set()
+        for lane in self.lanes.values():
+            with lane.condition:
+                lane.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.executor.shutdown(wait=True)
+
+
+@lru_cache(maxsize=1 << 18)
+def _feature_hash(feature: str) -> int:
+    return zlib.crc32(feature.encode("utf-8"))
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Local, dependency-free embeddings: signed feature hashing of word n-grams.
+
+    Each text is tokenized into lower-cased words, its unigrams and bigrams
+    are hashed into `dim` buckets with a hash-derived sign, counts are damped
+    with log1p and the vector is L2-normalized. A whole batch is scattered into
+    one NumPy matrix, so there is no per-text model call. Lexical rather than
+    semantic, but stable across processes and machines, free and fast, which
+    makes it the minimum tier for bulk ingest and offline benchmarks.
+    """
+
+    backend = "hashing"
+    token_re = re.compile(r"\w+")
+
+    def __init__(self, dim: int = 768, ngrams: int = 2):
+        self.dim = dim
+        self.ngrams = ngrams
+
+    def spec(self) -> Dict[str, Any]:
+        return {"backend": self.backend, "dim": self.dim, "ngrams": self.ngrams}
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        rows, hashes = [], []
+        for row, text in enumerate(texts):
+            words = self.token_re.findall(text.lower())
+            features = list(words)
+            for n in range(2, self.ngrams + 1):
+                features.extend(" ".join(words[i:i + n]) for i in range(len(words) - n + 1))
+            rows.extend([row] * len(features))
+            hashes.extend(_feature_hash(feature) for feature in features)
+
+        hashes = np.asarray(hashes, dtype=np.int64)
+        signs = np.where(hashes & (1 << 31), -1.0, 1.0).astype(np.float32)
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(matrix, (np.asarray(rows, dtype=np.int64), hashes % self.dim), signs)
+
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1.0, norms)
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """
+    Local embeddings from a small sentence-transformers model on CPU, encoded in batches.
+
+    Needs the optional `sentence-transformers` package.
+    """
+
+    backend = "sentence-transformers"
+
+    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2", batch_size: int = 64, device: str = "cpu"):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError("The sentence-transformers embedding backend needs `pip install sentence-transformers`") from e
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.client = SentenceTransformer(model_name, device=device)
+
+    def spec(self) -> Dict[str, Any]:
+        return {"backend": self.backend, "model_name": self.model_name, "batch_size": self.batch_size}
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.client.encode(
+            texts, batch_size=self.batch_size, convert_to_numpy=True, normalize_embeddings=True
+        ).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def create_embeddings(backend: str = "google", **kwargs) -> Embeddings:
+    """
+    Embedding model for a backend name: "google" (the hosted model, the default),
+    "hashing" or "sentence-transformers" (both local, on CPU).
+    """
+    if backend == "google":
+        from langchain_google_genai.embeddings import GoogleGenerativeAIEmbeddings
+        kwargs.setdefault("model", "models/embedding-001")
+        kwargs.setdefault("google_api_key", os.getenv("GOOGLE_GEN_AI_API_KEY", ""))
+        return GoogleGenerativeAIEmbeddings(**kwargs)
+    if backend == HashingEmbeddings.backend:
+        return HashingEmbeddings(**kwargs)
+    if backend == SentenceTransformerEmbeddings.backend:
+        return SentenceTransformerEmbeddings(**kwargs)
+    raise ValueError(f"Unknown embedding backend {backend!r}")
@@ -5,18 +5,22 @@ import uuid
 import logging
 import asyncio
 import threading
+import contextvars
 from pathlib import Path
-from typing import Dict, List, Any, Optional, Generator, Union
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Any, Optional, Generator, Tuple, Union
 from datetime import datetime, timedelta
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores.faiss import FAISS
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough, RunnableParallel
+from langchain_core.runnables import RunnableLambda, RunnableParallel
 
+from apps.core.cache.tiered_cache import TieredCache
+from apps.core.metrics import RequestTrace, count, timed
 from apps.ecodome.generative_search.models import SearchRequest, ChatRequest, SearchResult, ChatMessage
-from apps.ecodome.generative_search.knowledge_sources import KnowledgeSourceRegistry
+from apps.ecodome.generative_search.knowledge_sources import KnowledgeSource, KnowledgeSourceRegistry
 from apps.ecodome.generative_search.prompts import (
     SYSTEM_PROMPT, 
     SEARCH_PROMPT, 
@@ -24,12 +28,37 @@ from apps.ecodome.generative_search.prompts import (
     RELATED_QUESTIONS_PROMPT
 )
 from apps.ecodome.generative_search.processors import DocumentProcessor, QueryProcessor
-from apps.ecodome.generative_search.utils import create_or_load_vectorstore, get_cache_key
+from apps.ecodome.generative_search.corpus_index import CorpusIndex
+from apps.ecodome.generative_search.context_store import SearchContextStore
+from apps.ecodome.generative_search.semantic_cache import SemanticQueryCache
+from apps.ecodome.generative_search.history import SearchHistoryStore
+from apps.ecodome.generative_search.context_packer import ContextPacker
+from apps.ecodome.generative_search.utils import get_cache_key
 
 logger = logging.getLogger(__name__)
 
+
+def parse_related_questions(response: str) -> List[str]:
+    return [q.strip() for q in response.split('\n') if q.strip()][:5]
+
+
+def instrumented_llm_call(stage: str, chain):
+    """Wrap an LLM chain so each invocation is timed and counted on the active request trace"""
+    def invoke(inputs):
+        count("llm_calls")
+        with timed(stage):
+            return chain.invoke(inputs)
+
+    async def ainvoke(inputs):
+        count("llm_calls")
+        with timed(stage):
+            return await chain.ainvoke(inputs)
+
+    return RunnableLambda(invoke, afunc=ainvoke)
+
+
 class GenSearchEngine:
-    def __init__(self, llm, embedding_model, vector_store_path: Path, result_cache_path: Path, chunk_size: int = 1000, chunk_overlap: int = 200, max_sources: int = 10, cache_ttl: int = 3600):
+    def __init__(self, llm, embedding_model, vector_store_path: Path, result_cache_path: Path, chunk_size: int = 1000, chunk_overlap: int = 200, max_sources: int = 10, cache_ttl: int = 3600, source_timeouts: Optional[Dict[str, float]] = None, source_grace_period: float = 0.5, max_source_workers: int = 8, context_ttl: int = 24 * 3600, semantic_cache_threshold: Optional[float] = 0.92, history_path: Optional[Path] = None):
         self.llm = llm
         self.embedding_model = embedding_model
         self.vector_store_path = vector_store_path
@@ -38,6 +67,9 @@ class GenSearchEngine:
         self.chunk_overlap = chunk_overlap
         self.max_sources = max_sources
         self.cache_ttl = cache_ttl
+        # per-source deadline overrides in seconds, keyed by knowledge source id
+        self.source_timeouts = source_timeouts or {}
+        self.source_grace_period = source_grace_period
 
         self.vector_store_path.mkdir(parents=True, exist_ok=True)
         self.result_cache_path.mkdir(parents=True, exist_ok=True)
@@ -45,9 +77,25 @@ class GenSearchEngine:
         self.knowledge_registry = KnowledgeSourceRegistry()
         self.document_processor = DocumentProcessor(chunk_size, chunk_overlap)
         self.query_processor = QueryProcessor()
-
-        self.active_searches = {}
-        self.search_history = {}
+        # fits retrieved chunks into the prompt budget of the configured model
+        self.context_packer = ContextPacker.for_model(getattr(llm, "model", None))
+        self.result_cache = TieredCache(self.result_cache_path, ttl=cache_ttl)
+        # a threshold of None disables near-duplicate query matching
+        self.semantic_cache = (
+            SemanticQueryCache(embedding_model, threshold=semantic_cache_threshold, ttl=cache_ttl)
+            if semantic_cache_threshold is not None else None
+        )
+        self.corpus_index = CorpusIndex(embedding_model, self.vector_store_path / "corpus")
+        # runs the related-questions chain; knowledge sources get their own pools
+        self.source_executor = ThreadPoolExecutor(max_workers=max_source_workers, thread_name_prefix="knowledge-source")
+        # per source: a pool of `max_source_workers` threads and a slot per thread, so a source stuck
+        # past its deadlines only ties up its own threads, and is skipped once they are all taken
+        self.max_source_workers = max_source_workers
+        self._source_pools: Dict[str, Tuple[ThreadPoolExecutor, threading.BoundedSemaphore]] = {}
+        self._source_pools_lock = threading.Lock()
+
+        self.active_searches = SearchContextStore(self.vector_store_path / "contexts", ttl=context_ttl)
+        self.search_history = SearchHistoryStore(history_path or self.vector_store_path.parent / "search_history.sqlite")
 
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
@@ -58,201 +106,562 @@ class GenSearchEngine:
         result_id = str(uuid.uuid4())
         start_time = time.time()
 
-        cache_key = get_cache_key(request.search_term, request.image_url)
-        cached_result = self._get_from_cache(cache_key)
-        if cached_result:
-            return cached_result
+        with RequestTrace("gensearch") as trace:
+            cache_key = get_cache_key(request.search_term, request.image_url)
+            with timed("cache_lookup"):
+                cached_result, query_vector = self._lookup_cached_result(request, cache_key)
+            if cached_result:
+                trace.count("cache_hits")
+                return cached_result
 
-        try:
-            processed_query = self.query_processor.process(request.search_term)
-            
-            knowledge_sources = []
-            for source_name in request.knowledge_sources:
-                source = self.knowledge_registry.get_source(source_name)
-                if source:
-                    knowledge_sources.append(source)
+            try:
+                knowledge_sources, source_timings, content_hashes = self._gather_context(request)
+                return self._answer_search(
+                    request, result_id, start_time, knowledge_sources, source_timings,
+                    content_hashes, cache_key, query_vector, trace
+                )
 
-            if not knowledge_sources:
-                knowledge_sources = [self.knowledge_registry.get_source("web")]
+            except Exception as e:
+                logger.exception(f"Error during search: {str(e)}")
+                trace.count("errors")
+                return self._search_error(result_id, request, e, start_time)
+
+    def search_many(self, requests: List[SearchRequest], max_llm_concurrency: int = 4, embed_batch_size: int = 256) -> List[Dict[str, Any]]:
+        """
+        Answer many searches at once, sharing work between them.
+
+        Each knowledge source receives all queries together, so the web source
+        loads every distinct page only once. The chunks of all queries are
+        embedded together in batches of `embed_batch_size`, and answers are
+        generated with at most `max_llm_concurrency` searches in flight.
+        Results are returned in request order.
+        """
+        start_time = time.time()
+        results: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+
+        pending = []
+        for index, request in enumerate(requests):
+            cache_key = get_cache_key(request.search_term, request.image_url)
+            cached_result, query_vector = self._lookup_cached_result(request, cache_key)
+            if cached_result:
+                results[index] = cached_result
+            else:
+                pending.append((index, request, cache_key, query_vector))
+
+        if not pending:
+            return results
+
+        with RequestTrace("gensearch_batch") as trace:
+            trace.count("searches", len(pending))
+            try:
+                # fan the whole batch out to each source once
+                queries = [self.query_processor.process(request.search_term) for _, request, _, _ in pending]
+                groups = {}
+                for position, (_, request, _, _) in enumerate(pending):
+                    for source in self._resolve_sources(request):
+                        groups.setdefault(source.id, (source, []))[1].append(position)
+
+                started = time.monotonic()
+                futures = []
+                for source, positions in groups.values():
+                    batch = [(queries[p], pending[p][1].image_url, pending[p][1].filters) for p in positions]
+                    deadline = started + self.source_timeouts.get(source.id, source.timeout)
+                    future = self._submit_to_source(source, self._timed_retrieve_many, source, batch, deadline)
+                    if future is None:
+                        logger.warning(f"Knowledge source {source.id} has no free worker, skipping it for this batch")
+                        continue
+                    futures.append((deadline, source, positions, future))
+
+                # like a single search, a source that fails or misses its deadline just contributes nothing
+                documents = [[] for _ in pending]
+                for deadline, source, positions, future in sorted(futures, key=lambda item: item[0]):
+                    try:
+                        remaining = deadline + self.source_grace_period - time.monotonic()
+                        retrieved = future.result(timeout=max(0.0, remaining))
+                    except FutureTimeoutError:
+                        future.cancel()
+                        logger.warning(f"Knowledge source {source.id} missed its deadline for the batch")
+                        continue
+                    except Exception as e:
+                        logger.exception(f"Knowledge source {source.id} failed for the batch: {e}")
+                        continue
+                    for position, (docs, _) in zip(positions, retrieved):
+                        documents[position].extend(docs)
+
+                # split each distinct page once, then embed every new chunk of the batch together
+                chunks_by_doc = {}
+                with timed("document_processing"):
+                    for docs in documents:
+                        for doc in docs:
+                            if id(doc) not in chunks_by_doc:
+                                chunks_by_doc[id(doc)] = self.document_processor.process([doc], deduplicate=False)
+                    # dedup across all of each request's pages, not just within each page
+                    request_chunks = [
+                        self.document_processor.deduplicator.deduplicate(
+                            [chunk for doc in docs for chunk in chunks_by_doc[id(doc)]]
+                        )
+                        for docs in documents
+                    ]
+                all_chunks = list({id(chunk): chunk for chunks in request_chunks for chunk in chunks}.values())
+                trace.count("chunks_produced", len(all_chunks))
+                self.corpus_index.add_documents(all_chunks, batch_size=embed_batch_size)
+
+                content_hashes = [[chunk.metadata["content_hash"] for chunk in chunks] for chunks in request_chunks]
+            except Exception as e:
+                logger.exception(f"Error during batch search: {str(e)}")
+                trace.count("errors")
+                for index, request, _, _ in pending:
+                    results[index] = self._search_error(str(uuid.uuid4()), request, e, start_time)
+                return results
+
+            def answer(position):
+                index, request, cache_key, query_vector = pending[position]
+                result_id = str(uuid.uuid4())
+                with RequestTrace("gensearch") as search_trace:
+                    try:
+                        knowledge_sources = self._resolve_sources(request)
+                        return index, self._answer_search(
+                            request, result_id, start_time, knowledge_sources, {},
+                            content_hashes[position], cache_key, query_vector, search_trace
+                        )
+                    except Exception as e:
+                        logger.exception(f"Error during batch search: {str(e)}")
+                        search_trace.count("errors")
+                        return index, self._search_error(result_id, request, e, start_time)
+
+            with ThreadPoolExecutor(max_workers=max_llm_concurrency, thread_name_prefix="batch-answer") as executor:
+                futures = [
+                    executor.submit(contextvars.copy_context().run, answer, position)
+                    for position in range(len(pending))
+                ]
+                for future in futures:
+                    index, result = future.result()
+                    results[index] = result
+
+        return results
+
+    def _answer_search(self, request: SearchRequest, result_id: str, start_time: float, knowledge_sources, source_timings, content_hashes: List[str], cache_key: str, query_vector, trace: RequestTrace) -> Dict[str, Any]:
+        """Retrieve from the indexed chunks of a search, generate the answer and record the result"""
+        retriever = self.corpus_index.as_retriever(content_hashes, k=self.max_sources)
+
+        # retrieve once and feed the same documents to the prompt and the source list
+        with timed("retrieval"):
+            retrieved_docs = retriever.invoke(request.search_term)
+        sources = self._format_sources(retrieved_docs)
+
+        # answer and related questions are independent LLM calls, run them concurrently
+        outputs = self._answer_chains(request).invoke(self._answer_inputs(request, retrieved_docs))
+
+        return self._finish_search(
+            request, result_id, start_time, knowledge_sources, source_timings,
+            content_hashes, cache_key, query_vector, trace, sources, outputs
+        )
 
-            all_documents = []
-            sources_metadata = []
+    def _answer_chains(self, request: SearchRequest) -> RunnableParallel:
+        answer_chain = self._search_prompt(request.search_term) | self.llm | StrOutputParser()
+        return RunnableParallel({
+            "answer": instrumented_llm_call("llm.answer", answer_chain),
+            "related": instrumented_llm_call("llm.related", self._related_chain()),
+        })
+
+    def _answer_inputs(self, request: SearchRequest, retrieved_docs) -> Dict[str, str]:
+        return {
+            "context": self.context_packer.format(request.search_term, retrieved_docs),
+            "question": request.search_term,
+            "search_term": request.search_term,
+        }
+
+    def _finish_search(self, request: SearchRequest, result_id: str, start_time: float, knowledge_sources, source_timings, content_hashes: List[str], cache_key: str, query_vector, trace: RequestTrace, sources, outputs) -> Dict[str, Any]:
+        """Build the search result from the chain outputs, then cache and record it"""
+        search_result = SearchResult(
+            result_id=result_id,
+            title=request.search_term,
+            answer=outputs["answer"],
+            sources=sources,
+            images=[],
+            related_queries=parse_related_questions(outputs["related"]),
+            metadata={
+                "processing_time": time.time() - start_time,
+                "knowledge_sources": [ks.id for ks in knowledge_sources],
+                "source_timings": source_timings,
+                "query": request.search_term,
+                "timestamp": datetime.now().isoformat(),
+                **trace.as_dict()
+            }
+        )
 
-            for source in knowledge_sources:
-                docs, meta = source.retrieve_knowledge(processed_query, request.image_url, request.filters)
-                all_documents.extend(docs)
-                sources_metadata.extend(meta)
+        self._cache_result(cache_key, search_result.to_dict(), query_vector)
+        self._remember_search(result_id, request, content_hashes, len(sources))
 
-            processed_docs = self.document_processor.process(all_documents)
+        return search_result.to_dict()
 
-            # create vector store
-            vector_store_path = self.vector_store_path / result_id
-            vector_store = create_or_load_vectorstore(docs=processed_docs, embedding_model=self.embedding_model, store_path=str(vector_store_path))
+    async def asearch(self, request: SearchRequest) -> Dict[str, Any]:
+        """
+        Async `search`.
 
-            retriever = vector_store.as_retriever(search_kwargs={"k": self.max_sources})
+        Knowledge sources, embeddings, retrieval and both LLM calls are awaited
+        natively; blocking work (document processing, disk caches) runs in worker
+        threads, so the event loop is never pinned by a single search.
+        """
+        result_id = str(uuid.uuid4())
+        start_time = time.time()
 
-            # format system prompt
-            system_prompt = SYSTEM_PROMPT.format(
-                current_date=datetime.now().strftime("%Y-%m-%d"),
-                search_term=request.search_term
-            )
+        with RequestTrace("gensearch") as trace:
+            cache_key = get_cache_key(request.search_term, request.image_url)
+            with timed("cache_lookup"):
+                cached_result, query_vector = await self._alookup_cached_result(request, cache_key)
+            if cached_result:
+                trace.count("cache_hits")
+                return cached_result
 
-            # build RAG chain
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", system_prompt),
-                ("human", SEARCH_PROMPT)
-            ])
+            try:
+                knowledge_sources, source_timings, content_hashes = await self._agather_context(request)
+                retriever = self.corpus_index.as_retriever(content_hashes, k=self.max_sources)
 
-            def format_docs(docs):
-                return "\n\n".join(doc.page_content for doc in docs)
+                with timed("retrieval"):
+                    retrieved_docs = await retriever.ainvoke(request.search_term)
+                sources = self._format_sources(retrieved_docs)
 
-            rag_chain = (
-                RunnableParallel({
-                    "context": retriever | format_docs,
-                    "question": RunnablePassthrough(),
-                })
-                | prompt
-                | self.llm
-                | StrOutputParser()
-            )
+                outputs = await self._answer_chains(request).ainvoke(self._answer_inputs(request, retrieved_docs))
 
-            # RAG chain for related questions
-            related_prompt = ChatPromptTemplate.from_template(RELATED_QUESTIONS_PROMPT)
-            related_chain = (
-                related_prompt.format(search_term=request.search_term)
-                | self.llm
-                | StrOutputParser()
-            )
+                return await asyncio.to_thread(
+                    self._finish_search, request, result_id, start_time, knowledge_sources, source_timings,
+                    content_hashes, cache_key, query_vector, trace, sources, outputs
+                )
 
-            # execute chains
-            answer = rag_chain.invoke(request.search_term)
-            related_response = related_chain.invoke({})
+            except Exception as e:
+                logger.exception(f"Error during search: {str(e)}")
+                trace.count("errors")
+                return self._search_error(result_id, request, e, start_time)
+
+    def search_stream(self, request: SearchRequest, result_id: Optional[str] = None) -> Generator[Dict[str, Any], None, None]:
+        """
+        Streaming variant of `search`.
+
+        Yields events in order: `metadata`, `sources`, one `token` event per answer
+        chunk, `related_queries`, and finally `done` carrying the full result.
+        Failures are reported as a single `error` event.
+        """
+        result_id = result_id or str(uuid.uuid4())
+        start_time = time.time()
+
+        with RequestTrace("gensearch") as trace:
+            cache_key = get_cache_key(request.search_term, request.image_url)
+            with timed("cache_lookup"):
+                cached_result, query_vector = self._lookup_cached_result(request, cache_key)
+            if cached_result:
+                trace.count("cache_hits")
+                cached_result = {**cached_result, "result_id": self._alias_search(cached_result["result_id"], result_id)}
+                yield {"event": "metadata", "data": {"result_id": cached_result["result_id"], "title": cached_result["title"], **cached_result["metadata"]}}
+                yield {"event": "sources", "data": cached_result["sources"]}
+                yield {"event": "token", "data": cached_result["answer"]}
+                yield {"event": "related_queries", "data": cached_result["related_queries"]}
+                yield {"event": "done", "data": cached_result}
+                return
 
             try:
-                related_questions = [q.strip() for q in related_response.split('\n') if q.strip()][:5]
-            except Exception as e:
-                logger.warning(f"Failed to parse related questions: {e}")
-                related_questions = []
-
-            retreived_docs = retriever.invoke(request.search_term)
-            sources = []
-            for doc in retreived_docs[:self.max_sources]:
-                if "source" in doc.metadata:
-                    source_url = docs.metadata["source"]
-                    source_title = doc.metadata.get("title", source_url)
-                    sources.append({
-                        "title": source_title,
-                        "url": source_url,
-                        "snippet": doc.page_content[:200] + "..." if len(docs.page_content) > 200 else doc.page_content
-                    })
-
-            search_result = SearchRequest(
-                result_id=result_id,
-                title=request.search_term,
-                answer=answer,
-                sources=sources,
-                images=[],
-                related_queries=related_questions,
-                metadata={
-                    "processing_time": time.time() - start_time,
+                knowledge_sources, source_timings, content_hashes = self._gather_context(request)
+                retriever = self.corpus_index.as_retriever(content_hashes, k=self.max_sources)
+
+                with timed("retrieval"):
+                    retrieved_docs = retriever.invoke(request.search_term)
+                sources = self._format_sources(retrieved_docs)
+
+                metadata = {
                     "knowledge_sources": [ks.id for ks in knowledge_sources],
+                    "source_timings": source_timings,
                     "query": request.search_term,
-                    "timestamp": datetime.now().isoformat()
                 }
-            )
+                yield {"event": "metadata", "data": {"result_id": result_id, "title": request.search_term, **metadata}}
+                yield {"event": "sources", "data": sources}
+
+                # related questions don't depend on the answer, generate them while it streams
+                related_future = self.source_executor.submit(
+                    contextvars.copy_context().run,
+                    instrumented_llm_call("llm.related", self._related_chain()).invoke,
+                    {"search_term": request.search_term}
+                )
+
+                answer_chain = self._search_prompt(request.search_term) | self.llm | StrOutputParser()
+                answer_parts = []
+                trace.count("llm_calls")
+                llm_start = time.perf_counter()
+                for token in answer_chain.stream({"context": self.context_packer.format(request.search_term, retrieved_docs), "question": request.search_term}):
+                    if not answer_parts:
+                        trace.record("llm.first_token", time.perf_counter() - llm_start)
+                    answer_parts.append(token)
+                    yield {"event": "token", "data": token}
+                trace.record("llm.answer", time.perf_counter() - llm_start)
+
+                related_questions = parse_related_questions(related_future.result())
+                yield {"event": "related_queries", "data": related_questions}
+
+                metadata["processing_time"] = time.time() - start_time
+                metadata["timestamp"] = datetime.now().isoformat()
+                metadata.update(trace.as_dict())
+                search_result = SearchResult(
+                    result_id=result_id,
+                    title=request.search_term,
+                    answer="".join(answer_parts),
+                    sources=sources,
+                    images=[],
+                    related_queries=related_questions,
+                    metadata=metadata
+                )
+
+                self._cache_result(cache_key, search_result.to_dict(), query_vector)
+                self._remember_search(result_id, request, content_hashes, len(sources))
+
+                yield {"event": "done", "data": search_result.to_dict()}
 
-            self._cache_result(cache_key, search_result.to_dict())
-            
-            self.active_searches[result_id] = {
-                "vector_store": vector_store,
-                "query": request.search_term,
-                "timestamp": datatime.now(),
-                "user_id": request.user_id
-            }
+            except Exception as e:
+                logger.exception(f"Error during streaming search: {str(e)}")
+                trace.count("errors")
+                yield {"event": "error", "data": self._search_error(result_id, request, e, start_time)}
 
-            if request.user_id not in self.search_history:
-                self.search_history[request.user_id] = []
+    def _gather_context(self, request: SearchRequest):
+        """Retrieve, process and index the documents for a search, returning the sources, their timings and the chunk hashes"""
+        with timed("query_processing"):
+            processed_query = self.query_processor.process(request.search_term)
 
-            self.search_history[request.user_id].append({
-                "result_id": result_id,
-                "query": request.search_term,
-                "timestamp": datetime.now().isoformat(),
-                "sources_count": len(sources)
-            })
+        knowledge_sources = self._resolve_sources(request)
 
-            if len(self.search_history[request.user_id]) > 100:
-                self.search_history[request.user_id] = self.search_history[request.user_id][-100:]
+        all_documents, sources_metadata, source_timings = self._retrieve_from_sources(
+            knowledge_sources, processed_query, request
+        )
 
-            return search_result.to_dict()
+        with timed("document_processing"):
+            processed_docs = self.document_processor.process(all_documents)
+        count("chunks_produced", len(processed_docs))
 
-        except Exception as e:
-            logger.exception(f"Error during search: {str(e)}")
-            return {
-                "result_id": result_id,
-                "error": str(e),
-                "title": request.search_term,
-                "answer": "I encountered an error while processing your search. Please try again later.",
-                "sources": [],
-                "images": [],
-                "related_queries": [],
-                "metadata": {
-                    "error": str(e),
-                    "processing_time": time.time() - start_time
-                }
-            }
+        # index new chunks into the shared corpus; each request only searches its own chunks
+        content_hashes = self.corpus_index.add_documents(processed_docs)
+        return knowledge_sources, source_timings, content_hashes
 
-    def chat(self, request: ChatRequest) -> Dict[str, Any]:
-        """Process a follow-up chat message in the context of the previous search"""
-        message_id = str(uuid.uuid4())
+    async def _agather_context(self, request: SearchRequest):
+        """Async `_gather_context`"""
+        with timed("query_processing"):
+            processed_query = self.query_processor.process(request.search_term)
 
-        try:
-            search_context = self.active_searches.get(request.result_id)
-            if not search_context:
-                raise ValueError(f"No active search found with ID {request.result_id}")
+        knowledge_sources = self._resolve_sources(request)
 
-            vector_store = search_context["vector_store"]
-            previous_query = search_context["query"]
+        all_documents, sources_metadata, source_timings = await self._aretrieve_from_sources(
+            knowledge_sources, processed_query, request
+        )
 
-            retriever = vector_store.as_retriever(search_kwargs={"k": self.max_sources})
+        with timed("document_processing"):
+            processed_docs = await asyncio.to_thread(self.document_processor.process, all_documents)
+        count("chunks_produced", len(processed_docs))
 
-            system_prompt = SYSTEM_PROMPT.format(
-                current_date=datetime.now().strftime("%Y-%m-%d"),
-                search_term=previous_query
-            )
+        content_hashes = await self.corpus_index.aadd_documents(processed_docs)
+        return knowledge_sources, source_timings, content_hashes
 
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", system_prompt),
-                ("human", QA_PROMPT)
-            ])
+    def _resolve_sources(self, request: SearchRequest) -> List[KnowledgeSource]:
+        knowledge_sources = []
+        for source_name in request.knowledge_sources:
+            source = self.knowledge_registry.get_source(source_name)
+            if source:
+                knowledge_sources.append(source)
 
-            def format_docs(docs):
-                return "\n\n".join(doc.page_content for doc in docs)
+        if not knowledge_sources:
+            knowledge_sources = [self.knowledge_registry.get_source("web")]
+        return knowledge_sources
 
-            rag_chain = (
-                RunnableParallel({
-                    "context": retriever | format_docs,
-                    "question": RunnablePassthrough()
+    def _search_prompt(self, search_term: str) -> ChatPromptTemplate:
+        system_prompt = SYSTEM_PROMPT.format(
+            current_date=datetime.now().strftime("%Y-%m-%d"),
+            search_term=search_term
+        )
+        return ChatPromptTemplate.from_messages([
+            ("system", system_prompt),
+            ("human", SEARCH_PROMPT)
+        ])
+
+    def _related_chain(self):
+        """Chain generating related queries; it never fails the search, an error just yields none"""
+        related_prompt = ChatPromptTemplate.from_template(RELATED_QUESTIONS_PROMPT)
+        related_chain = related_prompt | self.llm | StrOutputParser()
+        return related_chain.with_fallbacks([RunnableLambda(lambda _: "")])
+
+    def _format_sources(self, docs) -> List[Dict[str, str]]:
+        sources = []
+        for doc in docs[:self.max_sources]:
+            if "source" in doc.metadata:
+                source_url = doc.metadata["source"]
+                source_title = doc.metadata.get("title", source_url)
+                sources.append({
+                    "title": source_title,
+                    "url": source_url,
+                    "snippet": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content
                 })
-                | prompt
-                | self.llm
-                | StrOutputParser()
-            )
+        return sources
+
+    def _remember_search(self, result_id: str, request: SearchRequest, content_hashes: List[str], sources_count: int) -> None:
+        self.active_searches.put(result_id, {
+            "content_hashes": content_hashes,
+            "query": request.search_term,
+            "timestamp": datetime.now(),
+            "user_id": request.user_id
+        })
+
+        self.search_history.append(request.user_id, result_id, request.search_term, sources_count)
+
+    def _alias_search(self, cached_id: str, result_id: str) -> str:
+        """
+        Make the search context of a cached result reachable under `result_id`,
+        which the caller may already have handed out; returns the id to use.
+        """
+        if cached_id == result_id:
+            return result_id
+        search_context = self.active_searches.get(cached_id)
+        if search_context is None:
+            # the cached result outlived its search context; follow-ups will report it as gone
+            return cached_id
+        self.active_searches.put(result_id, search_context)
+        return result_id
+
+    def _search_error(self, result_id: str, request: SearchRequest, error: Exception, start_time: float) -> Dict[str, Any]:
+        return {
+            "result_id": result_id,
+            "error": str(error),
+            "title": request.search_term,
+            "answer": "I encountered an error while processing your search. Please try again later.",
+            "sources": [],
+            "images": [],
+            "related_queries": [],
+            "metadata": {
+                "error": str(error),
+                "processing_time": time.time() - start_time
+            }
+        }
+
+    def _retrieve_from_sources(self, knowledge_sources, query: str, request: SearchRequest):
+        """Query all knowledge sources concurrently, each bounded by its own deadline"""
+        started = time.monotonic()
+        pending = []
+        for source in knowledge_sources:
+            timeout = self.source_timeouts.get(source.id, source.timeout)
+            deadline = started + timeout
+            future = self._submit_to_source(source, self._timed_retrieve, source, query, request, deadline)
+            pending.append((deadline, source, future))
+
+        all_documents = []
+        sources_metadata = []
+        source_timings = {}
+
+        # sources were all started together, so waiting in deadline order never overshoots one
+        for deadline, source, future in sorted(pending, key=lambda item: item[0]):
+            timing = {"timed_out": False, "documents": 0}
+            if future is None:
+                # every worker of the source is still busy with earlier, abandoned requests
+                timing["saturated"] = True
+                timing["elapsed"] = 0.0
+                source_timings[source.id] = timing
+                count("sources_saturated")
+                logger.warning(f"Knowledge source {source.id} has no free worker, skipping it")
+                continue
+            try:
+                remaining = deadline + self.source_grace_period - time.monotonic()
+                docs, meta = future.result(timeout=max(0.0, remaining))
+                all_documents.extend(docs)
+                sources_metadata.extend(meta)
+                timing["documents"] = len(docs)
+            except FutureTimeoutError:
+                # the source ignored its deadline; abandon it rather than stall the request
+                future.cancel()
+                timing["timed_out"] = True
+                logger.warning(f"Knowledge source {source.id} missed its deadline")
+            except Exception as e:
+                timing["error"] = str(e)
+                logger.exception(f"Knowledge source {source.id} failed: {e}")
 
-            # Execute chain
-            answer = rag_chain.invoke(request.query)
-            
-            # Get sources
-            retrieved_docs = retriever.invoke(request.query)
-            sources = []
-            for doc in retrieved_docs[:self.max_sources]:
-                if "source" in doc.metadata:
-                    source_url = doc.metadata["source"]
-                    source_title = doc.metadata.get("title", source_url)
-                    sources.append({
-                        "title": source_title,
-                        "url": source_url,
-                        "snippet": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content
-                    })
+            timing["elapsed"] = time.monotonic() - started
+            source_timings[source.id] = timing
+
+        return all_documents, sources_metadata, source_timings
+
+    async def _aretrieve_from_sources(self, knowledge_sources, query: str, request: SearchRequest):
+        """Async `_retrieve_from_sources`: sources run as concurrent tasks, each cancelled at its deadline"""
+        started = time.monotonic()
+
+        async def retrieve(source):
+            timeout = self.source_timeouts.get(source.id, source.timeout)
+            timing = {"timed_out": False, "documents": 0}
+            docs, meta = [], []
+            try:
+                with timed(f"source.{source.id}"):
+                    docs, meta = await asyncio.wait_for(
+                        source.aretrieve_knowledge(query, request.image_url, request.filters, started + timeout),
+                        timeout=timeout + self.source_grace_period
+                    )
+                timing["documents"] = len(docs)
+            except asyncio.TimeoutError:
+                timing["timed_out"] = True
+                logger.warning(f"Knowledge source {source.id} missed its deadline")
+            except Exception as e:
+                timing["error"] = str(e)
+                logger.exception(f"Knowledge source {source.id} failed: {e}")
+            timing["elapsed"] = time.monotonic() - started
+            return docs, meta, timing
+
+        outcomes = await asyncio.gather(*(retrieve(source) for source in knowledge_sources))
+
+        all_documents = []
+        sources_metadata = []
+        source_timings = {}
+        for source, (docs, meta, timing) in zip(knowledge_sources, outcomes):
+            all_documents.extend(docs)
+            sources_metadata.extend(meta)
+            source_timings[source.id] = timing
+
+        return all_documents, sources_metadata, source_timings
+
+    def _submit_to_source(self, source, fn, *args) -> Optional[Future]:
+        """Run `fn(*args)` on the source's own pool, or return None if all of its workers are busy"""
+        with self._source_pools_lock:
+            entry = self._source_pools.get(source.id)
+            if entry is None:
+                entry = self._source_pools[source.id] = (
+                    ThreadPoolExecutor(max_workers=self.max_source_workers, thread_name_prefix=f"source-{source.id}"),
+                    threading.BoundedSemaphore(self.max_source_workers)
+                )
+        pool, slots = entry
+        if not slots.acquire(blocking=False):
+            return None
+        # run with a copy of the current context so the source reports into this request's trace
+        future = pool.submit(contextvars.copy_context().run, fn, *args)
+        # the slot is only freed once the call really ends, not when the request gives up on it
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    @staticmethod
+    def _timed_retrieve(source, query: str, request: SearchRequest, deadline: float):
+        with timed(f"source.{source.id}"):
+            return source.retrieve_knowledge(query, request.image_url, request.filters, deadline)
+
+    @staticmethod
+    def _timed_retrieve_many(source, queries, deadline: float):
+        with timed(f"source.{source.id}"):
+            return source.retrieve_knowledge_many(queries, deadline)
+
+    def chat(self, request: ChatRequest) -> Dict[str, Any]:
+        """Process a follow-up chat message in the context of the previous search"""
+        message_id = str(uuid.uuid4())
+
+        try:
+            search_context = self._get_search_context(request.result_id)
+            retriever = self.corpus_index.as_retriever(search_context["content_hashes"], k=self.max_sources)
+
+            with RequestTrace("genchat"):
+                # retrieve once for both the prompt context and the sources
+                with timed("retrieval"):
+                    retrieved_docs = retriever.invoke(request.query)
+                sources = self._format_sources(retrieved_docs)
+
+                answer_chain = self._chat_prompt(search_context["query"]) | self.llm | StrOutputParser()
+                answer = instrumented_llm_call("llm.answer", answer_chain).invoke(
+                    {"context": self.context_packer.format(request.query, retrieved_docs), "question": request.query}
+                )
             
             # Create chat result
             chat_message = ChatMessage(
@@ -262,28 +671,125 @@ class GenSearchEngine:
                 answer=answer,
                 sources=sources
             )
+            self._record_chat_message(search_context, chat_message)
 
-            if "messages" not in search_context:
-                search_context["messages"] = []
+            return chat_message.to_dict()
 
-            search_context["messages"].append(chat_message.to_dict())
-            search_context["timestamp"] = datetime.now()
+        except Exception as e:
+            logger.exception(f"Error during chat: {str(e)}")
+            return self._chat_error(message_id, request, e)
+
+    async def achat(self, request: ChatRequest) -> Dict[str, Any]:
+        """Async `chat`"""
+        message_id = str(uuid.uuid4())
+
+        try:
+            search_context = await asyncio.to_thread(self._get_search_context, request.result_id)
+            retriever = self.corpus_index.as_retriever(search_context["content_hashes"], k=self.max_sources)
+
+            with RequestTrace("genchat"):
+                with timed("retrieval"):
+                    retrieved_docs = await retriever.ainvoke(request.query)
+                sources = self._format_sources(retrieved_docs)
+
+                answer_chain = self._chat_prompt(search_context["query"]) | self.llm | StrOutputParser()
+                answer = await instrumented_llm_call("llm.answer", answer_chain).ainvoke(
+                    {"context": self.context_packer.format(request.query, retrieved_docs), "question": request.query}
+                )
+
+            chat_message = ChatMessage(
+                message_id=message_id,
+                result_id=request.result_id,
+                question=request.query,
+                answer=answer,
+                sources=sources
+            )
+            await asyncio.to_thread(self._record_chat_message, search_context, chat_message)
 
             return chat_message.to_dict()
 
         except Exception as e:
             logger.exception(f"Error during chat: {str(e)}")
-            return {
-                "message_id": message_id,
-                "result_id": request.result_id,
-                "question": request.query,
-                "answer": "I encountered an error processing your question. Please try again.",
-                "sources": [],
-                "error": str(e)
-            }
+            return self._chat_error(message_id, request, e)
+
+    def chat_stream(self, request: ChatRequest) -> Generator[Dict[str, Any], None, None]:
+        """
+        Streaming variant of `chat`.
 
-    def get_user_history(self, user_id: str) -> List[Dict[str, Any]]:
-        return self.search_history.get(user_id, [])
+        Yields `metadata`, `sources`, one `token` event per answer chunk and
+        finally `done` carrying the full message, or a single `error` event.
+        """
+        message_id = str(uuid.uuid4())
+
+        try:
+            search_context = self._get_search_context(request.result_id)
+            retriever = self.corpus_index.as_retriever(search_context["content_hashes"], k=self.max_sources)
+
+            retrieved_docs = retriever.invoke(request.query)
+            sources = self._format_sources(retrieved_docs)
+
+            yield {"event": "metadata", "data": {"message_id": message_id, "result_id": request.result_id, "question": request.query}}
+            yield {"event": "sources", "data": sources}
+
+            answer_chain = self._chat_prompt(search_context["query"]) | self.llm | StrOutputParser()
+            answer_parts = []
+            for token in answer_chain.stream({"context": self.context_packer.format(request.query, retrieved_docs), "question": request.query}):
+                answer_parts.append(token)
+                yield {"event": "token", "data": token}
+
+            chat_message = ChatMessage(
+                message_id=message_id,
+                result_id=request.result_id,
+                question=request.query,
+                answer="".join(answer_parts),
+                sources=sources
+            )
+            self._record_chat_message(search_context, chat_message)
+
+            yield {"event": "done", "data": chat_message.to_dict()}
+
+        except Exception as e:
+            logger.exception(f"Error during streaming chat: {str(e)}")
+            yield {"event": "error", "data": self._chat_error(message_id, request, e)}
+
+    def _get_search_context(self, result_id: str) -> Dict[str, Any]:
+        search_context = self.active_searches.get(result_id)
+        if not search_context:
+            raise ValueError(f"No active search found with ID {result_id}")
+        return search_context
+
+    def _chat_prompt(self, previous_query: str) -> ChatPromptTemplate:
+        system_prompt = SYSTEM_PROMPT.format(
+            current_date=datetime.now().strftime("%Y-%m-%d"),
+            search_term=previous_query
+        )
+        return ChatPromptTemplate.from_messages([
+            ("system", system_prompt),
+            ("human", QA_PROMPT)
+        ])
+
+    def _record_chat_message(self, search_context: Dict[str, Any], chat_message: ChatMessage) -> None:
+        if "messages" not in search_context:
+            search_context["messages"] = []
+
+        search_context["messages"].append(chat_message.to_dict())
+        search_context["timestamp"] = datetime.now()
+        # re-put so the store accounts for the grown context
+        self.active_searches.put(chat_message.result_id, search_context)
+
+    def _chat_error(self, message_id: str, request: ChatRequest, error: Exception) -> Dict[str, Any]:
+        return {
+            "message_id": message_id,
+            "result_id": request.result_id,
+            "question": request.query,
+            "answer": "I encountered an error processing your question. Please try again.",
+            "sources": [],
+            "error": str(error)
+        }
+
+    def get_user_history(self, user_id: str, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """A page of the user's search history, most recent first"""
+        return self.search_history.get(user_id, offset=offset, limit=limit)
 
     def store_feedback(
         self,
@@ -296,45 +802,81 @@ class GenSearchEngine:
         """Store user feedback for a search result"""
         pass
 
-    def _get_from_cache(self, cache_key: str) -> Optional[Dict[str, Any]]:
-        """Retrieve a result from the cache if it exists and is not expired"""
-        cache_file = self.result_cache_path / f"{cache_key}.json"
-        if not cache_file.exists():
+    def _lookup_cached_result(self, request: SearchRequest, cache_key: str):
+        """
+        Look up a cached result, first by exact key and then, for text searches,
+        by similarity to past queries. Returns the result (or None) and the query
+        embedding computed for the semantic lookup, if any.
+        """
+        cached_result = self._get_from_cache(cache_key)
+        if cached_result or self.semantic_cache is None or request.image_url:
+            return cached_result, None
+
+        try:
+            similar_key, query_vector = self.semantic_cache.lookup(request.search_term)
+        except Exception as e:
+            logger.warning(f"Error reading semantic cache: {e}")
+            return None, None
+
+        if similar_key:
+            cached_result = self._get_from_cache(similar_key)
+            if cached_result is None:
+                # the result expired or was evicted from the result cache
+                self.semantic_cache.remove(similar_key)
+        return cached_result, query_vector
+
+    async def _alookup_cached_result(self, request: SearchRequest, cache_key: str):
+        """Async `_lookup_cached_result`"""
+        cached_result = await self._aget_from_cache(cache_key)
+        if cached_result or self.semantic_cache is None or request.image_url:
+            return cached_result, None
+
+        try:
+            similar_key, query_vector = await self.semantic_cache.alookup(request.search_term)
+        except Exception as e:
+            logger.warning(f"Error reading semantic cache: {e}")
+            return None, None
+
+        if similar_key:
+            cached_result = await self._aget_from_cache(similar_key)
+            if cached_result is None:
+                self.semantic_cache.remove(similar_key)
+        return cached_result, query_vector
+
+    async def _aget_from_cache(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        try:
+            return await self.result_cache.aget(cache_key)
+        except Exception as e:
+            logger.warning(f"Error reading cache: {e}")
             return None
 
+    def _get_from_cache(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Retrieve a result from the cache if it exists and is not expired"""
         try:
-            with open(cache_file, "r") as f:
-                cached_data = json.load(f)
-
-            created_at = datetime.fromisoformat(cached_data.get("metadata", {}).get("timestamp", ""))
-            if datetime.now() - created_at > timedelta(seconds=self.cache_ttl):
-                return None
-                
-            return cached_data
+            return self.result_cache.get(cache_key)
         except Exception as e:
             logger.warning(f"Error reading cache: {e}")
-            return None 
+            return None
 
-    def _cache_result(self, cache_key: str, result: Dict[str, Any]) -> None:
+    def _cache_result(self, cache_key: str, result: Dict[str, Any], query_vector=None) -> None:
         """Store a result in the cache"""
-        cache_file = self.result_cache_path / f"{cache_key}.json"
-        
         try:
-            with open(cache_file, "w") as f:
-                json.dump(result, f)
+            self.result_cache.set(cache_key, result)
+            if query_vector is not None:
+                self.semantic_cache.add(query_vector, cache_key)
         except Exception as e:
             logger.warning(f"Error writing cache: {e}")
-            
+
     def cleanup_old_searches(self, max_age_hours: int = 24) -> None:
         """Clean up search contexts that haven't been used for a while"""
-        cutoff_time = datetime.now() - timedelta(hours=max_age_hours)
-        
-        to_remove = []
-        for result_id, context in self.active_searches.items():
-            if context["timestamp"] < cutoff_time:
-                to_remove.append(result_id)
-                
-        for result_id in to_remove:
-            del self.active_searches[result_id]
-            
-        logger.info(f"Cleaned up {len(to_remove)} old search contexts")
\ No newline at end of file
+        removed = self.active_searches.expire(max_age_hours * 3600)
+        logger.info(f"Cleaned up {removed} old search contexts")
+
+    def close(self) -> None:
+        """Persist the corpus, search contexts and history; call once on shutdown"""
+        self.source_executor.shutdown(wait=False, cancel_futures=True)
+        for pool, _ in self._source_pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        self.corpus_index.close()
+        self.active_searches.close()
+        self.search_history.close()
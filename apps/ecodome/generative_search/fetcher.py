@@ -0,0 +1,406 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from hashlib import blake2b
+from pathlib import Path
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from langchain.schema import Document
+
+from apps.core.metrics import count, timed
+from apps.core.cache.page_cache import CachedPage, PageCache
+from apps.core.resilience import DeadlineExceeded, Resilience, ShedError, resilience
+from apps.ecodome.generative_search.html_extract import HTMLTextExtractor, sniff_encoding
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (compatible; EcoViewBot/1.0)",
+    "Accept": "text/html,application/xhtml+xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en",
+}
+
+
+class FetchError(Exception):
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        # HTTP status of the failed response, if there was one
+        self.status = status
+
+
+def _is_host_failure(error: Exception) -> bool:
+    """Whether an error says the host is unhealthy, rather than that the page doesn't exist"""
+    status = getattr(error, "status", None)
+    return status is None or status >= 500 or status == 429
+
+
+class FetchResult(NamedTuple):
+    url: str
+    final_url: str
+    status: int
+    headers: Dict[str, str]
+    # None when the body was extracted while streaming instead of buffered
+    content: Optional[bytes]
+    encoding: Optional[str]
+    truncated: bool
+    elapsed: float
+    content_hash: Optional[str] = None
+    from_cache: bool = False
+    documents: Optional[List[Document]] = None
+
+    @property
+    def text(self) -> str:
+        return (self.content or b"").decode(self.encoding or "utf-8", errors="replace")
+
+
+class PageFetcher:
+    """
+    Shared HTTP fetcher for web pages.
+
+    One keep-alive `requests.Session` pools connections per host. At most
+    `max_concurrency` fetches run at once, and at most `max_per_host` against a
+    single host. Every fetch is bounded by its own `timeout` and by an optional
+    overall `deadline` (a `time.monotonic()` value), including the time spent
+    waiting for a slot, and bodies are cut off at `max_bytes`.
+
+    `load_documents`/`load_chunks` don't buffer the body: it is streamed into
+    an `HTMLTextExtractor`, which stops reading after `max_text_chars` of text.
+
+    With a `cache`, pages validated less than `fresh_for` seconds ago are read
+    from disk without a request; older ones are revalidated with a conditional
+    GET, and a 304 serves the stored body.
+
+    With `resilience`, requests go through its per-host circuit breakers and
+    adaptive limits, and slow ones are hedged. Hosts count as failing on
+    timeouts, connection errors, 5xx and 429, not on other 4xx. Extracted documents and chunks are
+    cached by content hash, so an unchanged page is never parsed or split twice.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        max_per_host: int = 4,
+        timeout: float = 10.0,
+        max_bytes: int = 5 * 1024 * 1024,
+        chunk_size: int = 64 * 1024,
+        max_text_chars: int = 500_000,
+        cache: Optional[PageCache] = None,
+        fresh_for: float = 300.0,
+        resilience: Optional[Resilience] = None
+    ):
+        self.resilience = resilience
+        self.max_text_chars = max_text_chars
+        self.cache = cache
+        self.fresh_for = fresh_for
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        adapter = HTTPAdapter(pool_connections=64, pool_maxsize=max_per_host, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="page-fetch")
+
+    def _host_slot(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return slot
+
+    def _time_left(self, deadline: Optional[float], timeout: Optional[float]) -> float:
+        timeout = self.timeout if timeout is None else timeout
+        if deadline is None:
+            return timeout
+        return max(0.0, min(timeout, deadline - time.monotonic()))
+
+    def fetch(self, url: str, deadline: Optional[float] = None, timeout: Optional[float] = None, extract: bool = False) -> FetchResult:
+        """
+        Fetch `url`, raising FetchError if it fails or the time budget runs out.
+
+        With `extract`, the body isn't kept in memory: a fetched page comes
+        back with its `documents`, and a cached one with just its content hash.
+        """
+        start = time.monotonic()
+        budget_end = start + self._time_left(deadline, timeout)
+        host = urlsplit(url).netloc.lower()
+        if not host:
+            raise FetchError(f"Invalid url {url}")
+
+        cached = self.cache.lookup(url) if self.cache is not None else None
+        if cached is not None and time.time() - cached.validated_at < self.fresh_for:
+            result = self._cached_result(cached, start, buffered=not extract)
+            if result is not None:
+                count("page_cache_hits")
+                return result
+
+        # wait for the host before taking a global slot, so a busy host doesn't hold slots other hosts could use
+        host_slot = self._host_slot(host)
+        if not host_slot.acquire(timeout=max(0.0, budget_end - time.monotonic())):
+            raise FetchError(f"No slot for {host} free before the deadline for {url}")
+        try:
+            if not self._slots.acquire(timeout=max(0.0, budget_end - time.monotonic())):
+                raise FetchError(f"No fetch slot free before the deadline for {url}")
+            try:
+                with timed("page_fetch"):
+                    # the host gets its full timeout from here; the caller's deadline only counts if it ends sooner
+                    host_timeout = self.timeout if timeout is None else timeout
+                    call_end = time.monotonic() + host_timeout
+                    caller_bound = deadline is not None and deadline < call_end
+                    call_end = deadline if caller_bound else call_end
+                    try:
+                        if self.resilience is None:
+                            return self._fetch(url, start, call_end, cached, extract, caller_bound)
+                        # the host is only blamed for running out its own timeout, not the caller's deadline
+                        return self.resilience.call(
+                            host, self._fetch, url, start, call_end, cached, extract, caller_bound,
+                            timeout=host_timeout, deadline=deadline if caller_bound else None,
+                            is_failure=_is_host_failure
+                        )
+                    except (ShedError, TimeoutError) as e:
+                        raise FetchError(f"Failed to fetch {url}: {e}") from e
+            finally:
+                self._slots.release()
+        finally:
+            host_slot.release()
+
+    def _cached_result(self, cached: CachedPage, start: float, buffered: bool = True) -> Optional[FetchResult]:
+        if buffered:
+            content = self.cache.read_body(cached.content_hash)
+            if content is None:
+                return None
+        elif self.cache.has_body(cached.content_hash):
+            content = None
+        else:
+            return None
+        return FetchResult(
+            url=cached.url,
+            final_url=cached.final_url,
+            status=200,
+            headers={},
+            content=content,
+            encoding=cached.encoding,
+            truncated=cached.truncated,
+            elapsed=time.monotonic() - start,
+            content_hash=cached.content_hash,
+            from_cache=True,
+        )
+
+    @staticmethod
+    def _conditional_headers(cached: Optional[CachedPage]) -> Dict[str, str]:
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+        return headers
+
+    def _fetch(
+        self,
+        url: str,
+        start: float,
+        budget_end: float,
+        cached: Optional[CachedPage] = None,
+        extract: bool = False,
+        caller_bound: bool = False
+    ) -> FetchResult:
+        """
+        Fetch `url` by `budget_end`; running out of time raises DeadlineExceeded
+        if `budget_end` is the caller's deadline (`caller_bound`), else a plain
+        TimeoutError that counts against the host.
+        """
+        timeout_error = DeadlineExceeded if caller_bound else TimeoutError
+        remaining = budget_end - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Deadline reached before fetching {url}")
+
+        spool = None
+        result = None
+        try:
+            with self.session.get(url, headers=self._conditional_headers(cached), timeout=remaining, stream=True) as response:
+                if response.status_code == 304 and cached is not None:
+                    result = self._cached_result(self.cache.revalidated(cached, response.headers), start, buffered=not extract)
+                    if result is not None:
+                        count("page_cache_revalidated")
+                        return result
+                    # the body was evicted under us, so fetch it again in full
+                    response.close()
+                    return self._fetch(url, start, budget_end, None, extract, caller_bound)
+
+                response.raise_for_status()
+                encoding = response.encoding if "charset" in response.headers.get("Content-Type", "") else None
+                extractor = HTMLTextExtractor(self.max_text_chars, encoding) if extract else None
+                body = None if extract else bytearray()
+                if self.cache is not None and "no-store" not in response.headers.get("Cache-Control", ""):
+                    spool = self.cache.spool()
+                hasher = blake2b(digest_size=20)
+                size = 0
+                truncated = False
+                for chunk in response.iter_content(self.chunk_size):
+                    if size + len(chunk) > self.max_bytes:
+                        chunk = chunk[:self.max_bytes - size]
+                        truncated = True
+                    if not size and encoding is None:
+                        encoding = sniff_encoding(chunk)
+                    size += len(chunk)
+                    hasher.update(chunk)
+                    if body is not None:
+                        body += chunk
+                    if spool is not None:
+                        spool.write(chunk)
+                    if extractor is not None:
+                        extractor.feed_bytes(chunk)
+                        # enough text: the rest of the page isn't needed
+                        truncated = truncated or extractor.full
+                    if truncated:
+                        break
+                    # the socket timeout only bounds each read, so check the overall budget too
+                    if time.monotonic() > budget_end:
+                        raise timeout_error(f"Deadline reached while reading {url}")
+                result = FetchResult(
+                    url=url,
+                    final_url=response.url,
+                    status=response.status_code,
+                    headers=dict(response.headers),
+                    content=None if body is None else bytes(body),
+                    encoding=encoding,
+                    truncated=truncated,
+                    elapsed=time.monotonic() - start,
+                    content_hash=hasher.hexdigest(),
+                    documents=extractor.documents(url) if extractor is not None else None,
+                )
+        except requests.Timeout as e:
+            raise timeout_error(f"Timed out fetching {url}: {e}") from e
+        except requests.RequestException as e:
+            status = e.response.status_code if e.response is not None else None
+            raise FetchError(f"Failed to fetch {url}: {e}", status) from e
+        finally:
+            if spool is not None:
+                spool.close()
+                if result is None:
+                    os.unlink(spool.name)
+
+        count("pages_fetched")
+        count("bytes_fetched", size)
+        if truncated:
+            logger.info(f"Stopped reading {url} after {size} bytes")
+        if spool is not None:
+            try:
+                self.cache.store(
+                    url, result.content_hash, Path(spool.name), result.final_url,
+                    result.encoding, result.headers, truncated
+                )
+            except Exception as e:
+                logger.warning(f"Failed to cache {url}: {e}")
+        return result
+
+    def load_documents(self, url: str, deadline: Optional[float] = None, timeout: Optional[float] = None) -> List[Document]:
+        """Fetch a page and return its text as a Document, like WebBaseLoader"""
+        return self.to_documents(self.fetch(url, deadline, timeout, extract=True))
+
+    def load_many(self, urls: Sequence[str], deadline: Optional[float] = None, timeout: Optional[float] = None) -> Dict[str, Union[List[Document], Exception]]:
+        """`load_documents` for the distinct `urls` concurrently; maps each url to its documents or the error it raised"""
+        unique = list(dict.fromkeys(urls))
+        # each load gets its own copy of the caller's context, so fetch metrics reach the request trace
+        futures = {
+            url: self.executor.submit(contextvars.copy_context().run, self.load_documents, url, deadline, timeout)
+            for url in unique
+        }
+        results = {}
+        for url, future in futures.items():
+            try:
+                results[url] = future.result()
+            except Exception as e:
+                results[url] = e
+        return results
+
+    def load_chunks(self, url: str, text_splitter, deadline: Optional[float] = None, timeout: Optional[float] = None) -> List[Document]:
+        """Fetch a page and split its documents, reusing the chunks cached for the same content and splitter"""
+        result = self.fetch(url, deadline, timeout, extract=True)
+        kind = "chunks-" + "-".join(str(part) for part in (
+            type(text_splitter).__name__,
+            getattr(text_splitter, "_chunk_size", ""),
+            getattr(text_splitter, "_chunk_overlap", ""),
+        ))
+        return self._derived(result, kind, lambda: text_splitter.split_documents(self.to_documents(result)))
+
+    def to_documents(self, result: FetchResult) -> List[Document]:
+        return self._derived(result, "text", lambda: self._extract(result))
+
+    def _derived(self, result: FetchResult, kind: str, derive) -> List[Document]:
+        """Documents derived from a page's body, cached under its content hash"""
+        if self.cache is None or result.content_hash is None:
+            return derive()
+
+        stored = self.cache.get_artifact(result.content_hash, kind)
+        if stored is not None:
+            count("page_cache_artifact_hits")
+            # the same content may have been fetched from another url
+            return [Document(page_content=doc["page_content"], metadata={**doc["metadata"], "source": result.url}) for doc in stored]
+
+        docs = derive()
+        try:
+            self.cache.set_artifact(result.content_hash, kind, [_dump_document(doc) for doc in docs])
+        except Exception as e:
+            logger.warning(f"Failed to cache {kind} of {result.url}: {e}")
+        return docs
+
+    def _extract(self, result: FetchResult) -> List[Document]:
+        """The page's documents: extracted while it streamed in, or else from its buffered or cached body"""
+        if result.documents is not None:
+            return result.documents
+
+        extractor = HTMLTextExtractor(self.max_text_chars, result.encoding)
+        if result.content is not None:
+            view = memoryview(result.content)
+            for offset in range(0, len(view), self.chunk_size):
+                extractor.feed_bytes(view[offset:offset + self.chunk_size].tobytes())
+                if extractor.full:
+                    break
+        else:
+            body = self.cache.open_body(result.content_hash) if self.cache is not None else None
+            if body is None:
+                raise FetchError(f"Body of {result.url} is no longer cached")
+            with body:
+                while not extractor.full and (chunk := body.read(self.chunk_size)):
+                    extractor.feed_bytes(chunk)
+        return extractor.documents(result.url)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+def _dump_document(doc: Document) -> Dict[str, Any]:
+    metadata = {key: value for key, value in doc.metadata.items() if key != "source"}
+    return {"page_content": doc.page_content, "metadata": metadata}
+
+
+_fetcher: Optional[PageFetcher] = None
+_fetcher_lock = threading.Lock()
+
+def get_fetcher() -> PageFetcher:
+    """The page fetcher shared by this process, so every caller shares its connection pools and limits"""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            cache_path = os.path.join("./.runtime", os.getenv("PAGE_CACHE_STORE", "page_cache"))
+            _fetcher = PageFetcher(cache=PageCache(cache_path), resilience=resilience)
+        return _fetcher
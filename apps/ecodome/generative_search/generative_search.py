@@ -1,7 +1,8 @@
 
 import os
 import logging
-from typing import Dict
+from pathlib import Path
+from typing import Dict, Optional
 
 from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
@@ -11,7 +12,6 @@ from langchain.schema import Document
 from langchain_community.vectorstores.faiss import FAISS
 from langchain_core.output_parsers import StrOutputParser
 from langchain.chains.summarize import load_summarize_chain
-from langchain_community.document_loaders import WebBaseLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.runnables import RunnableParallel, RunnablePassthrough
 
@@ -19,27 +19,24 @@ from apps.tasks import get_task_result
 from apps.ecodome.data_synthesis.knowledge.knowledge_base import KnowledgeBase
 from apps.rpc_methods.utils import url_to_filename
 from apps.tasks.google_search import async_google_image_search, async_product_google_search
+from apps.ecodome.generative_search.context_packer import ContextPacker
+from apps.ecodome.generative_search.fetcher import get_fetcher
+from apps.ecodome.generative_search.index_registry import IndexRegistry
 
-def split_webpage(webpage_url: str):
-    loader = WebBaseLoader(webpage_url)
-    docs = loader.load()
+context_packer = ContextPacker.for_model("gemini-pro")
+index_registry = IndexRegistry(Path(os.getenv("GENERATIVE_SEARCH_INDEX_PATH", "./.runtime/indexes")))
+
+def split_webpage(webpage_url: str, deadline: Optional[float] = None):
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    docs = text_splitter.split_documents(docs)
-    return docs
+    return get_fetcher().load_chunks(webpage_url, text_splitter, deadline=deadline)
 
 def create_or_get_vectorstore(docs, gen_ai_result_id, embedding_model):
-    index_path = os.path.join('./.runtimes/indexes', f'{gen_ai_result_id}_index')
-    if os.path.exists(index_path):
-        db = FAISS.load_local(f"{gen_ai_result_id}_index", embedding_model)
-
-    db = FAISS.from_documents(docs, embedding_model)
-    db.save_local(index_path)
-
-    return db
+    """The result's index, reused while it was built from the same docs and embedding model"""
+    return index_registry.get_or_build(gen_ai_result_id, docs, embedding_model)
 
 
-def format_docs(docs):
-    return "\n\n".join(doc.page_content for doc in docs)
+def format_docs(docs, query: str = ""):
+    return context_packer.format(query, docs)
 
 GENERATIVE_SEARCH_QNA_PROMPT = """
 You are an assistant for question-answering tasks. Use the following pieces of retrieved context to answer the question. If you don't know the answer, just say that you don't know. Use three sentences maximum and keep the answer concise.
@@ -59,7 +56,7 @@ def get_generative_search_chain(db, embedding_model, chat_model, query):
 
     retreiver = similar_embeddings.as_retriever()
     rag_chain = (
-        RunnablePassthrough.assign(context=(lambda x: format_docs(x["context"])))
+        RunnablePassthrough.assign(context=(lambda x: format_docs(x["context"], x["question"])))
         | prompt
         | chat_model
         | StrOutputParser()
@@ -81,7 +78,7 @@ def generative_search(result_id, llm, embedding_model, search_term: str, image_u
             image_search_result = async_google_image_search(image_url=image_url)
             subject, webpage_url, image_results = image_search_result
             if webpage_url:
-                docs = split_webpage(embedding_model=embedding_model, webpage_url=webpage_url)
+                docs = split_webpage(webpage_url=webpage_url)
                 db = create_or_get_vectorstore(docs=docs, embedding_model=embedding_model, gen_ai_result_id=result_id)
                 rag_chain = get_generative_search_chain(chat_model=llm, embedding_model=embedding_model, db=db, query=search_term)
                 QUERY = f"Explain the topic {search_term} in details. Explain in a point-wise manner."
@@ -91,6 +88,7 @@ def generative_search(result_id, llm, embedding_model, search_term: str, image_u
         else:
             # google_search_task = perform_product_google_search(search_term)
             google_search_result = async_product_google_search(search_term)
+            google_search_result = context_packer.pack_text(search_term, google_search_result)
             QUERY_PROMPT = f"Using the context : {google_search_result}.\n Explain the topic {search_term} in details. Explain in a point-wise manner."
             output_parser = StrOutputParser()
             question = f"Explain {search_term}"
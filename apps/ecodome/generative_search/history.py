@@ -0,0 +1,157 @@
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, NamedTuple
+
+from apps.core.metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryRecord(NamedTuple):
+    result_id: str
+    query: str
+    created_at: float
+    sources_count: int
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "result_id": self.result_id,
+            "query": self.query,
+            "timestamp": datetime.fromtimestamp(self.created_at).isoformat(),
+            "sources_count": self.sources_count
+        }
+
+
+class SearchHistoryStore:
+    """
+    Per-user search history shared by every worker.
+
+    Appends go to a fixed-size in-memory ring buffer per user and to a pending
+    batch that is flushed to a SQLite table, either once it reaches
+    `flush_size` records or every `flush_interval` seconds. Reads are served
+    from the table, so every worker sees the same history; the ring buffers are
+    only used if it can't be read. Each flush deletes a user's records beyond
+    the newest `max_entries_per_user`. A failed flush is retried with the next
+    one, keeping at most `max_pending` records; older ones are dropped and
+    counted in `search_history_dropped_total`.
+    """
+
+    def __init__(self, db_path: Path, max_entries_per_user: int = 100, max_users: int = 10000, flush_size: int = 64, flush_interval: float = 2.0, max_pending: int = 10000):
+        self.db_path = Path(db_path)
+        self.max_entries_per_user = max_entries_per_user
+        self.max_users = max_users
+        self.flush_size = flush_size
+        # records kept for retry while the database can't be written; the oldest are dropped beyond it
+        self.max_pending = max_pending
+        self.dropped_total = metrics.counter("search_history_dropped_total")
+
+        self._recent: "OrderedDict[str, Deque[HistoryRecord]]" = OrderedDict()
+        self._pending: List[tuple] = []
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS search_history ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, result_id TEXT NOT NULL, "
+            "query TEXT NOT NULL, created_at REAL NOT NULL, sources_count INTEGER NOT NULL)"
+        )
+        # workers flush on their own timers, so ids aren't in time order across workers
+        self._db.execute("DROP INDEX IF EXISTS search_history_user")
+        self._db.execute("CREATE INDEX IF NOT EXISTS search_history_user_created ON search_history (user_id, created_at, id)")
+        self._db.commit()
+
+        self.flush_interval = flush_interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._flush_periodically, name="search-history-flush", daemon=True)
+        self.thread.start()
+
+    def append(self, user_id: str, result_id: str, query: str, sources_count: int) -> None:
+        record = HistoryRecord(result_id, query, time.time(), sources_count)
+        with self._lock:
+            ring = self._recent.get(user_id)
+            if ring is None:
+                ring = self._recent[user_id] = deque(maxlen=self.max_entries_per_user)
+                if len(self._recent) > self.max_users:
+                    self._recent.popitem(last=False)
+            else:
+                self._recent.move_to_end(user_id)
+            ring.append(record)
+
+            self._pending.append((user_id, *record))
+            should_flush = len(self._pending) >= self.flush_size
+
+        if should_flush:
+            self.flush()
+
+    def get(self, user_id: str, offset: int = 0, limit: int = 20) -> List[Dict[str, Any]]:
+        """A page of the user's history, most recent first"""
+        try:
+            self.flush()
+            with self._db_lock:
+                rows = self._db.execute(
+                    "SELECT result_id, query, created_at, sources_count FROM search_history "
+                    "WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+                    (user_id, limit, offset)
+                ).fetchall()
+            return [HistoryRecord(*row).to_dict() for row in rows]
+        except sqlite3.Error as e:
+            logger.warning(f"Error reading search history, serving this worker's recent history: {e}")
+            with self._lock:
+                records = list(reversed(self._recent.get(user_id, ())))
+            return [record.to_dict() for record in records[offset:offset + limit]]
+
+    def flush(self) -> None:
+        """Write pending records to the table in one transaction"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        try:
+            with self._db_lock:
+                self._db.executemany(
+                    "INSERT INTO search_history (user_id, result_id, query, created_at, sources_count) VALUES (?, ?, ?, ?, ?)",
+                    pending
+                )
+                # keep only the newest records of the users we just wrote to
+                for user_id in {row[0] for row in pending}:
+                    self._db.execute(
+                        "DELETE FROM search_history WHERE user_id = ? AND id NOT IN "
+                        "(SELECT id FROM search_history WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?)",
+                        (user_id, user_id, self.max_entries_per_user)
+                    )
+                self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Error flushing search history: {e}")
+            # undo the part of the batch that was written, or retrying it would store it twice
+            with self._db_lock:
+                self._db.rollback()
+            with self._lock:
+                self._pending = pending + self._pending
+                overflow = len(self._pending) - self.max_pending
+                if overflow > 0:
+                    del self._pending[:overflow]
+            if overflow > 0:
+                self.dropped_total.inc(overflow)
+                logger.warning(f"Dropped {overflow} search history records that could not be written")
+
+    def _flush_periodically(self) -> None:
+        while not self.stop_event.wait(timeout=self.flush_interval):
+            self.flush()
+
+    def close(self) -> None:
+        self.stop_event.set()
+        self.thread.join()
+        self.flush()
+        with self._db_lock:
+            self._db.close()
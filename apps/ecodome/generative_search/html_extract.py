@@ -0,0 +1,136 @@
+import re
+import codecs
+from html.parser import HTMLParser
+from typing import Dict, List, Optional
+
+from langchain.schema import Document
+
+# subtrees whose text isn't page content
+SKIP_TAGS = frozenset(("script", "style", "noscript", "template", "svg", "nav", "iframe"))
+# elements that start a new line, so paragraphs and list items stay apart for chunking
+BLOCK_TAGS = frozenset((
+    "address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt", "figcaption", "figure",
+    "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "li", "main", "ol", "p", "pre",
+    "section", "table", "td", "th", "tr", "ul",
+))
+
+CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([A-Za-z0-9_.:-]+)', re.IGNORECASE)
+
+
+def sniff_encoding(chunk: bytes) -> Optional[str]:
+    """The `<meta charset>` declared near the start of a page, if any"""
+    match = CHARSET_RE.search(chunk[:4096])
+    return match.group(1).decode("ascii") if match else None
+
+
+class HTMLTextExtractor(HTMLParser):
+    """
+    Incremental HTML-to-text extraction.
+
+    Feed the body as it arrives with `feed_bytes`; only the extracted text is
+    kept, never the markup or a tree. Script, style and navigation subtrees are
+    dropped as they stream past, block elements become line breaks, and once
+    `max_chars` of text have been gathered `full` is set so the caller can stop
+    reading. The title, meta description and language are kept as metadata.
+
+    Without an `encoding` (no charset in the Content-Type), a `<meta charset>`
+    in the first chunk is used, and UTF-8 otherwise.
+    """
+
+    def __init__(self, max_chars: int = 500_000, encoding: Optional[str] = None):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.encoding = encoding
+        self.metadata: Dict[str, str] = {}
+        self.full = False
+        self._decoder = None
+        self._parts: List[str] = []
+        self._chars = 0
+        self._skip_depth = 0
+        self._in_title = False
+        self._title: List[str] = []
+
+    def feed_bytes(self, chunk: bytes) -> None:
+        if self.full:
+            return
+        if self._decoder is None:
+            if self.encoding is None:
+                self.encoding = sniff_encoding(chunk) or "utf-8"
+            try:
+                self._decoder = codecs.getincrementaldecoder(self.encoding)(errors="replace")
+            except LookupError:
+                self.encoding = "utf-8"
+                self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.feed(self._decoder.decode(chunk))
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+            return
+        if self._skip_depth:
+            return
+        if tag == "title":
+            self._in_title = True
+        elif tag == "meta":
+            attrs = dict(attrs)
+            if (attrs.get("name") or "").lower() == "description" and attrs.get("content"):
+                self.metadata.setdefault("description", attrs["content"])
+        elif tag == "html":
+            lang = dict(attrs).get("lang")
+            if lang:
+                self.metadata["language"] = lang
+        if tag in BLOCK_TAGS:
+            self._append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        # a self-closing <nav/> or <svg/> has no subtree to skip
+        if tag not in SKIP_TAGS:
+            super().handle_startendtag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            if self._skip_depth:
+                self._skip_depth -= 1
+            return
+        if self._skip_depth:
+            return
+        if tag == "title":
+            self._in_title = False
+            title = " ".join("".join(self._title).split())
+            if title:
+                self.metadata.setdefault("title", title)
+        if tag in BLOCK_TAGS:
+            self._append("\n")
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        if self._in_title:
+            self._title.append(data)
+            return
+        self._append(data)
+
+    def _append(self, text: str) -> None:
+        if self.full:
+            return
+        remaining = self.max_chars - self._chars
+        if len(text) >= remaining:
+            text = text[:remaining]
+            self.full = True
+        self._parts.append(text)
+        self._chars += len(text)
+
+    def text(self) -> str:
+        """The text so far, one line per block with whitespace collapsed"""
+        lines = (" ".join(line.split()) for line in "".join(self._parts).split("\n"))
+        return "\n".join(line for line in lines if line)
+
+    def documents(self, source: str) -> List[Document]:
+        """The extracted page as Documents ready for chunking"""
+        self.close()
+        return [Document(page_content=self.text(), metadata={"source": source, **self.metadata})]
+
+    def close(self) -> None:
+        if self._decoder is not None and not self.full:
+            self.feed(self._decoder.decode(b"", final=True))
+        super().close()
@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import logging
+import threading
+from pathlib import Path
+from hashlib import blake2b
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.schema import Document
+from langchain_community.vectorstores.faiss import FAISS
+
+from apps.core.metrics import count
+from apps.ecodome.generative_search.vector_index import VectorIndexConfig, build_vectorstore, load_vectorstore, save_vectorstore
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+
+
+def embedding_id(embedding_model) -> str:
+    """Identifies the model behind `embedding_model`, so indexes aren't queried with another model's vectors"""
+    model = getattr(embedding_model, "underlying_embeddings", embedding_model)
+    model = getattr(model, "embedding_model", model)
+    if hasattr(model, "spec"):
+        return json.dumps(model.spec(), sort_keys=True)
+    return str(getattr(model, "model", type(model).__name__))
+
+
+def documents_fingerprint(docs: List[Document], embedding_model) -> str:
+    digest = blake2b(embedding_id(embedding_model).encode("utf-8"), digest_size=20)
+    for doc in docs:
+        digest.update(b"\0")
+        digest.update(doc.page_content.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class IndexRegistry:
+    """
+    Per-result FAISS indexes on disk, with an in-memory LRU of loaded stores.
+
+    An index is reused while it was built from the same documents with the
+    same embedding model (a fingerprint kept in its manifest) and is younger
+    than `max_age`; otherwise it is rebuilt. Each build is written to a fresh
+    version directory and published by atomically swapping the `<id>_index`
+    symlink, so readers never see a half-written index. Builds of one index
+    are serialized across processes with an flock, and a worker that waited
+    on the lock loads what the other one built instead of embedding again.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        max_handles: int = 32,
+        max_age: Optional[float] = 7 * 24 * 3600,
+        index_config: VectorIndexConfig = VectorIndexConfig(),
+        mmap: bool = False
+    ):
+        self.root = Path(root)
+        self.max_handles = max_handles
+        self.max_age = max_age
+        self.index_config = index_config
+        self.mmap = mmap
+        self.root.mkdir(parents=True, exist_ok=True)
+        (self.root / "locks").mkdir(exist_ok=True)
+
+        # index id -> (manifest, store)
+        self._handles: "OrderedDict[str, Tuple[Dict[str, Any], FAISS]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def index_path(self, index_id: str) -> Path:
+        return self.root / f"{index_id}_index"
+
+    def get_or_build(self, index_id: str, docs: List[Document], embedding_model) -> FAISS:
+        """The index of `docs` for `index_id`, loaded or built only if there is no current one"""
+        fingerprint = documents_fingerprint(docs, embedding_model)
+
+        store = self._cached(index_id, fingerprint)
+        if store is not None:
+            count("index_registry_memory_hits")
+            return store
+
+        store = self._load(index_id, fingerprint, embedding_model)
+        if store is not None:
+            count("index_registry_disk_hits")
+            return store
+
+        with self._build_lock(index_id):
+            # another worker may have built it while we waited for the lock
+            store = self._load(index_id, fingerprint, embedding_model)
+            if store is not None:
+                count("index_registry_disk_hits")
+                return store
+            return self._build(index_id, fingerprint, docs, embedding_model)
+
+    def _fresh(self, manifest: Optional[Dict[str, Any]], fingerprint: str) -> bool:
+        if manifest is None or manifest.get("fingerprint") != fingerprint:
+            return False
+        return self.max_age is None or time.time() - manifest.get("built_at", 0) < self.max_age
+
+    def _cached(self, index_id: str, fingerprint: str) -> Optional[FAISS]:
+        with self._lock:
+            entry = self._handles.get(index_id)
+            if entry is None or not self._fresh(entry[0], fingerprint):
+                return None
+            # a newer build may have been published by another worker
+            if entry[0].get("version") != self._current_version(index_id):
+                return None
+            self._handles.move_to_end(index_id)
+            return entry[1]
+
+    def _remember(self, index_id: str, manifest: Dict[str, Any], store: FAISS) -> None:
+        with self._lock:
+            self._handles[index_id] = (manifest, store)
+            self._handles.move_to_end(index_id)
+            while len(self._handles) > self.max_handles:
+                self._handles.popitem(last=False)
+
+    def _current_version(self, index_id: str) -> Optional[str]:
+        try:
+            return os.readlink(self.index_path(index_id))
+        except OSError:
+            return None
+
+    def _load(self, index_id: str, fingerprint: str, embedding_model) -> Optional[FAISS]:
+        # a version can be removed by a newer build between resolving the link and reading it, so retry once
+        for _ in range(2):
+            version = self._current_version(index_id)
+            if version is None:
+                return None
+            folder = self.root / version
+            try:
+                manifest = json.loads((folder / MANIFEST_FILE).read_text())
+                if not self._fresh(manifest, fingerprint):
+                    return None
+                store = load_vectorstore(folder, embedding_model, mmap=self.mmap)
+            except FileNotFoundError:
+                continue
+            except RuntimeError:
+                # faiss reports a file that vanished mid-read as a RuntimeError; anything else is a broken index
+                if folder.exists() and self._current_version(index_id) == version:
+                    raise
+                continue
+            self._remember(index_id, manifest, store)
+            return store
+        return None
+
+    @contextmanager
+    def _build_lock(self, index_id: str):
+        with open(self.root / "locks" / f"{index_id}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _build(self, index_id: str, fingerprint: str, docs: List[Document], embedding_model) -> FAISS:
+        """Embed and save a new version of the index, then point `<id>_index` at it; needs `_build_lock`"""
+        if not docs:
+            raise ValueError(f"No documents to index for {index_id}")
+
+        start = time.monotonic()
+        embeddings = embedding_model.embed_documents([doc.page_content for doc in docs])
+        store = build_vectorstore([(docs, embeddings)], embedding_model, self.index_config)
+
+        version = f"{index_id}_index.{uuid.uuid4().hex[:12]}"
+        folder = self.root / version
+        save_vectorstore(store, folder, self.index_config)
+        manifest = {"fingerprint": fingerprint, "built_at": time.time(), "documents": len(docs), "version": version}
+        (folder / MANIFEST_FILE).write_text(json.dumps(manifest))
+
+        link_path = self.index_path(index_id)
+        previous = self._current_version(index_id)
+        tmp_link = self.root / f".{version}.link"
+        os.symlink(version, tmp_link)
+        os.replace(tmp_link, link_path)
+        if previous is not None:
+            shutil.rmtree(self.root / previous, ignore_errors=True)
+
+        self._remember(index_id, manifest, store)
+        count("index_registry_builds")
+        logger.info(f"Built index {index_id} from {len(docs)} documents in {time.monotonic() - start:.2f}s")
+        return store
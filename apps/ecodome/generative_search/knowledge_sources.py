@@ -1,33 +1,43 @@
 import os
+import time
+import asyncio
 import logging
-import requests
+import contextvars
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Tuple, Optional
 
-from langchain_community.document_loaders import WebBaseLoader
 from langchain.schema import Document
 from apps.tasks.google_search import async_google_image_search, async_product_google_search
 from apps.ecodome.data_synthesis.knowledge.knowledge_base import KnowledgeBase
+from apps.ecodome.generative_search.fetcher import PageFetcher, get_fetcher
 
 logger = logging.getLogger(__name__)
 
 class KnowledgeSource(ABC):
     """Abstract base class for knowledge sources"""
     
-    def __init__(self, id: str, name: str):
+    def __init__(self, id: str, name: str, timeout: float = 10.0):
         self.id = id
         self.name = name
+        # default time budget (seconds) for a single retrieval
+        self.timeout = timeout
     
     @abstractmethod
     def retrieve_knowledge(
         self, 
         query: str, 
         image_url: Optional[str] = None,
-        filters: Optional[Dict[str, Any]] = None
+        filters: Optional[Dict[str, Any]] = None,
+        deadline: Optional[float] = None
     ) -> Tuple[List[Document], List[Dict[str, Any]]]:
         """
         Retrieve knowledge from the source
         
+        Args:
+            deadline: `time.monotonic()` value after which the source should stop
+                and return whatever it has gathered so far
+        
         Returns:
             Tuple containing:
                 - List of Documents
@@ -35,115 +45,256 @@ class KnowledgeSource(ABC):
         """
         pass
 
+    async def aretrieve_knowledge(
+        self,
+        query: str,
+        image_url: Optional[str] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        deadline: Optional[float] = None
+    ) -> Tuple[List[Document], List[Dict[str, Any]]]:
+        """
+        Async `retrieve_knowledge`. By default the blocking implementation runs in
+        a worker thread; sources with native async I/O should override this.
+        """
+        return await asyncio.to_thread(self.retrieve_knowledge, query, image_url, filters, deadline)
+
+    def retrieve_knowledge_many(
+        self,
+        queries: List[Tuple[str, Optional[str], Optional[Dict[str, Any]]]],
+        deadline: Optional[float] = None
+    ) -> List[Tuple[List[Document], List[Dict[str, Any]]]]:
+        """
+        Retrieve knowledge for several `(query, image_url, filters)` at once.
+
+        Returns one `(documents, metadata)` pair per query, in order. Sources that
+        can share work between queries should override this.
+        """
+        return [self.retrieve_knowledge(query, image_url, filters, deadline) for query, image_url, filters in queries]
+
+    @staticmethod
+    def time_left(deadline: Optional[float]) -> Optional[float]:
+        """Seconds remaining until the deadline, or None if there is no deadline"""
+        if deadline is None:
+            return None
+        return max(0.0, deadline - time.monotonic())
+
 class WebKnowledgeSource(KnowledgeSource):
     """Knowledge source that retrieves information from the web"""
     
-    def __init__(self):
-        super().__init__(id="web", name="Web Search")
+    def __init__(self, timeout: float = 15.0, max_concurrent_pages: int = 8, fetcher: Optional[PageFetcher] = None, async_workers: int = 8):
+        super().__init__(id="web", name="Web Search", timeout=timeout)
+        self.max_concurrent_pages = max_concurrent_pages
+        # shared by default, so all sources reuse the same connection pools and concurrency limits
+        self.fetcher = fetcher or get_fetcher()
+        # threads for `aretrieve_knowledge`, kept apart from the event loop's default executor
+        self.async_executor = ThreadPoolExecutor(max_workers=async_workers, thread_name_prefix="web-source")
     
     def retrieve_knowledge(
         self, 
         query: str, 
         image_url: Optional[str] = None,
-        filters: Optional[Dict[str, Any]] = None
+        filters: Optional[Dict[str, Any]] = None,
+        deadline: Optional[float] = None
+    ) -> Tuple[List[Document], List[Dict[str, Any]]]:
+        try:
+            pages, documents, metadata = self._find_pages(query, image_url)
+
+            loaded = self._load_pages(pages, deadline)
+            for page in pages:
+                page_docs = loaded.get(page["url"])
+                if page_docs:
+                    documents.extend(page_docs)
+                    metadata.append(page)
+
+            return documents, metadata
+        except Exception as e:
+            logger.exception(f"Error retrieving web knowledge: {str(e)}")
+            return self._error_result(query, e)
+
+    async def aretrieve_knowledge(
+        self,
+        query: str,
+        image_url: Optional[str] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        deadline: Optional[float] = None
     ) -> Tuple[List[Document], List[Dict[str, Any]]]:
+        """
+        Async `retrieve_knowledge`.
+
+        The search and page fetches are blocking HTTP calls run on this
+        source's own `async_workers` threads, so cancelling the awaiting task
+        doesn't stop them: they end on their own at `deadline`. At most
+        `async_workers` retrievals run at once, and leftovers from cancelled
+        ones never hold threads of the loop's default executor.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.async_executor, contextvars.copy_context().run, self.retrieve_knowledge, query, image_url, filters, deadline
+        )
+
+    def retrieve_knowledge_many(
+        self,
+        queries: List[Tuple[str, Optional[str], Optional[Dict[str, Any]]]],
+        deadline: Optional[float] = None
+    ) -> List[Tuple[List[Document], List[Dict[str, Any]]]]:
+        """Run every search, then load each distinct page only once and share it between queries"""
+        def find(item):
+            query, image_url, _ = item
+            try:
+                return self._find_pages(query, image_url)
+            except Exception as e:
+                logger.exception(f"Error retrieving web knowledge: {str(e)}")
+                return e
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_pages) as executor:
+            found = list(executor.map(find, queries))
+
+        unique_pages = {}
+        for item in found:
+            if not isinstance(item, Exception):
+                for page in item[0]:
+                    unique_pages.setdefault(page["url"], page)
+
+        logger.info(f"Loading {len(unique_pages)} distinct pages for {len(queries)} queries")
+        loaded = self._load_pages(list(unique_pages.values()), deadline)
+
+        results = []
+        for (query, _, _), item in zip(queries, found):
+            if isinstance(item, Exception):
+                results.append(self._error_result(query, item))
+                continue
+            pages, documents, metadata = item
+            for page in pages:
+                if loaded.get(page["url"]):
+                    documents.extend(loaded[page["url"]])
+                    metadata.append(page)
+            results.append((documents, metadata))
+        return results
+
+    def _find_pages(self, query: str, image_url: Optional[str] = None):
+        """
+        Run the image or web search.
+
+        Returns the pages to load (each one a metadata dict with a `url`), plus any
+        documents and metadata the search produced inline.
+        """
+        pages = []
         documents = []
         metadata = []
-        
-        try:
-            if image_url:
-                # Use image search
-                subject, webpage_url, image_results = async_google_image_search(image_url=image_url)
+
+        if image_url:
+            # Use image search
+            subject, webpage_url, image_results = async_google_image_search(image_url=image_url)
+            
+            if webpage_url:
+                pages.append({
+                    "source_type": "image_search",
+                    "url": webpage_url,
+                    "title": subject or "Image Search Result",
+                    "images": image_results or []
+                })
+        else:
+            search_results = async_product_google_search(query)
+            
+            if isinstance(search_results, list):
+                for result in search_results:
+                    if isinstance(result, dict) and "url" in result:
+                        pages.append({
+                            "source_type": "web_search",
+                            "url": result["url"],
+                            "title": result.get("title", result["url"]),
+                            "snippet": result.get("snippet", "")
+                        })
+            elif isinstance(search_results, str):
+                documents.append(Document(page_content=search_results, metadata={"source": "web_search"}))
                 
-                if webpage_url:
-                    loader = WebBaseLoader(webpage_url)
-                    webpage_docs = loader.load()
-                    documents.extend(webpage_docs)
-                    
-                    metadata.append({
-                        "source_type": "image_search",
-                        "url": webpage_url,
-                        "title": subject or "Image Search Result",
-                        "images": image_results or []
-                    })
+                metadata.append({
+                    "source_type": "web_search",
+                    "title": f"Search results for: {query}",
+                    "content": search_results[:200] + "..." if len(search_results) > 200 else search_results
+                })
+
+        return pages, documents, metadata
+
+    def _load_pages(self, pages: List[Dict[str, Any]], deadline: Optional[float] = None) -> Dict[str, List[Document]]:
+        """
+        Fetch the pages concurrently through the shared fetcher.
+
+        Each page is bounded by the source timeout and all of them by the
+        deadline; pages that fail or run out of time are left out.
+        """
+        if not pages or self.time_left(deadline) == 0:
+            return {}
+        fetched = self.fetcher.load_many([page["url"] for page in pages], deadline=deadline, timeout=self.timeout)
+
+        loaded = {}
+        for url, result in fetched.items():
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to load {url}: {str(result)}")
             else:
-                search_results = async_product_google_search(query)
-                
-                if isinstance(search_results, list):
-                    for result in search_results:
-                        if isinstance(result, dict) and "url" in result:
-                            try:
-                                loader = WebBaseLoader(result["url"])
-                                page_docs = loader.load()
-                                documents.extend(page_docs)
-                                
-                                metadata.append({
-                                    "source_type": "web_search",
-                                    "url": result["url"],
-                                    "title": result.get("title", result["url"]),
-                                    "snippet": result.get("snippet", "")
-                                })
-                            except Exception as e:
-                                logger.warning(f"Failed to load {result['url']}: {str(e)}")
-                elif isinstance(search_results, str):
-                    documents.append(Document(page_content=search_results, metadata={"source": "web_search"}))
-                    
-                    metadata.append({
-                        "source_type": "web_search",
-                        "title": f"Search results for: {query}",
-                        "content": search_results[:200] + "..." if len(search_results) > 200 else search_results
-                    })
-        
-        except Exception as e:
-            logger.exception(f"Error retrieving web knowledge: {str(e)}")
-            documents.append(Document(
-                page_content=f"Error retrieving information for query: {query}",
-                metadata={"source": "error", "error": str(e)}
-            ))
-            metadata.append({
-                "source_type": "error",
-                "error": str(e)
-            })
-        
+                loaded[url] = result
+        return loaded
+
+    @staticmethod
+    def _error_result(query: str, error: Exception) -> Tuple[List[Document], List[Dict[str, Any]]]:
+        documents = [Document(
+            page_content=f"Error retrieving information for query: {query}",
+            metadata={"source": "error", "error": str(error)}
+        )]
+        metadata = [{
+            "source_type": "error",
+            "error": str(error)
+        }]
         return documents, metadata
 
 class KnowledgeBaseSource(KnowledgeSource):
     """Knowledge source that retrieves information from internal knowledge base"""
     
-    def __init__(self, knowledge_base: KnowledgeBase):
-        super().__init__(id="knowledge_base", name="Internal Knowledge Base")
+    def __init__(self, knowledge_base: KnowledgeBase, timeout: float = 5.0, k: int = 4):
+        super().__init__(id="knowledge_base", name="Internal Knowledge Base", timeout=timeout)
         self.knowledge_base = knowledge_base
+        self.k = k
     
     def retrieve_knowledge(
         self, 
         query: str, 
         image_url: Optional[str] = None,
-        filters: Optional[Dict[str, Any]] = None
+        filters: Optional[Dict[str, Any]] = None,
+        deadline: Optional[float] = None
     ) -> Tuple[List[Document], List[Dict[str, Any]]]:
+        """
+        Search each of the knowledge base's vector stores for `query`. Stores
+        are searched one after the other until the deadline, and whatever was
+        found by then is returned.
+        """
         documents = []
         metadata = []
         
         try:
-            # Query the knowledge base
-            kb_results = self.knowledge_base.query(query, filters=filters or {})
-            
-            for result in kb_results:
-                documents.append(Document(
-                    page_content=result.get("content", ""),
-                    metadata={
-                        "source": "knowledge_base",
+            for name, store in list(self.knowledge_base.vector_stores.items()):
+                if self.time_left(deadline) == 0:
+                    logger.info(f"Knowledge base search reached its deadline, returning {len(documents)} documents")
+                    break
+                # each store embeds the query with the model it was built with
+                for doc in store.similarity_search(query, k=self.k, filter=filters or None):
+                    result = doc.metadata
+                    documents.append(Document(
+                        page_content=doc.page_content,
+                        metadata={
+                            "source": "knowledge_base",
+                            "id": result.get("id", ""),
+                            "title": result.get("title", ""),
+                            "category": result.get("category", ""),
+                            "store": name
+                        }
+                    ))
+
+                    metadata.append({
+                        "source_type": "knowledge_base",
                         "id": result.get("id", ""),
                         "title": result.get("title", ""),
                         "category": result.get("category", "")
-                    }
-                ))
-                
-                metadata.append({
-                    "source_type": "knowledge_base",
-                    "id": result.get("id", ""),
-                    "title": result.get("title", ""),
-                    "category": result.get("category", "")
-                })
+                    })
                 
         except Exception as e:
             logger.exception(f"Error retrieving knowledge base data: {str(e)}")
@@ -1,64 +1,248 @@
+import os
 import re
+import html
 import logging
+import threading
 import unicodedata
-from typing import List
+import multiprocessing
+from collections import deque
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from bs4 import BeautifulSoup
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+from apps.core.metrics import count
+from apps.ecodome.generative_search.dedup import ChunkDeduplicator, SeenChunks
+
 logger = logging.getLogger(__name__)
 
 class DocumentProcessor:
     """Process and prepare documents for use in the search engine"""
     
-    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200, dedup_threshold: float = 0.8):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap
         )
+        self.cleaner = TextCleaner()
+        self.deduplicator = ChunkDeduplicator(threshold=dedup_threshold)
         
-    def process(self, documents: List[Document]) -> List[Document]:
-        """Process a list of documents"""
+    def process(self, documents: List[Document], deduplicate: bool = True) -> List[Document]:
+        """Process a list of documents, dropping exact and near-duplicate chunks unless `deduplicate` is False"""
         if not documents:
             return []
         
-        processed_docs = self.text_splitter.split_documents(documents)
-        for doc in processed_docs:
-            doc.page_content = self._clean_text(doc.page_content)
+        # clean whole documents once, rather than every (overlapping) chunk
+        cleaned_docs = [
+            Document(page_content=self._clean_text(doc.page_content), metadata=doc.metadata)
+            for doc in documents
+        ]
+        processed_docs = self.text_splitter.split_documents(cleaned_docs)
+
+        if deduplicate:
+            processed_docs = self.deduplicator.deduplicate(processed_docs)
             
         return processed_docs
     
     def _clean_text(self, text: str) -> str:
         """Clean and normalize text"""
-        # Normalize Unicode to canonical form (e.g., convert full-width to half-width characters)
-        text = unicodedata.normalize('NFKC', text)
-        # Remove HTML tags (useful for webpages)
-        text = self._strip_html(text)
-        # Remove URLs from the text
-        text = re.sub(r'http[s]?://\S+', '', text)
-        # Remove standalone page numbers or digits often found in PDFs
-        text = re.sub(r'(?m)^\s*\d+\s*$', '', text)
-        # Normalize quotes and dashes
-        text = text.replace("“", '"').replace("”", '"')
-        text = text.replace("‘", "'").replace("’", "'")
-        text = text.replace("–", "-").replace("—", "-")
-        # Remove boilerplate such as page footers (example pattern: "Page X of Y")
-        text = re.sub(r'Page \d+ of \d+', '', text, flags=re.IGNORECASE)
-         # Replace multiple newlines with a single newline
-        text = re.sub(r'\n+', '\n', text)
-        # Replace multiple spaces with a single space
-        text = re.sub(r'\s+', ' ', text)
-        # Final trim of leading/trailing whitespace
-        text = text.strip()
-        return text
-
-    def _strip_html(self, text: str) -> str:
-        if '<' in text and '>' in text:
+        return self.cleaner.clean(text)
+
+class TextCleaner:
+    """
+    Text cleaner for whole documents.
+
+    Normalizes Unicode (NFKC), strips HTML, drops URLs, standalone page numbers
+    and "Page X of Y" footers, normalizes quotes and dashes and collapses
+    spaces and runs of blank lines, keeping the line and paragraph breaks the
+    splitter chunks on. Patterns are precompiled and cheap guards skip passes
+    which can't match: ASCII text skips normalization and punctuation, text
+    without "://" skips the URL pass, and BeautifulSoup is only used for markup
+    with script or style blocks, so plain text never goes near a parser.
+    """
+
+    # anything that looks like a real tag, not just a stray "<" or ">"
+    TAG_RE = re.compile(r'<(?:[A-Za-z][^<>]*|/[A-Za-z][^<>]*|!--.*?--|![^<>]*)>', re.DOTALL)
+    # blocks whose text content isn't content
+    SCRIPT_RE = re.compile(r'<(?:script|style|noscript)\b', re.IGNORECASE)
+    URL_RE = re.compile(r'http[s]?://\S+')
+    # standalone page numbers often found in PDFs
+    PAGE_NUMBER_RE = re.compile(r'(?m)^\s*\d+\s*$')
+    PAGE_FOOTER_RE = re.compile(r'Page \d+ of \d+', re.IGNORECASE)
+    # whitespace other than line breaks, then the spaces left around line breaks, then blank lines beyond one
+    SPACE_RE = re.compile(r'[^\S\n]+')
+    LINE_EDGE_RE = re.compile(r' ?\n ?')
+    BLANK_LINES_RE = re.compile(r'\n{3,}')
+    # chained str.replace beats both str.translate and a regex with a lookup for these
+    PUNCTUATION = (("“", '"'), ("”", '"'), ("‘", "'"), ("’", "'"), ("–", "-"), ("—", "-"))
+
+    def clean(self, text: str) -> str:
+        # ASCII text is already NFKC-normalized
+        if not text.isascii():
+            text = unicodedata.normalize('NFKC', text)
+        text = self.strip_html(text)
+        if '://' in text:
+            text = self.URL_RE.sub('', text)
+        text = self.PAGE_NUMBER_RE.sub('', text)
+        text = self.PAGE_FOOTER_RE.sub('', text)
+        if not text.isascii():
+            for old, new in self.PUNCTUATION:
+                text = text.replace(old, new)
+        # collapse whitespace but keep paragraphs and lines apart, then trim
+        text = self.SPACE_RE.sub(' ', text)
+        text = self.LINE_EDGE_RE.sub('\n', text)
+        return self.BLANK_LINES_RE.sub('\n\n', text).strip()
+
+    def strip_html(self, text: str) -> str:
+        if '<' not in text or not self.TAG_RE.search(text):
+            return text
+        if self.SCRIPT_RE.search(text):
             soup = BeautifulSoup(text, 'html.parser')
-            return soup.get_text(separator=' ', strip=True)
-        return text
+            return soup.get_text(separator='\n', strip=True)
+        return html.unescape(self.TAG_RE.sub(' ', text))
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+# per-process state of the pipeline workers: cleaner, splitter and deduplicator per pipeline config
+_worker: Dict[Tuple, Tuple[TextCleaner, Any, ChunkDeduplicator]] = {}
+
+def _pipeline_stages(config: Tuple) -> Tuple[TextCleaner, Any, ChunkDeduplicator]:
+    stages = _worker.get(config)
+    if stages is None:
+        splitter_cls, splitter_items, threshold = config
+        stages = _worker[config] = (TextCleaner(), splitter_cls(**dict(splitter_items)), ChunkDeduplicator(threshold=threshold))
+    return stages
+
+def _clean_split_fingerprint(config: Tuple, documents: List[Document]) -> List[Tuple[Document, Any]]:
+    """Clean and split a batch of documents, fingerprinting every chunk for dedup"""
+    cleaner, splitter, deduplicator = _pipeline_stages(config)
+    cleaned_docs = [
+        Document(page_content=cleaner.clean(doc.page_content), metadata=doc.metadata)
+        for doc in documents
+    ]
+    return [(chunk, deduplicator.fingerprint(chunk.page_content)) for chunk in splitter.split_documents(cleaned_docs)]
+
+# worker pools shared by every pipeline in this process, by size: starting spawned workers costs seconds
+_pools: Dict[int, ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+def _shared_pool(max_workers: int) -> ProcessPoolExecutor:
+    with _pools_lock:
+        pool = _pools.get(max_workers)
+        if pool is None:
+            # spawn rather than fork: the callers run background threads
+            pool = _pools[max_workers] = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return pool
+
+def _discard_pool(max_workers: int, pool: ProcessPoolExecutor) -> None:
+    """Forget a pool whose workers died, so the next pipeline starts a new one"""
+    with _pools_lock:
+        if _pools.get(max_workers) is pool:
+            del _pools[max_workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+class StreamingDocumentPipeline:
+    """
+    Streaming load -> clean -> split -> dedup -> embed-batch pipeline for large ingests.
+
+    Documents are pulled lazily from any iterable and sent to a process pool in
+    batches of `docs_per_task`, where they are cleaned, split and fingerprinted.
+    Inputs of fewer than `min_parallel_docs` documents are handled in this
+    process instead, and the pool is shared by every pipeline and kept alive.
+    At most `max_pending` batches are in flight, and their chunks come back in
+    input order and are deduplicated in this process, so memory stays bounded by
+    the queue sizes (plus ~0.5 KB of dedup state per unique chunk) rather than
+    the size of the corpus. `iter_embedded` additionally embeds the chunks in
+    batches on a background thread while the next batch is being prepared.
+    """
+
+    def __init__(
+        self,
+        splitter_cls=RecursiveCharacterTextSplitter,
+        splitter_kwargs: Optional[Dict[str, Any]] = None,
+        dedup_threshold: float = 0.8,
+        max_workers: Optional[int] = None,
+        docs_per_task: int = 16,
+        max_pending: Optional[int] = None,
+        embedding_model=None,
+        embed_batch_size: int = 256,
+        min_parallel_docs: int = 64
+    ):
+        self.splitter_cls = splitter_cls
+        self.splitter_kwargs = splitter_kwargs or {"chunk_size": 1000, "chunk_overlap": 200}
+        self.deduplicator = ChunkDeduplicator(threshold=dedup_threshold)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.docs_per_task = docs_per_task
+        self.max_pending = max_pending or 2 * self.max_workers
+        self.embedding_model = embedding_model
+        self.embed_batch_size = embed_batch_size
+        self.min_parallel_docs = min_parallel_docs
+
+    def run(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """Yield the unique chunks of `documents` as they are produced"""
+        seen = SeenChunks(self.deduplicator)
+        produced = 0
+        for chunk, fingerprint in self._split(documents):
+            produced += 1
+            if seen.add(fingerprint):
+                yield chunk
+        count("chunks_deduplicated", produced - len(seen))
+        logger.info(f"Pipeline produced {produced} chunks, {len(seen)} unique")
+
+    def iter_embedded(self, documents: Iterable[Document]) -> Iterator[Tuple[List[Document], List[List[float]]]]:
+        """Yield `(chunks, embeddings)` batches; each batch is embedded while the next one is prepared"""
+        if self.embedding_model is None:
+            raise ValueError("iter_embedded needs an embedding_model")
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-embed") as embedder:
+            pending = None
+            for chunks in batched(self.run(documents), self.embed_batch_size):
+                count("embedding_calls")
+                future = embedder.submit(self.embedding_model.embed_documents, [chunk.page_content for chunk in chunks])
+                if pending is not None:
+                    yield pending[0], pending[1].result()
+                pending = (chunks, future)
+            if pending is not None:
+                yield pending[0], pending[1].result()
+
+    def _split(self, documents: Iterable[Document]) -> Iterator[Tuple[Document, Any]]:
+        config = (self.splitter_cls, tuple(sorted(self.splitter_kwargs.items())), self.deduplicator.threshold)
+        documents = iter(documents)
+        head = list(islice(documents, self.min_parallel_docs))
+
+        if self.max_workers <= 1 or len(head) < self.min_parallel_docs:
+            # too little work to be worth shipping to other processes
+            for batch in batched(chain(head, documents), self.docs_per_task):
+                yield from _clean_split_fingerprint(config, batch)
+            return
+
+        pool = _shared_pool(self.max_workers)
+        pending = deque()
+        try:
+            for batch in batched(chain(head, documents), self.docs_per_task):
+                pending.append(pool.submit(_clean_split_fingerprint, config, batch))
+                if len(pending) >= self.max_pending:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        except BrokenProcessPool:
+            _discard_pool(self.max_workers, pool)
+            raise
+        finally:
+            # the consumer may stop early; don't leave its batches queued on the shared pool
+            for future in pending:
+                future.cancel()
 
 class QueryProcessor:
     """Process and enhance search queries"""
@@ -0,0 +1,138 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from apps.core.metrics import count
+from apps.core.query_normalization import normalize_query
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticQueryCache:
+    """
+    Near-duplicate query cache.
+
+    Maps the embeddings of past queries to the cache keys of their results, so
+    a paraphrase of an earlier query can reuse its answer. Lookups are a
+    brute-force cosine nearest-neighbour search over a preallocated matrix of
+    normalized query embeddings; entries expire after `ttl` seconds and the
+    least recently used one is evicted when the cache is full. Query embeddings
+    are memoized by normalized query, so rephrasings that only differ in case,
+    punctuation or stop words are embedded once.
+    """
+
+    def __init__(self, embedding_model, threshold: float = 0.92, max_entries: int = 5000, ttl: int = 3600, max_embeddings: int = 1024):
+        self.embedding_model = embedding_model
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._vectors: Optional[np.ndarray] = None
+        self._expires_at = np.zeros(max_entries, dtype=np.float64)
+        self._keys: List[Optional[str]] = [None] * max_entries
+        # cache key -> slot, in least to most recently used order
+        self._slots: "OrderedDict[str, int]" = OrderedDict()
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+
+        self.max_embeddings = max_embeddings
+        self._embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+    def embed(self, query: str) -> np.ndarray:
+        key = normalize_query(query)
+        vector = self._memoized(key)
+        if vector is None:
+            count("embedding_calls")
+            vector = self._memoize(key, self.embedding_model.embed_query(query))
+        return vector
+
+    async def aembed(self, query: str) -> np.ndarray:
+        key = normalize_query(query)
+        vector = self._memoized(key)
+        if vector is None:
+            count("embedding_calls")
+            vector = self._memoize(key, await self.embedding_model.aembed_query(query))
+        return vector
+
+    def _memoized(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._embeddings.get(key)
+            if vector is not None:
+                self._embeddings.move_to_end(key)
+            return vector
+
+    def _memoize(self, key: str, embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        vector = vector / norm if norm else vector
+        with self._lock:
+            self._embeddings[key] = vector
+            if len(self._embeddings) > self.max_embeddings:
+                self._embeddings.popitem(last=False)
+        return vector
+
+    def lookup(self, query: str) -> Tuple[Optional[str], np.ndarray]:
+        """
+        Find the cache key of the most similar past query.
+
+        Returns the cache key (or None if nothing is similar enough) together with
+        the query embedding, so a miss can be added without embedding again.
+        """
+        return self._nearest(query, self.embed(query))
+
+    async def alookup(self, query: str) -> Tuple[Optional[str], np.ndarray]:
+        return self._nearest(query, await self.aembed(query))
+
+    def _nearest(self, query: str, vector: np.ndarray) -> Tuple[Optional[str], np.ndarray]:
+        with self._lock:
+            if self._vectors is None or not self._slots:
+                return None, vector
+
+            similarities = self._vectors @ vector
+            similarities[self._expires_at <= time.time()] = -1.0
+            slot = int(np.argmax(similarities))
+            if similarities[slot] < self.threshold:
+                return None, vector
+
+            cache_key = self._keys[slot]
+            self._slots.move_to_end(cache_key)
+            count("semantic_cache_hits")
+            logger.debug(f"Semantic cache hit for '{query}' (similarity {similarities[slot]:.3f})")
+            return cache_key, vector
+
+    def add(self, vector: np.ndarray, cache_key: str) -> None:
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+
+            if cache_key in self._slots:
+                slot = self._slots[cache_key]
+                self._slots.move_to_end(cache_key)
+            else:
+                if not self._free:
+                    self._release(next(iter(self._slots)))
+                slot = self._free.pop()
+                self._slots[cache_key] = slot
+                self._keys[slot] = cache_key
+
+            self._vectors[slot] = vector
+            self._expires_at[slot] = time.time() + self.ttl
+
+    def remove(self, cache_key: str) -> None:
+        with self._lock:
+            if cache_key in self._slots:
+                self._release(cache_key)
+
+    def _release(self, cache_key: str) -> None:
+        slot = self._slots.pop(cache_key)
+        self._keys[slot] = None
+        self._vectors[slot] = 0.0
+        self._expires_at[slot] = 0.0
+        self._free.append(slot)
+
+    def __len__(self) -> int:
+        return len(self._slots)
@@ -0,0 +1,8 @@
+from typing import Optional
+
+from apps.core.query_normalization import query_cache_key
+
+
+def get_cache_key(search_term: str, image_url: Optional[str] = None) -> str:
+    """Cache key for a search result, shared by every phrasing that normalizes to the same query"""
+    return query_cache_key(search_term, image_url)
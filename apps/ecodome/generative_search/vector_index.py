@@ -0,0 +1,164 @@
+import json
+import pickle
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores.faiss import FAISS
+
+from apps.ecodome.generative_search.embeddings import create_embeddings
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "hnsw", "ivfpq", "sq8", "fp16")
+CONFIG_FILE = "index_config.json"
+EMBEDDINGS_FILE = "embeddings.json"
+
+
+class VectorIndexConfig(NamedTuple):
+    """
+    FAISS index type and parameters for a vector store.
+
+    - flat: exact search over float32 vectors (the default, and the baseline)
+    - hnsw: HNSW graph over float32 vectors; fast, but uses more memory than flat
+    - ivfpq: inverted lists with product-quantized codes; needs training and
+      is by far the smallest (`pq_m` bytes per vector with 8-bit codes)
+    - sq8 / fp16: scalar-quantized vectors, 1/4 and 1/2 the size of flat
+
+    `nlist` defaults to ~4 * sqrt(n) inverted lists.
+    """
+    index_type: str = "flat"
+    hnsw_m: int = 32
+    ef_construction: int = 200
+    ef_search: int = 64
+    nlist: Optional[int] = None
+    nprobe: int = 16
+    pq_m: int = 64
+    pq_bits: int = 8
+
+    @classmethod
+    def from_dict(cls, values: Dict[str, Any]) -> "VectorIndexConfig":
+        return cls(**{key: value for key, value in values.items() if key in cls._fields})
+
+
+def _pq_subquantizers(dim: int, wanted: int) -> int:
+    """Largest number of sub-quantizers <= `wanted` that divides `dim`"""
+    return max(m for m in range(1, min(wanted, dim) + 1) if dim % m == 0)
+
+
+def build_index(vectors: np.ndarray, config: VectorIndexConfig) -> faiss.Index:
+    """Create, train and fill a FAISS index of `config.index_type` over float32 `vectors`"""
+    if config.index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {config.index_type!r}, expected one of {INDEX_TYPES}")
+
+    count, dim = vectors.shape
+    index_type = config.index_type
+    nlist = config.nlist or max(1, min(int(4 * np.sqrt(count)), count // 39))
+    if index_type == "ivfpq" and count < max(2 ** config.pq_bits, nlist):
+        logger.warning(f"Only {count} vectors, too few to train IVF-PQ; using a flat index")
+        index_type = "flat"
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, config.hnsw_m)
+        index.hnsw.efConstruction = config.ef_construction
+    elif index_type == "ivfpq":
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_subquantizers(dim, config.pq_m), config.pq_bits)
+    else:
+        kind = faiss.ScalarQuantizer.QT_8bit if index_type == "sq8" else faiss.ScalarQuantizer.QT_fp16
+        index = faiss.IndexScalarQuantizer(dim, kind)
+
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    apply_search_params(index, config)
+    return index
+
+
+def apply_search_params(index: faiss.Index, config: VectorIndexConfig) -> None:
+    """Set the query-time knobs (HNSW efSearch, IVF nprobe), which aren't always persisted"""
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = config.ef_search
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(config.nprobe, ivf.nlist)
+
+
+def build_vectorstore(
+    batches: Iterable[Tuple[List[Document], List[List[float]]]],
+    embedding_model,
+    config: VectorIndexConfig = VectorIndexConfig()
+) -> Optional[FAISS]:
+    """
+    Build a langchain FAISS store from `(documents, embeddings)` batches with the configured index.
+
+    Quantized and IVF indexes must be trained on the data before anything is
+    added, so the embeddings are gathered first (as one float32 array, not
+    Python lists) and the index is built in one go.
+    """
+    docs: List[Document] = []
+    parts: List[np.ndarray] = []
+    for batch_docs, embeddings in batches:
+        docs.extend(batch_docs)
+        parts.append(np.asarray(embeddings, dtype=np.float32))
+    if not docs:
+        return None
+
+    index = build_index(np.concatenate(parts), config)
+    ids = [str(position) for position in range(len(docs))]
+    return FAISS(
+        embedding_model,
+        index,
+        InMemoryDocstore(dict(zip(ids, docs))),
+        dict(enumerate(ids)),
+    )
+
+
+def save_vectorstore(store: FAISS, folder_path: Path, config: VectorIndexConfig) -> None:
+    """Save the store with its index config and, for local embedding backends, the backend that embedded it"""
+    folder_path = Path(folder_path)
+    store.save_local(str(folder_path))
+    (folder_path / CONFIG_FILE).write_text(json.dumps(config._asdict()))
+    if hasattr(store.embedding_function, "spec"):
+        (folder_path / EMBEDDINGS_FILE).write_text(json.dumps(store.embedding_function.spec()))
+    else:
+        # a backend left by an earlier save of this folder would be used to query the new vectors
+        (folder_path / EMBEDDINGS_FILE).unlink(missing_ok=True)
+
+
+def load_vectorstore(folder_path: Path, embedding_model, mmap: bool = False) -> FAISS:
+    """
+    Load a store saved by `save_vectorstore` (or `FAISS.save_local`) and apply its search parameters.
+
+    With `mmap`, the index file is memory-mapped instead of read into every
+    worker's heap, so workers on one host share it through the page cache.
+    A store embedded by a local backend is queried with that backend rather
+    than `embedding_model`, since vectors from different models don't mix.
+    """
+    folder_path = Path(folder_path)
+    embeddings_path = folder_path / EMBEDDINGS_FILE
+    if embeddings_path.exists():
+        embedding_model = create_embeddings(**json.loads(embeddings_path.read_text()))
+    config_path = folder_path / CONFIG_FILE
+    config = VectorIndexConfig.from_dict(json.loads(config_path.read_text())) if config_path.exists() else VectorIndexConfig()
+
+    index_path = str(folder_path / "index.faiss")
+    index = None
+    if mmap:
+        try:
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+        except RuntimeError as e:
+            logger.warning(f"Could not memory-map {index_path}, reading it instead: {e}")
+    if index is None:
+        index = faiss.read_index(index_path)
+    apply_search_params(index, config)
+
+    with open(folder_path / "index.pkl", "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embedding_model, index, docstore, index_to_docstore_id)
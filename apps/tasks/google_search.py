@@ -4,6 +4,11 @@ from serpapi import GoogleSearch
 from langchain_community.utilities.google_search import GoogleSearchAPIWrapper
 
 from apps.core.cache.redis_cache import redis_cache
+from apps.core.query_normalization import normalize_query
+from apps.core.resilience import resilience
+
+# seconds before a search API call is abandoned
+SEARCH_TIMEOUT = 15.0
 
 @redis_cache(ttl=3600)
 def async_google_image_search(image_url):
@@ -15,7 +20,7 @@ def async_google_image_search(image_url):
             'hl': 'en',
         }
         search = GoogleSearch(params)
-        response = search.json()
+        response = resilience.call("serpapi.com", search.json, timeout=SEARCH_TIMEOUT)
         if response["search_metadata"]["status"] != "Success":
             logging.error(f"Google Lens search for {image_url} failed")
 
@@ -40,11 +45,11 @@ def async_google_image_search(image_url):
         logging.error(f"Error in async_google_image_search: {ex}")
         return None
     
-@redis_cache(ttl=3600)
+@redis_cache(ttl=3600, key_normalizers={"query": normalize_query})
 def async_product_google_search(query, num_results=5):
     try:
         search = GoogleSearchAPIWrapper(k=num_results)
-        return search.run(query=query)
+        return resilience.call("www.googleapis.com", search.run, query=query, timeout=SEARCH_TIMEOUT)
     except Exception as ex:
         logging.error(f"Error in async_product_google_search : {ex}")
         return None
\ No newline at end of file
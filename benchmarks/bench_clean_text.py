@@ -0,0 +1,97 @@
+"""
+Micro-benchmark of TextCleaner against the previous per-chunk _clean_text.
+
+    python -m benchmarks.bench_clean_text [--docs 200] [--repeat 5]
+
+Both are run over the same synthetic corpus of plain, PDF-like and HTML
+documents. The old implementation is timed the way it used to run (on every
+chunk after splitting) and as a plain per-document pass, so the gain from the
+compiled cleaner and from cleaning before splitting can be told apart.
+"""
+import re
+import random
+import argparse
+import unicodedata
+from timeit import repeat
+
+from bs4 import BeautifulSoup
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from apps.ecodome.generative_search.processors import TextCleaner
+
+
+def legacy_clean_text(text: str) -> str:
+    text = unicodedata.normalize('NFKC', text)
+    if '<' in text and '>' in text:
+        text = BeautifulSoup(text, 'html.parser').get_text(separator=' ', strip=True)
+    text = re.sub(r'http[s]?://\S+', '', text)
+    text = re.sub(r'(?m)^\s*\d+\s*$', '', text)
+    text = text.replace("“", '"').replace("”", '"')
+    text = text.replace("‘", "'").replace("’", "'")
+    text = text.replace("–", "-").replace("—", "-")
+    text = re.sub(r'Page \d+ of \d+', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'\n+', '\n', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+
+WORDS = (
+    "bamboo recycled organic cotton packaging carbon footprint emissions supply chain biodegradable "
+    "compostable certified product material water energy renewable “eco” ‘green’ – — sustainable"
+).split()
+
+
+def make_corpus(n_docs: int, seed: int = 7):
+    rng = random.Random(seed)
+
+    def paragraph():
+        return " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 120)))
+
+    corpus = []
+    for i in range(n_docs):
+        kind = i % 3
+        paragraphs = [paragraph() for _ in range(rng.randint(5, 20))]
+        if kind == 0:
+            text = "\n\n".join(paragraphs)
+        elif kind == 1:
+            text = "\n".join(f"{p}\nhttps://example.com/{i}\n{n}\nPage {n} of 20" for n, p in enumerate(paragraphs))
+        else:
+            text = "<html><body>" + "".join(f"<p class='c'>{p} &amp; more</p>" for p in paragraphs) + "</body></html>"
+        corpus.append(text)
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.docs)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    chunks = [chunk for text in corpus for chunk in splitter.split_text(text)]
+    cleaner = TextCleaner()
+
+    cases = {
+        "legacy, per chunk": lambda: [legacy_clean_text(chunk) for chunk in chunks],
+        "legacy, per document": lambda: [legacy_clean_text(text) for text in corpus],
+        "TextCleaner, per document": lambda: [cleaner.clean(text) for text in corpus],
+    }
+
+    size_mb = sum(len(text) for text in corpus) / 1e6
+    print(f"{len(corpus)} documents ({size_mb:.1f} MB), {len(chunks)} chunks, best of {args.repeat}")
+    baseline = None
+    for name, func in cases.items():
+        best = min(repeat(func, number=1, repeat=args.repeat))
+        baseline = baseline or best
+        print(f"  {name:<28} {best * 1000:9.1f} ms  {size_mb / best:7.1f} MB/s  {baseline / best:5.1f}x")
+
+    plain = [text for i, text in enumerate(corpus) if i % 3 != 2]
+    mismatches = sum(legacy_clean_text(text) != cleaner.clean(text) for text in plain)
+    print(f"  output differs from legacy on {mismatches}/{len(plain)} non-HTML documents")
+
+
+if __name__ == "__main__":
+    main()
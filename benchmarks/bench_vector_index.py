@@ -0,0 +1,84 @@
+"""
+Recall/latency/memory benchmark of the vector index types against the flat baseline.
+
+    python -m benchmarks.bench_vector_index [--vectors 200000] [--dim 768] [--queries 500]
+
+Vectors are synthetic and clustered (a mixture of Gaussians, roughly like
+text embeddings); recall@k is measured against exact flat search. Pass
+`--embeddings file.npy` to benchmark real embeddings instead.
+"""
+import time
+import argparse
+
+import faiss
+import numpy as np
+
+from apps.ecodome.generative_search.vector_index import VectorIndexConfig, build_index
+
+CONFIGS = {
+    "flat": VectorIndexConfig("flat"),
+    "hnsw": VectorIndexConfig("hnsw"),
+    "ivfpq": VectorIndexConfig("ivfpq"),
+    "ivfpq nprobe=64": VectorIndexConfig("ivfpq", nprobe=64),
+    "sq8": VectorIndexConfig("sq8"),
+    "fp16": VectorIndexConfig("fp16"),
+}
+
+
+def make_vectors(count: int, dim: int, clusters: int = 256, seed: int = 7) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(clusters, size=count)] + 0.5 * rng.normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--embeddings", help=".npy file of real embeddings to use instead of synthetic ones")
+    parser.add_argument("--only", nargs="*", choices=list(CONFIGS), help="index configurations to run")
+    args = parser.parse_args()
+
+    if args.embeddings:
+        vectors = np.load(args.embeddings).astype(np.float32)
+    else:
+        vectors = make_vectors(args.vectors + args.queries, args.dim)
+    queries, vectors = vectors[:args.queries], vectors[args.queries:]
+    threads = faiss.omp_get_max_threads()
+
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, {len(queries)} queries, recall@{args.k}")
+    print(f"  {'index':<18} {'build s':>8} {'size MB':>8} {'recall':>7} {'p50 ms':>7} {'p99 ms':>7}")
+
+    truth = None
+    for name, config in CONFIGS.items():
+        if args.only and name not in args.only and name != "flat":
+            continue
+        faiss.omp_set_num_threads(threads)
+        start = time.perf_counter()
+        index = build_index(vectors, config)
+        build_seconds = time.perf_counter() - start
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+
+        # one query at a time on one thread, as the search path issues them
+        faiss.omp_set_num_threads(1)
+        latencies = []
+        results = []
+        for query in queries:
+            start = time.perf_counter()
+            _, ids = index.search(query[None, :], args.k)
+            latencies.append(time.perf_counter() - start)
+            results.append(ids[0])
+        results = np.array(results)
+
+        if truth is None:
+            truth = results
+        recall = np.mean([len(set(found) & set(expected)) / args.k for found, expected in zip(results, truth)])
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        print(f"  {name:<18} {build_seconds:8.1f} {size_mb:8.1f} {recall:7.3f} {p50:7.2f} {p99:7.2f}")
+
+
+if __name__ == "__main__":
+    main()
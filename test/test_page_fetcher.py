@@ -0,0 +1,87 @@
+import time
+import socket
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from apps.core.cache.page_cache import PageCache
+from apps.core.resilience import OPEN, Resilience
+from apps.ecodome.generative_search.fetcher import FetchError, PageFetcher
+
+
+class HangingServer:
+    """Accepts connections and never answers, like a host that hangs"""
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(16)
+        self.connections = []
+        self.thread = threading.Thread(target=self._accept, daemon=True)
+        self.thread.start()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.sock.getsockname()[1]}"
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections.append(connection)
+
+    def close(self):
+        self.sock.close()
+        for connection in self.connections:
+            connection.close()
+
+
+class SlowLookupCache(PageCache):
+    """A page cache whose lookups take a while, like waiting for a slot would"""
+
+    def lookup(self, url):
+        time.sleep(0.05)
+        return super().lookup(url)
+
+
+class HangingHostTest(unittest.TestCase):
+    def setUp(self):
+        self.server = HangingServer()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.resilience = Resilience(failure_threshold=3, reset_timeout=60)
+        self.fetcher = PageFetcher(timeout=0.2, cache=SlowLookupCache(Path(self.cache_dir.name)), resilience=self.resilience)
+
+    def tearDown(self):
+        self.fetcher.close()
+        self.cache_dir.cleanup()
+        self.resilience.close()
+        self.server.close()
+
+    def breaker(self):
+        return self.resilience.domain(self.server.base_url.split("//")[1]).breaker
+
+    def test_consecutive_hanging_fetches_open_the_breaker(self):
+        for i in range(3):
+            with self.assertRaises(FetchError):
+                self.fetcher.fetch(f"{self.server.base_url}/page{i}")
+        self.assertEqual(self.breaker().state, OPEN)
+
+        # once open, fetches to the host fail fast
+        start = time.monotonic()
+        with self.assertRaises(FetchError):
+            self.fetcher.fetch(f"{self.server.base_url}/page3")
+        self.assertLess(time.monotonic() - start, 0.1)
+
+    def test_caller_deadline_is_not_held_against_the_host(self):
+        for i in range(5):
+            with self.assertRaises(FetchError):
+                self.fetcher.fetch(f"{self.server.base_url}/page{i}", deadline=time.monotonic() + 0.05)
+        self.assertNotEqual(self.breaker().state, OPEN)
+        self.assertEqual(self.breaker().failures, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import time
+import threading
+import unittest
+
+from apps.core.metrics import MetricsRegistry
+from apps.core.resilience import Resilience
+
+
+class LimiterSlotTest(unittest.TestCase):
+    def setUp(self):
+        self.resilience = Resilience(registry=MetricsRegistry())
+
+    def tearDown(self):
+        self.resilience.close()
+
+    def test_abandoned_attempt_keeps_its_slot_until_it_ends(self):
+        release = threading.Event()
+        with self.assertRaises(TimeoutError):
+            self.resilience.call("slow.example", release.wait, 5, timeout=0.05)
+
+        limiter = self.resilience.domain("slow.example").limiter
+        # the call gave up, but its attempt is still running against the host
+        self.assertEqual(limiter.in_flight, 1)
+        release.set()
+        for _ in range(100):
+            if limiter.in_flight == 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_finished_call_frees_its_slot_at_once(self):
+        self.assertEqual(self.resilience.call("fast.example", lambda: 42), 42)
+        self.assertEqual(self.resilience.domain("fast.example").limiter.in_flight, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()